@@ -0,0 +1,176 @@
+import sys
+import time
+from datetime import date, timedelta
+
+import numpy as np
+
+EPOCH = date(1970, 1, 1)
+
+
+def to_day_numbers(values):
+    return np.array(list(values), dtype='datetime64[D]').astype(np.int64)
+
+
+def day_number(value):
+    return (value - EPOCH).days
+
+
+def encode_labels(values):
+    labels, codes = np.unique(np.array(list(values), dtype=object).astype(str), return_inverse=True)
+    return codes.astype(np.int64), labels.tolist()
+
+
+class OrderFrame:
+    def __init__(self, days, user_ids, dish_ids, prices, calories, category_codes, category_labels):
+        self.days = days
+        self.user_ids = user_ids
+        self.dish_ids = dish_ids
+        self.prices = prices
+        self.calories = calories
+        self.category_codes = category_codes
+        self.category_labels = category_labels
+
+    def __len__(self):
+        return len(self.days)
+
+    @classmethod
+    def from_rows(cls, rows):
+        rows = list(rows)
+        if not rows:
+            empty_int = np.zeros(0, dtype=np.int64)
+            return cls(empty_int, empty_int, empty_int, np.zeros(0), np.zeros(0), empty_int, [])
+        created, user_ids, dish_ids, prices, calories, categories = zip(*rows)
+        category_codes, category_labels = encode_labels(categories)
+        return cls(
+            to_day_numbers(created),
+            np.array(user_ids, dtype=np.int64),
+            np.array(dish_ids, dtype=np.int64),
+            np.array(prices, dtype=np.float64),
+            np.array(calories, dtype=np.float64),
+            category_codes,
+            category_labels,
+        )
+
+
+def bucket_sums(days, values, start_day, n_days):
+    offsets = np.asarray(days, dtype=np.int64) - start_day
+    mask = (offsets >= 0) & (offsets < n_days)
+    return np.bincount(offsets[mask], weights=np.asarray(values, dtype=np.float64)[mask], minlength=n_days)
+
+
+def moving_average(values, window):
+    values = np.asarray(values, dtype=np.float64)
+    if not len(values):
+        return values
+    window = max(1, int(window))
+    cumulative = np.cumsum(np.insert(values, 0, 0.0))
+    upper = np.arange(1, len(values) + 1)
+    lower = np.maximum(upper - window, 0)
+    return (cumulative[upper] - cumulative[lower]) / (upper - lower)
+
+
+def group_sums(codes, values, n_groups=None):
+    codes = np.asarray(codes, dtype=np.int64)
+    if n_groups is None:
+        n_groups = int(codes.max()) + 1 if len(codes) else 0
+    return np.bincount(codes, weights=np.asarray(values, dtype=np.float64), minlength=n_groups)
+
+
+def rank_totals(keys, counts, sums, limit=None):
+    keys = np.asarray(keys, dtype=np.int64)
+    counts = np.asarray(counts, dtype=np.int64)
+    sums = np.asarray(sums, dtype=np.float64)
+    order = np.lexsort((keys, -counts))[:limit]
+    return keys[order].tolist(), counts[order].tolist(), sums[order].tolist()
+
+
+def top_keys(keys, limit, weights=None):
+    keys = np.asarray(keys, dtype=np.int64)
+    if not len(keys):
+        return [], [], []
+    if keys.min() >= 0 and keys.max() <= max(len(keys), 1 << 16):
+        all_counts = np.bincount(keys)
+        unique_keys = np.flatnonzero(all_counts)
+        counts = all_counts[unique_keys]
+        sums = np.bincount(keys, weights=weights)[unique_keys] if weights is not None else counts.astype(np.float64)
+    else:
+        unique_keys, inverse, counts = np.unique(keys, return_inverse=True, return_counts=True)
+        sums = np.bincount(inverse, weights=weights) if weights is not None else counts.astype(np.float64)
+    return rank_totals(unique_keys, counts, sums, limit)
+
+
+def daily_series(days, values, end_date, n_days=30, window=7):
+    start_date = end_date - timedelta(days=n_days - 1)
+    sums = bucket_sums(days, np.maximum(np.asarray(values, dtype=np.float64), 0), day_number(start_date), n_days)
+    return {
+        'labels': [(start_date + timedelta(days=step)).strftime('%d.%m') for step in range(n_days)],
+        'values': np.rint(sums).astype(np.int64).tolist(),
+        'moving_average': np.round(moving_average(sums, window), 1).tolist(),
+    }
+
+
+def category_totals(category_codes, category_labels, values):
+    sums = group_sums(category_codes, values, len(category_labels))
+    order = np.argsort(-sums, kind='stable')
+    return [category_labels[idx] for idx in order], np.rint(sums[order]).astype(np.int64).tolist()
+
+
+def category_totals_from_pairs(categories, values):
+    category_codes, category_labels = encode_labels(categories)
+    return category_totals(category_codes, category_labels, values)
+
+
+def make_synthetic_frame(n_orders, n_days=365, n_users=5000, n_dishes=200, n_categories=6, seed=7):
+    rng = np.random.default_rng(seed)
+    end_day = day_number(date.today())
+    return OrderFrame(
+        end_day - rng.integers(0, n_days, n_orders),
+        rng.integers(1, n_users + 1, n_orders),
+        rng.zipf(1.6, n_orders) % n_dishes + 1,
+        rng.integers(60, 400, n_orders).astype(np.float64),
+        rng.integers(150, 900, n_orders).astype(np.float64),
+        rng.integers(0, n_categories, n_orders),
+        [f'category_{idx}' for idx in range(n_categories)],
+    )
+
+
+def run_benchmark(n_orders=1_000_000, repeat=3):
+    frame = make_synthetic_frame(n_orders)
+    today = date.today()
+    results = {}
+
+    def timed(name, func):
+        best = None
+        for _ in range(repeat):
+            started = time.perf_counter()
+            func()
+            elapsed = time.perf_counter() - started
+            best = elapsed if best is None else min(best, elapsed)
+        results[name] = best
+
+    timed('daily_series_30d', lambda: daily_series(frame.days, frame.prices, today, 30))
+    timed('daily_series_365d', lambda: daily_series(frame.days, frame.prices, today, 365))
+    timed('top_dishes', lambda: top_keys(frame.dish_ids, 15, frame.prices))
+    timed('category_totals', lambda: category_totals(frame.category_codes, frame.category_labels, frame.prices))
+    timed('spending_per_user', lambda: group_sums(frame.user_ids, frame.prices))
+
+    days_list = frame.days.tolist()
+    prices_list = frame.prices.tolist()
+    start_day = day_number(today) - 29
+
+    def python_daily_loop():
+        buckets = [0.0] * 30
+        for day, price in zip(days_list, prices_list):
+            offset = day - start_day
+            if 0 <= offset < 30:
+                buckets[offset] += max(price, 0)
+        return buckets
+
+    timed('python_loop_daily_30d', python_daily_loop)
+    return results
+
+
+if __name__ == '__main__':
+    size = int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000
+    for name, seconds in run_benchmark(size).items():
+        print(f'{name:<24} {seconds * 1000:9.2f} ms')
@@ -0,0 +1,199 @@
+import gzip
+import hashlib
+import json
+import os
+import re
+import sys
+import time
+from pathlib import Path
+from threading import Lock
+
+BUNDLES = {
+    'app.css': [
+        'style.css',
+        'css/buttons.css',
+        'css/layout.css',
+        'css/forms.css',
+        'css/profile-components.css',
+        'css/ui-components.css',
+        'theme.css',
+    ],
+    'admin.css': ['admin.css'],
+    'app.js': ['js/script.js', 'js/theme.js'],
+    'user.js': ['js/panel.js', 'js/avatar.js'],
+    'profile.js': ['js/profile.js'],
+    'admin.js': ['js/admin.js'],
+}
+
+CSS_COMMENT_RE = re.compile(r'/\*.*?\*/', re.S)
+CSS_SPACE_RE = re.compile(r'\s+')
+CSS_PUNCT_RE = re.compile(r'\s*([{};,])\s*')
+
+
+def minify_css(source):
+    source = CSS_COMMENT_RE.sub('', source)
+    source = CSS_SPACE_RE.sub(' ', source)
+    source = CSS_PUNCT_RE.sub(r'\1', source)
+    return source.replace(';}', '}').strip()
+
+
+def minify_js(source):
+    try:
+        import rjsmin
+        return rjsmin.jsmin(source)
+    except ImportError:
+        pass
+    lines = source.splitlines()
+    if any(line.count('`') % 2 for line in lines):
+        return source
+    return '\n'.join(line.strip() for line in lines if line.strip())
+
+
+class AssetPipeline:
+    def __init__(self, static_dir, bundles=None, output_subdir='dist', url_prefix='/assets', keep_days=7):
+        self.static_dir = Path(static_dir)
+        self.bundles = dict(bundles or BUNDLES)
+        self.output_dir = self.static_dir / output_subdir
+        self.url_prefix = url_prefix.rstrip('/')
+        self.keep_seconds = max(0, keep_days) * 86400
+        self.manifest = {}
+        self._lock = Lock()
+
+    @property
+    def manifest_path(self):
+        return self.output_dir / 'manifest.json'
+
+    def _read_sources(self, sources):
+        parts = []
+        for rel_path in sources:
+            path = self.static_dir / rel_path
+            try:
+                parts.append(path.read_text(encoding='utf-8-sig'))
+            except OSError:
+                continue
+        return parts
+
+    @staticmethod
+    def _write_atomic(path, data):
+        tmp_path = path.with_name(f'{path.name}.{os.getpid()}.tmp')
+        tmp_path.write_bytes(data)
+        os.replace(tmp_path, path)
+
+    def _write_variants(self, path, data):
+        if not path.exists():
+            self._write_atomic(path, data)
+        gz_path = path.with_name(path.name + '.gz')
+        if not gz_path.exists():
+            self._write_atomic(gz_path, gzip.compress(data, compresslevel=9, mtime=0))
+        br_path = path.with_name(path.name + '.br')
+        if not br_path.exists():
+            try:
+                import brotli
+            except ImportError:
+                return
+            self._write_atomic(br_path, brotli.compress(data, quality=11))
+
+    def build(self):
+        self.output_dir.mkdir(parents=True, exist_ok=True)
+        manifest = {}
+        keep = {'manifest.json'}
+        for name, sources in self.bundles.items():
+            parts = self._read_sources(sources)
+            if not parts:
+                continue
+            stem, ext = name.rsplit('.', 1)
+            if ext == 'css':
+                content = '\n'.join(minify_css(part) for part in parts)
+            else:
+                content = ';\n'.join(minify_js(part).rstrip().rstrip(';') for part in parts) + ';\n'
+            data = content.encode('utf-8')
+            digest = hashlib.sha256(data).hexdigest()[:12]
+            filename = f'{stem}.{digest}.{ext}'
+            self._write_variants(self.output_dir / filename, data)
+            manifest[name] = filename
+            keep.update({filename, f'{filename}.gz', f'{filename}.br'})
+
+        self._write_atomic(self.manifest_path, json.dumps(manifest, indent=2, sort_keys=True).encode('utf-8'))
+        expire_before = time.time() - self.keep_seconds
+        for path in self.output_dir.iterdir():
+            if not path.is_file() or path.name in keep or path.name.endswith('.tmp'):
+                continue
+            try:
+                if path.stat().st_mtime < expire_before:
+                    path.unlink()
+            except OSError:
+                pass
+        with self._lock:
+            self.manifest = manifest
+        return manifest
+
+    def precompress_static(self, suffixes=('.css', '.js', '.svg')):
+        written = 0
+        for path in self.static_dir.rglob('*'):
+            if not path.is_file() or path.suffix not in suffixes or self.output_dir in path.parents:
+                continue
+            source_mtime = path.stat().st_mtime
+            data = None
+            for suffix in ('.gz', '.br'):
+                variant = path.with_name(path.name + suffix)
+                if variant.is_file() and variant.stat().st_mtime >= source_mtime:
+                    continue
+                if data is None:
+                    data = path.read_bytes()
+                if suffix == '.gz':
+                    self._write_atomic(variant, gzip.compress(data, compresslevel=9, mtime=0))
+                else:
+                    try:
+                        import brotli
+                    except ImportError:
+                        continue
+                    self._write_atomic(variant, brotli.compress(data, quality=11))
+                written += 1
+        return written
+
+    def resolve_static(self, filename, accepted_encodings=()):
+        path = (self.static_dir / filename).resolve()
+        if self.static_dir.resolve() not in path.parents or not path.is_file():
+            return None, None
+        for encoding, suffix in (('br', '.br'), ('gzip', '.gz')):
+            variant = path.with_name(path.name + suffix)
+            if encoding in accepted_encodings and variant.is_file() and variant.stat().st_mtime >= path.stat().st_mtime:
+                return variant, encoding
+        return None, None
+
+    def load(self):
+        try:
+            manifest = json.loads(self.manifest_path.read_text(encoding='utf-8'))
+        except (OSError, ValueError):
+            manifest = {}
+        with self._lock:
+            self.manifest = manifest
+        return manifest
+
+    def urls(self, name, fallback_rev=None):
+        with self._lock:
+            filename = self.manifest.get(name)
+        if filename:
+            return [f'{self.url_prefix}/{filename}']
+        suffix = f'?v={fallback_rev}' if fallback_rev is not None else ''
+        return [f'/static/{rel_path}{suffix}' for rel_path in self.bundles.get(name, [])]
+
+    def resolve(self, filename, accepted_encodings=()):
+        if '/' in filename or '\\' in filename or filename.startswith('.') or filename == 'manifest.json':
+            return None, None
+        path = self.output_dir / filename
+        if not path.is_file():
+            return None, None
+        for encoding, suffix in (('br', '.br'), ('gzip', '.gz')):
+            variant = path.with_name(path.name + suffix)
+            if encoding in accepted_encodings and variant.is_file():
+                return variant, encoding
+        return path, None
+
+
+if __name__ == '__main__':
+    static_dir = Path(sys.argv[1]) if len(sys.argv) > 1 else Path(__file__).resolve().parent / 'static'
+    pipeline = AssetPipeline(static_dir)
+    for bundle, output in pipeline.build().items():
+        print(f'{bundle:<12} {output}')
+    print(f'precompressed {pipeline.precompress_static()} static variants')
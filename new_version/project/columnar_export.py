@@ -0,0 +1,155 @@
+import json
+import os
+from datetime import date, datetime
+from pathlib import Path
+
+from sqlalchemy import func, select
+
+
+class ColumnarExporter:
+    FORMATS = {'parquet': 'parquet', 'arrow': 'arrow'}
+
+    def __init__(self, db, export_dir, partitioned_models=None, snapshot_models=None, batch_size=10000,
+                 refresh_months=2):
+        self.db = db
+        self.export_dir = Path(export_dir)
+        self.partitioned_models = list(partitioned_models or [])
+        self.snapshot_models = list(snapshot_models or [])
+        self.batch_size = max(100, int(batch_size))
+        self.refresh_months = max(1, int(refresh_months))
+
+    @staticmethod
+    def _load_pyarrow():
+        import pyarrow
+        import pyarrow.ipc
+        import pyarrow.parquet
+        return pyarrow
+
+    @staticmethod
+    def _arrow_type(pa, column_type):
+        try:
+            python_type = column_type.python_type
+        except NotImplementedError:
+            return pa.string()
+        if python_type is bool:
+            return pa.bool_()
+        if python_type is int:
+            return pa.int64()
+        if python_type is float:
+            return pa.float64()
+        if python_type is datetime:
+            return pa.timestamp('us')
+        if python_type is date:
+            return pa.date32()
+        return pa.string()
+
+    def _schema(self, pa, model):
+        return pa.schema([
+            pa.field(column.name, self._arrow_type(pa, column.type)) for column in model.__table__.columns
+        ])
+
+    @staticmethod
+    def _month_start(value):
+        return datetime(value.year, value.month, 1)
+
+    @staticmethod
+    def _next_month(value):
+        return datetime(value.year + 1, 1, 1) if value.month == 12 else datetime(value.year, value.month + 1, 1)
+
+    @staticmethod
+    def _previous_month(value):
+        return datetime(value.year - 1, 12, 1) if value.month == 1 else datetime(value.year, value.month - 1, 1)
+
+    def _open_writer(self, pa, path, schema, fmt):
+        if fmt == 'arrow':
+            return pa.ipc.new_file(str(path), schema)
+        return pa.parquet.ParquetWriter(str(path), schema, compression='zstd')
+
+    def _write(self, pa, model, path, fmt, filters=()):
+        schema = self._schema(pa, model)
+        columns = list(model.__table__.columns)
+        statement = select(*columns).where(*filters).order_by(model.__table__.primary_key.columns.values()[0])
+        result = self.db.session.execute(statement.execution_options(stream_results=True, yield_per=self.batch_size))
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = path.with_name(f'{path.name}.{os.getpid()}.tmp')
+        rows_written = 0
+        writer = None
+        try:
+            while True:
+                rows = result.fetchmany(self.batch_size)
+                if not rows:
+                    break
+                if writer is None:
+                    writer = self._open_writer(pa, tmp_path, schema, fmt)
+                data = {column.name: [row[idx] for row in rows] for idx, column in enumerate(columns)}
+                writer.write_batch(pa.RecordBatch.from_pydict(data, schema=schema))
+                rows_written += len(rows)
+        finally:
+            result.close()
+            if writer is not None:
+                writer.close()
+        if writer is None:
+            return 0
+        os.replace(tmp_path, path)
+        return rows_written
+
+    def _load_manifest(self):
+        try:
+            return json.loads((self.export_dir / '_manifest.json').read_text(encoding='utf-8'))
+        except (OSError, ValueError):
+            return {}
+
+    def _save_manifest(self, manifest):
+        self.export_dir.mkdir(parents=True, exist_ok=True)
+        path = self.export_dir / '_manifest.json'
+        tmp_path = path.with_name(f'_manifest.json.{os.getpid()}.tmp')
+        tmp_path.write_text(json.dumps(manifest, ensure_ascii=False, indent=2), encoding='utf-8')
+        os.replace(tmp_path, path)
+
+    def export(self, fmt='parquet', full=False, now=None):
+        fmt = self.FORMATS.get(str(fmt or '').lower(), 'parquet')
+        pa = self._load_pyarrow()
+        now = now or datetime.utcnow()
+        current_month = self._month_start(now)
+        refresh_from = current_month
+        for _ in range(self.refresh_months - 1):
+            refresh_from = self._previous_month(refresh_from)
+        manifest = self._load_manifest()
+        summary = {'format': fmt, 'written': [], 'skipped': 0, 'rows': 0}
+        written_at = now.strftime('%Y-%m-%dT%H:%M:%S')
+
+        for model in self.partitioned_models:
+            table_name = model.__tablename__
+            created_column = model.__table__.columns['created_at']
+            first_value, last_value = self.db.session.query(func.min(created_column), func.max(created_column)).one()
+            table_manifest = manifest.setdefault(table_name, {})
+            if not first_value:
+                continue
+            month = self._month_start(first_value)
+            last_month = self._month_start(last_value)
+            while month <= last_month:
+                partition = month.strftime('%Y-%m')
+                path = self.export_dir / table_name / f'month={partition}' / f'part-0.{fmt}'
+                if not full and month < refresh_from and path.exists():
+                    summary['skipped'] += 1
+                    month = self._next_month(month)
+                    continue
+                rows = self._write(pa, model, path, fmt, [
+                    created_column >= month,
+                    created_column < self._next_month(month),
+                ])
+                if rows:
+                    table_manifest[partition] = {'rows': rows, 'format': fmt, 'written_at': written_at}
+                    summary['written'].append(f'{table_name}/{partition}')
+                    summary['rows'] += rows
+                month = self._next_month(month)
+
+        for model in self.snapshot_models:
+            table_name = model.__tablename__
+            rows = self._write(pa, model, self.export_dir / table_name / f'snapshot.{fmt}', fmt)
+            manifest.setdefault(table_name, {})['snapshot'] = {'rows': rows, 'format': fmt, 'written_at': written_at}
+            summary['written'].append(f'{table_name}/snapshot')
+            summary['rows'] += rows
+
+        self._save_manifest(manifest)
+        return summary
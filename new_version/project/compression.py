@@ -0,0 +1,237 @@
+import sys
+import time
+import zlib
+
+COMPRESSIBLE_TYPES = {
+    'text/html',
+    'text/css',
+    'text/plain',
+    'text/csv',
+    'text/javascript',
+    'text/xml',
+    'application/javascript',
+    'application/json',
+    'application/xml',
+    'image/svg+xml',
+}
+
+
+def load_brotli():
+    try:
+        import brotli
+    except ImportError:
+        return None
+    return brotli
+
+
+def parse_accept_encoding(header):
+    accepted = {}
+    for item in str(header or '').split(','):
+        name, _, params = item.strip().partition(';')
+        name = name.strip().lower()
+        if not name:
+            continue
+        quality = 1.0
+        for param in params.split(';'):
+            key, _, value = param.strip().partition('=')
+            if key.strip() == 'q':
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        accepted[name] = quality
+    return accepted
+
+
+class GzipStream:
+    def __init__(self, level):
+        self._compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+
+    def compress(self, data):
+        return self._compressor.compress(data)
+
+    def flush(self):
+        return self._compressor.flush(zlib.Z_SYNC_FLUSH)
+
+    def finish(self):
+        return self._compressor.flush(zlib.Z_FINISH)
+
+
+class BrotliStream:
+    def __init__(self, brotli, quality):
+        self._compressor = brotli.Compressor(quality=quality)
+
+    def compress(self, data):
+        return self._compressor.process(data)
+
+    def flush(self):
+        return self._compressor.flush()
+
+    def finish(self):
+        return self._compressor.finish()
+
+
+class CompressionMiddleware:
+    def __init__(self, wsgi_app, min_size=500, gzip_level=6, brotli_quality=4, compressible_types=None):
+        self.wsgi_app = wsgi_app
+        self.min_size = max(0, int(min_size))
+        self.gzip_level = gzip_level
+        self.brotli_quality = brotli_quality
+        self.compressible_types = set(compressible_types or COMPRESSIBLE_TYPES)
+        self.brotli = load_brotli()
+        self.enabled = True
+
+    def choose_encoding(self, environ):
+        accepted = parse_accept_encoding(environ.get('HTTP_ACCEPT_ENCODING'))
+        if self.brotli is not None and accepted.get('br', 0) > 0:
+            return 'br'
+        if accepted.get('gzip', 0) > 0 or accepted.get('x-gzip', 0) > 0:
+            return 'gzip'
+        return None
+
+    def _should_compress(self, environ, status, headers):
+        if environ.get('REQUEST_METHOD') == 'HEAD':
+            return False
+        code = int(str(status).split(' ', 1)[0] or 0)
+        if code < 200 or code in (204, 206, 304):
+            return False
+        header_map = {name.lower(): value for name, value in headers}
+        if 'content-encoding' in header_map or 'content-range' in header_map:
+            return False
+        if 'no-transform' in header_map.get('cache-control', '').lower():
+            return False
+        content_type = header_map.get('content-type', '').split(';', 1)[0].strip().lower()
+        if content_type not in self.compressible_types:
+            return False
+        length = header_map.get('content-length')
+        if length is not None and length.isdigit() and int(length) < self.min_size:
+            return False
+        return True
+
+    def _stream(self, encoding):
+        if encoding == 'br':
+            return BrotliStream(self.brotli, self.brotli_quality)
+        return GzipStream(self.gzip_level)
+
+    @staticmethod
+    def _rewrite_headers(headers, encoding, length=None):
+        rewritten = []
+        vary = None
+        for name, value in headers:
+            lower = name.lower()
+            if lower == 'content-length':
+                continue
+            if lower == 'vary':
+                vary = value
+                continue
+            if lower == 'etag' and not value.startswith('W/'):
+                value = f'W/{value}'
+            rewritten.append((name, value))
+        if vary and 'accept-encoding' not in vary.lower():
+            vary = f'{vary}, Accept-Encoding'
+        rewritten.append(('Vary', vary or 'Accept-Encoding'))
+        rewritten.append(('Content-Encoding', encoding))
+        if length is not None:
+            rewritten.append(('Content-Length', str(length)))
+        return rewritten
+
+    def __call__(self, environ, start_response):
+        encoding = self.choose_encoding(environ) if self.enabled else None
+        if encoding is None:
+            return self.wsgi_app(environ, start_response)
+
+        captured = {}
+
+        def capture_start_response(status, headers, exc_info=None):
+            captured['status'] = status
+            captured['headers'] = headers
+            captured['exc_info'] = exc_info
+            if not self._should_compress(environ, status, headers):
+                captured['passthrough'] = True
+                return start_response(status, headers, exc_info)
+            captured['passthrough'] = False
+            return captured.setdefault('writes', []).append
+
+        app_iter = self.wsgi_app(environ, capture_start_response)
+        if captured.get('passthrough', True) and not captured.get('writes'):
+            return app_iter
+
+        header_map = {name.lower(): value for name, value in captured['headers']}
+        length = header_map.get('content-length')
+        if length is not None and length.isdigit():
+            try:
+                body = b''.join(captured.get('writes', [])) + b''.join(app_iter)
+            finally:
+                if hasattr(app_iter, 'close'):
+                    app_iter.close()
+            compressor = self._stream(encoding)
+            compressed = compressor.compress(body) + compressor.finish()
+            if len(compressed) >= len(body):
+                headers = [(name, value) for name, value in captured['headers'] if name.lower() != 'content-length']
+                headers.append(('Content-Length', str(len(body))))
+                start_response(captured['status'], headers, captured['exc_info'])
+                return [body]
+            start_response(captured['status'], self._rewrite_headers(captured['headers'], encoding, len(compressed)),
+                           captured['exc_info'])
+            return [compressed]
+
+        start_response(captured['status'], self._rewrite_headers(captured['headers'], encoding),
+                       captured['exc_info'])
+        return self._iter_compressed(app_iter, captured.get('writes', []), self._stream(encoding))
+
+    @staticmethod
+    def _iter_compressed(app_iter, early_writes, compressor):
+        try:
+            for chunk in early_writes:
+                data = compressor.compress(chunk)
+                if data:
+                    yield data
+            for chunk in app_iter:
+                if not chunk:
+                    continue
+                data = compressor.compress(chunk) + compressor.flush()
+                if data:
+                    yield data
+            yield compressor.finish()
+        finally:
+            if hasattr(app_iter, 'close'):
+                app_iter.close()
+
+
+def run_benchmark(app, middleware, paths, repeat=20):
+    client = app.test_client()
+    results = []
+    for path in paths:
+        row = {'path': path}
+        for label, encoding in (('identity', None), ('gzip', 'gzip'), ('br', 'br')):
+            if encoding == 'br' and middleware.brotli is None:
+                continue
+            middleware.enabled = encoding is not None
+            headers = {'Accept-Encoding': encoding} if encoding else {}
+            best = None
+            size = 0
+            for _ in range(repeat):
+                started = time.perf_counter()
+                response = client.get(path, headers=headers)
+                body = response.get_data()
+                elapsed = time.perf_counter() - started
+                best = elapsed if best is None else min(best, elapsed)
+                size = len(body)
+            row[label] = (size, best)
+        middleware.enabled = True
+        results.append(row)
+    return results
+
+
+if __name__ == '__main__':
+    import main
+
+    app = main.create_app()
+    with app.app_context():
+        dish = main.Dish.query.filter_by(is_active=True).first()
+    paths = sys.argv[1:] or ['/', '/menu/week/', *([f'/dish/{dish.id}/'] if dish else []),
+                             '/static/css/ui-components.css', '/menu/search/?q=%D1%81%D1%83%D0%BF']
+    for row in run_benchmark(app, main.compression_middleware, paths):
+        parts = [f"{label} {row[label][0]:>7} B {row[label][1] * 1000:7.2f} ms"
+                 for label in ('identity', 'gzip', 'br') if label in row]
+        print(f"{row['path']:<36} " + ' | '.join(parts))
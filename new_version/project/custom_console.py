@@ -80,6 +80,14 @@ class CustomConsole:
             'list_purchase_requests': self.cmd_list_purchase_requests,
             'setup_wizard': self.cmd_setup_wizard,
             'system_info': self.cmd_system_info,
+            'compact_rollups': self.cmd_compact_rollups,
+            'export_columnar': self.cmd_export_columnar,
+            'forecast': self.cmd_forecast,
+            'rebuild_ratings': self.cmd_rebuild_ratings,
+            'rate_limits': self.cmd_rate_limits,
+            'hashing_stats': self.cmd_hashing_stats,
+            'image_jobs': self.cmd_image_jobs,
+            'backfill_images': self.cmd_backfill_images,
             'list_inventory': self.cmd_list_inventory,
             'inventory_stats': self.cmd_inventory_stats,
             'list_incidents': self.cmd_list_incidents,
@@ -194,6 +202,14 @@ class CustomConsole:
             'list_purchase_requests [limit]': 'Список заявок на закупку',
             'setup_wizard': 'Перезапустить первичную настройку',
             'system_info': 'Информация о системе',
+            'compact_rollups [full]': 'Пересчитать дневные сводки',
+            'export_columnar [full] [parquet|arrow]': 'Колоночная выгрузка заказов и платежей',
+            'forecast [refresh]': 'Прогноз порций по блюдам на неделю',
+            'rebuild_ratings': 'Пересчитать рейтинги блюд по отзывам',
+            'rate_limits': 'Счетчики ограничений запросов',
+            'hashing_stats': 'Очередь хеширования паролей',
+            'image_jobs': 'Фоновая обработка изображений',
+            'backfill_images [limit]': 'Создать уменьшенные копии фото блюд и аватаров',
             'list_inventory [limit]': 'Список складских позиций',
             'inventory_stats': 'Статистика по складу',
             'list_incidents [limit]': 'Список инцидентов',
@@ -453,6 +469,96 @@ class CustomConsole:
         callback()
         self.print('Код доступа к веб-мастеру первичной настройки обновлен.')
 
+    def cmd_compact_rollups(self, args):
+        callback = self.hooks.get('compact_rollups')
+        if not callback:
+            self.print('Команда недоступна.')
+            return
+        full = bool(args) and args[0].lower() == 'full'
+        days = callback(full)
+        self.print(f'Сводки пересчитаны: дней {days}.')
+
+    def cmd_export_columnar(self, args):
+        callback = self.hooks.get('export_columnar')
+        if not callback:
+            self.print('Команда недоступна.')
+            return
+        options = [str(arg).lower() for arg in args]
+        fmt = next((arg for arg in options if arg in {'parquet', 'arrow'}), None)
+        try:
+            summary = callback('full' in options, fmt)
+        except ImportError:
+            self.print('Для выгрузки установите пакет pyarrow.')
+            return
+        self.print(f"Выгрузка {summary['format']}: партиций {len(summary['written'])}, строк {summary['rows']}, "
+                   f"пропущено {summary['skipped']}.")
+
+    def cmd_forecast(self, args):
+        callback = self.hooks.get('forecast')
+        if not callback:
+            self.print('Команда недоступна.')
+            return
+        days = callback(bool(args) and args[0].lower() == 'refresh')
+        if not days:
+            self.print('Прогноз пуст. Используйте forecast refresh.')
+            return
+        for day in days:
+            self.print(f"{day['label']}:")
+            for item in day['dishes']:
+                self.print(f"  {item['title']}: прогноз {item['forecast']}, предзаказов {item['preorders']}, "
+                           f"готовить {item['prepare']}")
+
+    def cmd_rebuild_ratings(self, args):
+        callback = self.hooks.get('rebuild_ratings')
+        if not callback:
+            self.print('Команда недоступна.')
+            return
+        self.print(f'Рейтинги пересчитаны: блюд {callback()}.')
+
+    def cmd_rate_limits(self, args):
+        callback = self.hooks.get('rate_limits')
+        if not callback:
+            self.print('Команда недоступна.')
+            return
+        report = callback()
+        backend = report['backend']
+        self.print(f"Хранилище: {backend['backend']}, записей {backend['items']}")
+        for name, policy in report['policies'].items():
+            counters = report['counters'].get(name, {})
+            self.print(f"  {name}: {policy['limit']} за {policy['window']} с — пропущено {counters.get('allowed', 0)}, "
+                       f"отклонено {counters.get('limited', 0)}, блокировок {counters.get('blocked', 0)}")
+
+    def cmd_hashing_stats(self, args):
+        callback = self.hooks.get('hashing_stats')
+        if not callback:
+            self.print('Команда недоступна.')
+            return
+        stats = callback()
+        self.print(f"Метод: {stats['method']}, потоков {stats['workers']}, очередь до {stats['max_queue']}")
+        self.print(f"Сейчас: в работе {stats['in_flight']}, в очереди {stats['queued']}, пик {stats['peak_in_flight']}")
+        self.print(f"Выполнено {stats['completed']} (среднее {stats['avg_ms']} мс), отклонено {stats['shed']}, "
+                   f"по таймауту {stats['timed_out']}, перехешировано {stats['rehashed']}")
+
+    def cmd_image_jobs(self, args):
+        callback = self.hooks.get('image_jobs')
+        if not callback:
+            self.print('Команда недоступна.')
+            return
+        stats = callback()
+        self.print(f"Процессов: {stats['workers'] or 'нет (обработка в запросе)'}")
+        self.print(f"Принято {stats['submitted']}, в работе {stats['pending']}, готово {stats['done']} "
+                   f"(среднее {stats['avg_ms']} мс), ошибок {stats['failed']}")
+
+    def cmd_backfill_images(self, args):
+        callback = self.hooks.get('backfill_images')
+        if not callback:
+            self.print('Команда недоступна.')
+            return
+        limit = int(args[0]) if args and args[0].isdigit() else None
+        submitted = callback(limit)
+        self.print(f"В очередь поставлено: блюд {submitted['dishes']}, аватаров {submitted['avatars']}. "
+                   f"Ход обработки — команда image_jobs.")
+
     def cmd_system_info(self, args):
         self.print('Система:')
         self.print(f'OS: {platform.system()} {platform.release()}')
@@ -0,0 +1,163 @@
+import re
+
+from sqlalchemy import text
+
+RUSSIAN_SUFFIXES = sorted({
+    'ами', 'ями', 'ого', 'его', 'ому', 'ему', 'ыми', 'ими', 'ая', 'яя', 'ое', 'ее', 'ые', 'ие', 'ой', 'ей', 'ий',
+    'ый', 'ом', 'ем', 'ам', 'ям', 'ах', 'ях', 'ов', 'ев', 'ью', 'ую', 'юю', 'ию', 'ия', 'ие', 'а', 'я', 'о', 'е',
+    'ы', 'и', 'у', 'ю', 'ь', 'й',
+}, key=len, reverse=True)
+TOKEN_RE = re.compile(r'[0-9a-zа-я]+', re.IGNORECASE)
+
+
+def fold_text(value):
+    return str(value or '').casefold().replace('ё', 'е')
+
+
+def stem_token(token):
+    token = fold_text(token)
+    for suffix in RUSSIAN_SUFFIXES:
+        if token.endswith(suffix) and len(token) - len(suffix) >= 3:
+            return token[:-len(suffix)]
+    return token
+
+
+def query_terms(query, max_terms=6):
+    terms = []
+    for token in TOKEN_RE.findall(fold_text(query)):
+        stem = stem_token(token)
+        if stem and stem not in terms:
+            terms.append(stem)
+    return terms[:max_terms]
+
+
+def build_search_text(*parts):
+    return ' '.join(fold_text(part) for part in parts if part)
+
+
+class DishSearchIndex:
+    FTS_TABLE = 'dish_fts'
+    FTS_COLUMNS = ('title', 'composition', 'description', 'allergens')
+    LIKE_COLUMN = 'search_text'
+    PG_CONFIG = 'russian'
+
+    def __init__(self, db, logger=None):
+        self.db = db
+        self.logger = logger
+        self.backend = None
+
+    def _log_error(self, message):
+        if self.logger:
+            self.logger.error(message)
+
+    def _dialect(self):
+        return self.db.engine.dialect.name
+
+    def setup(self):
+        try:
+            if self._dialect() == 'postgresql':
+                self._setup_postgres()
+                self.backend = 'postgresql'
+            elif self._dialect() == 'sqlite':
+                self._setup_sqlite()
+                self.backend = 'fts5'
+            else:
+                self.backend = 'like'
+        except Exception as e:
+            self._log_error(f'dish search setup error: {str(e)}')
+            self.backend = 'like'
+        return self.backend
+
+    def _setup_sqlite(self):
+        columns = ', '.join(self.FTS_COLUMNS)
+        new_values = ', '.join(f'new.{column}' for column in self.FTS_COLUMNS)
+        old_values = ', '.join(f'old.{column}' for column in self.FTS_COLUMNS)
+        fts = self.FTS_TABLE
+        with self.db.engine.begin() as conn:
+            exists = conn.execute(text("SELECT 1 FROM sqlite_master WHERE type='table' AND name=:name"),
+                                  {'name': fts}).first()
+            conn.execute(text(
+                f"CREATE VIRTUAL TABLE IF NOT EXISTS {fts} USING fts5({columns}, content='Dish', content_rowid='id', "
+                f"tokenize='unicode61 remove_diacritics 2', prefix='2 3 4')"
+            ))
+            conn.execute(text(
+                f'CREATE TRIGGER IF NOT EXISTS {fts}_ai AFTER INSERT ON "Dish" BEGIN '
+                f'INSERT INTO {fts}(rowid, {columns}) VALUES (new.id, {new_values}); END'
+            ))
+            conn.execute(text(
+                f'CREATE TRIGGER IF NOT EXISTS {fts}_ad AFTER DELETE ON "Dish" BEGIN '
+                f"INSERT INTO {fts}({fts}, rowid, {columns}) VALUES ('delete', old.id, {old_values}); END"
+            ))
+            conn.execute(text(
+                f'CREATE TRIGGER IF NOT EXISTS {fts}_au AFTER UPDATE OF {columns} ON "Dish" BEGIN '
+                f"INSERT INTO {fts}({fts}, rowid, {columns}) VALUES ('delete', old.id, {old_values}); "
+                f'INSERT INTO {fts}(rowid, {columns}) VALUES (new.id, {new_values}); END'
+            ))
+            if not exists:
+                conn.execute(text(f"INSERT INTO {fts}({fts}) VALUES ('rebuild')"))
+
+    def _setup_postgres(self):
+        document = " || ".join([
+            f"setweight(to_tsvector('{self.PG_CONFIG}', coalesce(title, '')), 'A')",
+            f"setweight(to_tsvector('{self.PG_CONFIG}', coalesce(composition, '')), 'B')",
+            f"setweight(to_tsvector('{self.PG_CONFIG}', coalesce(description, '')), 'C')",
+            f"setweight(to_tsvector('{self.PG_CONFIG}', coalesce(allergens, '')), 'D')",
+        ])
+        with self.db.engine.begin() as conn:
+            conn.execute(text(
+                f'ALTER TABLE "Dish" ADD COLUMN IF NOT EXISTS search_vector tsvector '
+                f'GENERATED ALWAYS AS ({document}) STORED'
+            ))
+            conn.execute(text('CREATE INDEX IF NOT EXISTS ix_dish_search_vector ON "Dish" USING GIN (search_vector)'))
+
+    def rebuild(self):
+        if self.backend == 'fts5':
+            with self.db.engine.begin() as conn:
+                conn.execute(text(f"INSERT INTO {self.FTS_TABLE}({self.FTS_TABLE}) VALUES ('rebuild')"))
+
+    def search_ids(self, query, limit=10, active_only=True):
+        terms = query_terms(query)
+        if not terms:
+            return []
+        limit = max(1, min(int(limit), 100))
+        try:
+            if self.backend == 'fts5':
+                return self._search_sqlite(terms, limit, active_only)
+            if self.backend == 'postgresql':
+                return self._search_postgres(terms, limit, active_only)
+        except Exception as e:
+            self._log_error(f'dish search error: {str(e)}')
+        return self._search_like(terms, limit, active_only)
+
+    def _search_sqlite(self, terms, limit, active_only):
+        match = ' AND '.join(f'"{term}"*' for term in terms)
+        active_sql = 'AND d.is_active = 1' if active_only else ''
+        rows = self.db.session.execute(text(
+            f'SELECT d.id FROM {self.FTS_TABLE} f JOIN "Dish" d ON d.id = f.rowid '
+            f'WHERE {self.FTS_TABLE} MATCH :match {active_sql} '
+            f'ORDER BY bm25({self.FTS_TABLE}, 10.0, 4.0, 1.0, 1.0), d.title LIMIT :limit'
+        ), {'match': match, 'limit': limit})
+        return [row[0] for row in rows]
+
+    def _search_postgres(self, terms, limit, active_only):
+        tsquery = ' & '.join(f'{term}:*' for term in terms)
+        active_sql = 'AND is_active' if active_only else ''
+        rows = self.db.session.execute(text(
+            f'SELECT id FROM "Dish" WHERE search_vector @@ to_tsquery(\'{self.PG_CONFIG}\', :query) {active_sql} '
+            f'ORDER BY ts_rank(search_vector, to_tsquery(\'{self.PG_CONFIG}\', :query)) DESC, title LIMIT :limit'
+        ), {'query': tsquery, 'limit': limit})
+        return [row[0] for row in rows]
+
+    def _search_like(self, terms, limit, active_only):
+        conditions = []
+        params = {'limit': limit}
+        for idx, term in enumerate(terms):
+            params[f't{idx}'] = f'%{term}%'
+            conditions.append(f'{self.LIKE_COLUMN} LIKE :t{idx}')
+        if active_only:
+            conditions.append('is_active = :active')
+            params['active'] = True
+        rows = self.db.session.execute(text(
+            f'SELECT id FROM "Dish" WHERE {" AND ".join(conditions)} ORDER BY title LIMIT :limit'
+        ), params)
+        return [row[0] for row in rows]
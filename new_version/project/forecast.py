@@ -0,0 +1,105 @@
+import numpy as np
+
+from analytics import day_number, EPOCH
+
+
+def weekday_numbers(day_numbers):
+    return (np.asarray(day_numbers, dtype=np.int64) + EPOCH.weekday()) % 7
+
+
+def build_history_matrix(dish_index, rows, start_day, n_days):
+    history = np.zeros((len(dish_index), n_days), dtype=np.float64)
+    if not rows:
+        return history
+    dish_rows, day_values, counts = zip(*rows)
+    dish_positions = np.array([dish_index.get(dish_id, -1) for dish_id in dish_rows], dtype=np.int64)
+    offsets = np.array([day_number(value) for value in day_values], dtype=np.int64) - start_day
+    mask = (dish_positions >= 0) & (offsets >= 0) & (offsets < n_days)
+    np.add.at(history, (dish_positions[mask], offsets[mask]), np.asarray(counts, dtype=np.float64)[mask])
+    return history
+
+
+def offered_matrix(schedule, scheduled_days, day_numbers):
+    dows = weekday_numbers(day_numbers)
+    return np.where(scheduled_days[dows][None, :], schedule[:, dows], True)
+
+
+def forecast_portions(history, offered, start_day, target_days, target_offered, halflife_weeks=4.0,
+                      trend_weeks=8, max_trend=0.5):
+    n_dishes, n_days = history.shape
+    target_days = np.asarray(target_days, dtype=np.int64)
+    if not n_dishes or not len(target_days):
+        empty = np.zeros((n_dishes, len(target_days)))
+        return empty, empty, np.ones_like(empty)
+
+    day_numbers = start_day + np.arange(n_days)
+    dows = weekday_numbers(day_numbers)
+    last_day = day_numbers[-1]
+    age_weeks = (last_day - day_numbers) / 7.0
+    weights = 0.5 ** (age_weeks / halflife_weeks)
+    weighted = offered * weights[None, :]
+    weighted_history = history * weighted
+
+    dow_onehot = (dows[:, None] == np.arange(7)[None, :]).astype(np.float64)
+    dow_num = weighted_history @ dow_onehot
+    dow_den = weighted @ dow_onehot
+    overall_den = weighted.sum(axis=1)
+    overall = np.divide(weighted_history.sum(axis=1), overall_den, out=np.zeros(n_dishes), where=overall_den > 0)
+    baseline = np.where(dow_den > 0, np.divide(dow_num, dow_den, out=np.zeros_like(dow_num), where=dow_den > 0),
+                        overall[:, None])
+
+    trend_weeks = max(2, min(int(trend_weeks), n_days // 7))
+    window = trend_weeks * 7
+    recent_history = (history * offered)[:, -window:].reshape(n_dishes, trend_weeks, 7).sum(axis=2)
+    recent_offered = offered[:, -window:].reshape(n_dishes, trend_weeks, 7).sum(axis=2)
+    valid = recent_offered > 0
+    weekly_mean = np.divide(recent_history, recent_offered, out=np.zeros_like(recent_history), where=valid)
+    t = np.broadcast_to(np.arange(trend_weeks, dtype=np.float64), weekly_mean.shape)
+    count = valid.sum(axis=1)
+    safe_count = np.maximum(count, 1)
+    t_mean = (t * valid).sum(axis=1) / safe_count
+    y_mean = (weekly_mean * valid).sum(axis=1) / safe_count
+    t_centered = (t - t_mean[:, None]) * valid
+    variance = (t_centered ** 2).sum(axis=1)
+    covariance = (t_centered * (weekly_mean - y_mean[:, None])).sum(axis=1)
+    slope = np.divide(covariance, variance, out=np.zeros(n_dishes), where=(variance > 0) & (count >= 3))
+    relative_slope = np.divide(slope, y_mean, out=np.zeros(n_dishes), where=y_mean > 0)
+
+    effective_age = float((weights * age_weeks).sum() / weights.sum())
+    horizon_weeks = effective_age + (target_days - last_day) / 7.0
+    trend = np.clip(1.0 + relative_slope[:, None] * horizon_weeks[None, :], 1.0 - max_trend, 1.0 + max_trend)
+    target_baseline = baseline[:, weekday_numbers(target_days)]
+    forecast = np.where(target_offered, np.maximum(target_baseline * trend, 0.0), 0.0)
+    return forecast, target_baseline, trend
+
+
+def forecast_dish_demand(dish_ids, history_rows, schedule_rows, history_start_day, history_days, start_day, horizon):
+    dish_index = {dish_id: idx for idx, dish_id in enumerate(dish_ids)}
+    history = build_history_matrix(dish_index, history_rows, history_start_day, history_days)
+
+    schedule = np.zeros((len(dish_ids), 7), dtype=bool)
+    scheduled_days = np.zeros(7, dtype=bool)
+    for dish_id, day_of_week in schedule_rows:
+        if 0 <= day_of_week < 7:
+            scheduled_days[day_of_week] = True
+            if dish_id in dish_index:
+                schedule[dish_index[dish_id], day_of_week] = True
+
+    open_days = history.sum(axis=0) > 0
+    offered = offered_matrix(schedule, scheduled_days, history_start_day + np.arange(history_days)) & open_days
+    target_days = start_day + np.arange(horizon)
+    open_weekdays = np.zeros(7, dtype=bool)
+    open_weekdays[weekday_numbers(history_start_day + np.flatnonzero(open_days))] = True
+    target_offered = offered_matrix(schedule, scheduled_days, target_days) & open_weekdays[weekday_numbers(target_days)]
+    portions, baseline, trend = forecast_portions(history, offered, history_start_day, target_days, target_offered)
+
+    results = []
+    for dish_pos, target_pos in zip(*np.nonzero(target_offered & (portions > 0))):
+        results.append((
+            dish_ids[dish_pos],
+            int(target_pos),
+            float(portions[dish_pos, target_pos]),
+            float(baseline[dish_pos, target_pos]),
+            float(trend[dish_pos, target_pos]),
+        ))
+    return results
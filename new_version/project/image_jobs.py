@@ -0,0 +1,140 @@
+import os
+import secrets
+import shutil
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from pathlib import Path
+from threading import Lock
+
+AVIF_SAVE_OPTIONS = {'quality': 80, 'speed': 6, 'subsampling': '4:4:4'}
+WEBP_SAVE_OPTIONS = {'quality': 80, 'method': 4}
+SAVE_FORMATS = {
+    '.avif': ('AVIF', AVIF_SAVE_OPTIONS),
+    '.webp': ('WEBP', WEBP_SAVE_OPTIONS),
+}
+
+
+def render_square_variants(source_path, outputs):
+    from PIL import Image
+
+    started = time.perf_counter()
+    written = []
+    with Image.open(source_path) as source:
+        image = source.convert('RGBA')
+    width, height = image.size
+    side = min(width, height)
+    image = image.crop(((width - side) / 2, (height - side) / 2, (width + side) / 2, (height + side) / 2))
+    resized = {}
+    for size, output_path in outputs:
+        output_path = Path(output_path)
+        output_path.parent.mkdir(parents=True, exist_ok=True)
+        image_format, options = SAVE_FORMATS[output_path.suffix.lower()]
+        if size not in resized:
+            resized[size] = image.resize((size, size), Image.LANCZOS)
+        tmp_path = output_path.with_name(f'{output_path.name}.{os.getpid()}.tmp')
+        resized[size].save(tmp_path, format=image_format, **options)
+        os.replace(tmp_path, output_path)
+        written.append(str(output_path))
+    return {'files': written, 'ms': round((time.perf_counter() - started) * 1000, 1)}
+
+
+class ImagePipeline:
+    def __init__(self, state, staging_dir, logger, max_workers=2, prefix='img:job:', ttl=3600):
+        self.state = state
+        self.staging_dir = Path(staging_dir)
+        self.logger = logger
+        self.max_workers = max(0, int(max_workers))
+        self.prefix = prefix
+        self.ttl = ttl
+        self._executor = None
+        self._lock = Lock()
+        self._stats = {'submitted': 0, 'done': 0, 'failed': 0, 'pending': 0, 'total_ms': 0.0}
+
+    def configure(self, max_workers):
+        max_workers = max(0, int(max_workers))
+        with self._lock:
+            if max_workers == self.max_workers:
+                return
+            self.max_workers = max_workers
+        self.shutdown(wait=False)
+
+    def _pool(self):
+        with self._lock:
+            if self._executor is None:
+                self._executor = ProcessPoolExecutor(max_workers=self.max_workers)
+            return self._executor
+
+    def _save(self, job_id, payload):
+        self.state.set(self.prefix + job_id, payload, ttl=self.ttl)
+
+    def status(self, job_id):
+        return self.state.get(self.prefix + str(job_id))
+
+    def submit(self, stream, outputs, owner_id=None, kind='', url='', on_done=None):
+        job_id = secrets.token_urlsafe(12)
+        self.staging_dir.mkdir(parents=True, exist_ok=True)
+        staging_path = self.staging_dir / f'{job_id}.upload'
+        with staging_path.open('wb') as handle:
+            shutil.copyfileobj(stream, handle)
+        outputs = [(int(size), str(path)) for size, path in outputs]
+        job = {'status': 'pending', 'kind': kind, 'owner_id': owner_id, 'url': url, 'created_at': time.time()}
+        self._save(job_id, job)
+        with self._lock:
+            self._stats['submitted'] += 1
+            self._stats['pending'] += 1
+        if self.max_workers == 0:
+            self._run_inline(job_id, job, staging_path, outputs, on_done)
+            return job_id
+        try:
+            future = self._pool().submit(render_square_variants, str(staging_path), outputs)
+        except BrokenProcessPool:
+            self.logger.warning('Image process pool was broken, restarting it')
+            self.shutdown(wait=False)
+            future = self._pool().submit(render_square_variants, str(staging_path), outputs)
+        future.add_done_callback(lambda done: self._finish(job_id, job, staging_path, done.result, on_done))
+        return job_id
+
+    def _run_inline(self, job_id, job, staging_path, outputs, on_done):
+        self._finish(job_id, job, staging_path, lambda: render_square_variants(str(staging_path), outputs), on_done)
+
+    def _finish(self, job_id, job, staging_path, get_result, on_done):
+        try:
+            result = get_result()
+            if on_done is not None:
+                on_done(result)
+        except Exception as exc:
+            if isinstance(exc, BrokenProcessPool):
+                self.shutdown(wait=False)
+            self.logger.error(f'Image job {job_id} ({job.get("kind")}) failed: {exc}')
+            self._save(job_id, {**job, 'status': 'error', 'finished_at': time.time()})
+            with self._lock:
+                self._stats['failed'] += 1
+                self._stats['pending'] -= 1
+        else:
+            self._save(job_id, {**job, 'status': 'done', 'finished_at': time.time(), 'ms': result['ms']})
+            with self._lock:
+                self._stats['done'] += 1
+                self._stats['pending'] -= 1
+                self._stats['total_ms'] += result['ms']
+        finally:
+            staging_path.unlink(missing_ok=True)
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+        done = stats['done']
+        return {
+            'workers': self.max_workers,
+            'submitted': stats['submitted'],
+            'pending': stats['pending'],
+            'done': done,
+            'failed': stats['failed'],
+            'avg_ms': round(stats['total_ms'] / done, 1) if done else 0.0,
+        }
+
+    def shutdown(self, wait=True):
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=wait)
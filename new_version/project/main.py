@@ -1,8 +1,10 @@
 ﻿import getpass
+import hashlib
 import html as html_module
 import io
 import json
 import logging
+import mimetypes
 import os
 import re
 import secrets
@@ -10,18 +12,28 @@ import sys
 import time
 from datetime import date, datetime, timedelta
 from pathlib import Path
+from queue import Queue
 from random import choices
 from threading import Lock, Thread
 
 from flask import Flask, flash, g, has_request_context, jsonify, make_response, redirect, render_template, request, \
-    send_file, session
-from flask_mail import Mail, Message
+    send_file, session, url_for
 from flask_sqlalchemy import SQLAlchemy
-from PIL import Image, ImageDraw, ImageEnhance, ImageFilter, ImageOps
-from sqlalchemy import UniqueConstraint, func, inspect, text
-from werkzeug.security import check_password_hash, generate_password_hash
-
+from markupsafe import Markup
+from sqlalchemy import UniqueConstraint, case, cast, event, false, func, inspect, literal, or_, select, text, update
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from werkzeug.middleware.proxy_fix import ProxyFix
+
+from assets import AssetPipeline
+from columnar_export import ColumnarExporter
+from compression import CompressionMiddleware
 from custom_console import CustomConsole
+from dish_search import DishSearchIndex, build_search_text
+from image_jobs import AVIF_SAVE_OPTIONS, ImagePipeline
+from password_hashing import PasswordHasher, PasswordHashingBusy, is_valid_hash_method
+from qr_cache import QRCodeCache
+from rate_limit import SlidingWindowLimiter
+from shared_state import SessionCache, SharedState
 
 BASE_DIR = Path(__file__).resolve().parent
 STATIC_DIR = BASE_DIR / 'static'
@@ -30,6 +42,12 @@ ICON_DIR = STATIC_DIR / 'icons'
 DISH_ICON_DIR = ICON_DIR / 'dishes'
 BG_DIR = STATIC_DIR / 'bg'
 DATA_DIR = BASE_DIR / 'data'
+QR_CACHE_DIR = DATA_DIR / 'qr_cache'
+IMAGE_STAGING_DIR = DATA_DIR / 'uploads'
+IMAGE_VARIANT_FORMATS = ('avif', 'webp')
+DISH_IMAGE_WIDTHS = (160, 320, 640, 900)
+AVATAR_IMAGE_WIDTHS = (64, 512)
+COLUMNAR_EXPORT_DIR = DATA_DIR / 'exports' / 'columnar'
 SECRET_KEY_FILE = BASE_DIR / '.secret_key'
 ENV_SECRET_KEY_NAMES = ('SMART_CANTEEN_SECRET_KEY', 'SECRET_KEY')
 
@@ -71,18 +89,8 @@ def resolve_secret_key(cfg_secret_key=''):
 
 symbols = 'abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789'
 
-app = Flask(__name__, static_folder=str(STATIC_DIR), template_folder=str(TEMPLATES_DIR))
-DATA_DIR.mkdir(parents=True, exist_ok=True)
-app.config['SQLALCHEMY_DATABASE_URI'] = f"sqlite:///{(DATA_DIR / 'DB.db').as_posix()}"
-app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
-app.config['UPLOAD_FOLDER'] = str(ICON_DIR)
-app.config['MAX_CONTENT_LENGTH'] = 8 * 1024 * 1024
-bootstrap_secret_key, _ = resolve_secret_key()
-app.config['SECRET_KEY'] = bootstrap_secret_key
-app.secret_key = bootstrap_secret_key
-
-for folder in [STATIC_DIR, ICON_DIR, DISH_ICON_DIR, BG_DIR, STATIC_DIR / 'ico']:
-    folder.mkdir(parents=True, exist_ok=True)
+app = None
+logger = logging.getLogger(__name__)
 
 USER_ROLES = {
     'student': {'level': 1, 'session_hours': 24, 'label': 'Ученик'},
@@ -101,6 +109,12 @@ DEFAULT_CFG = {
     'adress': '127.0.0.1',
     'port': 5000,
     'debug': False,
+    'server_workers': 0,
+    'server_threads': 8,
+    'image_workers': 2,
+    'password_hash_method': 'scrypt',
+    'password_hash_workers': 4,
+    'password_hash_queue': 32,
     'protection': 64,
     'mail_enabled': False,
     'mail_server': '',
@@ -132,6 +146,10 @@ DEFAULT_CFG = {
     'announcement_type': 'info',
     'low_balance_threshold': 100,
     'topup_max_amount': 10000,
+    'public_url': '',
+    'proxy_hops': 0,
+    'columnar_export_enabled': False,
+    'columnar_export_format': 'parquet',
 }
 
 INCIDENT_KIND_LABELS = {
@@ -149,45 +167,114 @@ INCIDENT_SEVERITY_LABELS = {
     'critical': 'Критический',
 }
 
-db = SQLAlchemy(app)
-mail = Mail(app)
+db = SQLAlchemy()
 
-session_cache = {}
+SHARED_STATE_PATH = DATA_DIR / 'shared_state.db'
+SHARED_STATE_MAX_ITEMS = 20000
+shared_state = SharedState()
+session_cache = SessionCache(shared_state)
 _last_cleanup_time = None
-MAX_CACHE_SIZE = 2000
 admin_console_runner = None
 admin_console_runner_admin = None
+qr_cache = QRCodeCache(QR_CACHE_DIR, max_items=512)
+image_pipeline = ImagePipeline(shared_state, IMAGE_STAGING_DIR, logger)
+dish_search = DishSearchIndex(db, logger)
+asset_pipeline = AssetPipeline(STATIC_DIR)
+ASSET_MAX_AGE = 365 * 24 * 3600
+COMPRESSION_MIN_SIZE = 500
+proxy_fix = None
+compression_middleware = None
+
+mail = None
+notification_email_queue = Queue()
+notification_email_worker = None
+notification_email_worker_lock = Lock()
+
+report_cache = {}
+report_cache_lock = Lock()
+REPORT_CACHE_TTL_SECONDS = 120
+REPORT_CACHE_MAX_ITEMS = 1000
+REPORT_SNAPSHOT_MAX_AGE_SECONDS = 3600
+REPORT_SNAPSHOT_INTERVAL_SECONDS = 300
+
+menu_fragment_cache = {}
+menu_fragment_cache_lock = Lock()
+MENU_CACHE_TABLES = {'Dish', 'DishGroup', 'WeeklyMenu', 'DishReview', 'DishRatingStat'}
+MENU_FRAGMENT_CACHE_TTL_SECONDS = 300
+MENU_FRAGMENT_CACHE_MAX_ITEMS = 500
 
-_rl_lock = Lock()
-rate_limit_store = {}
 LOGIN_MAX_ATTEMPTS = 5
 LOGIN_BLOCK_MINUTES = 15
+RATE_LIMIT_POLICIES = {
+    'login': {'limit': LOGIN_MAX_ATTEMPTS, 'window': LOGIN_BLOCK_MINUTES * 60, 'block': LOGIN_BLOCK_MINUTES * 60},
+    'otp_verify': {'limit': 10, 'window': 600, 'block': 600},
+    'password_restore': {'limit': 5, 'window': 3600},
+    'feedback_post': {'limit': 10, 'window': 600},
+    'avatar_upload': {'limit': 10, 'window': 600},
+}
+
+
+def configure_shared_state(kind=None):
+    kind = kind or os.environ.get('CANTEEN_STATE_BACKEND') or 'memory'
+    if kind == 'sqlite':
+        backend = shared_state.configure('sqlite', path=SHARED_STATE_PATH)
+    else:
+        backend = shared_state.configure('memory', max_items=SHARED_STATE_MAX_ITEMS)
+    app.logger.info(f'Shared state backend: {backend.name}')
+    return backend
+
+
+rate_limiter = SlidingWindowLimiter(shared_state, RATE_LIMIT_POLICIES)
+password_hasher = PasswordHasher()
+
+
+def client_ip():
+    return request.remote_addr or '0.0.0.0'
+
+
+def rate_limit_hit(policy, ident=None):
+    return rate_limiter.hit(policy, ident or client_ip())
+
+
+def rate_limit_message(retry_after):
+    if retry_after >= 60:
+        return f'Слишком много попыток. Повторите через {-(-retry_after // 60)} мин.'
+    return f'Слишком много попыток. Повторите через {retry_after} сек.'
+
+
+def hash_password(password):
+    return password_hasher.hash(password)
+
+
+def verify_password(pwhash, password):
+    return password_hasher.verify(pwhash, password)
+
+
+def verify_user_password(user, password):
+    if not user or not verify_password(user.psw, password):
+        return False
+    if password_hasher.needs_rehash(user.psw):
+        user.psw = hash_password(password)
+        password_hasher.mark_rehashed()
+        db.session.commit()
+        app.logger.info(f'Password hash upgraded for user {user.id}')
+    return True
 
 
 def check_rate_limit(ip):
-    with _rl_lock:
-        entry = rate_limit_store.get(ip)
-        if not entry:
-            return None, 0
-        blocked_until = entry.get('blocked_until')
-        if blocked_until and datetime.utcnow() < blocked_until:
-            remaining = max(1, int((blocked_until - datetime.utcnow()).total_seconds() // 60) + 1)
-            return blocked_until, remaining
+    retry_after = rate_limiter.peek('login', ip)
+    if not retry_after:
         return None, 0
+    rate_limiter.count('login', 'limited')
+    return datetime.utcnow() + timedelta(seconds=retry_after), max(1, -(-retry_after // 60))
 
 
 def record_failed_attempt(ip):
-    with _rl_lock:
-        entry = rate_limit_store.setdefault(ip, {'count': 0, 'blocked_until': None})
-        entry['count'] += 1
-        if entry['count'] >= LOGIN_MAX_ATTEMPTS:
-            entry['blocked_until'] = datetime.utcnow() + timedelta(minutes=LOGIN_BLOCK_MINUTES)
-            entry['count'] = 0
+    rate_limiter.record('login', ip)
 
 
 def clear_rate_limit(ip):
-    with _rl_lock:
-        rate_limit_store.pop(ip, None)
+    rate_limiter.reset('login', ip)
 
 ADMIN_CONSOLE_ALLOWED_COMMANDS = {
     'help',
@@ -215,6 +302,10 @@ ADMIN_CONSOLE_ALLOWED_COMMANDS = {
     'notification_stats',
     'list_reviews',
     'review_stats',
+    'rate_limits',
+    'hashing_stats',
+    'image_jobs',
+    'backfill_images',
 }
 
 CONSOLE_COMMAND_SPECS = {
@@ -241,6 +332,15 @@ CONSOLE_COMMAND_SPECS = {
     'list_purchase_requests': {'title': 'Заявки на закупку', 'args': ['limit'], 'help': 'Например: 50'},
     'setup_wizard': {'title': 'Первичная настройка', 'args': [], 'help': 'Повторный запуск мастера'},
     'system_info': {'title': 'Система', 'args': [], 'help': 'Версия ОС и Python'},
+    'compact_rollups': {'title': 'Пересчет сводок', 'args': ['mode'], 'help': 'full — полный пересчет'},
+    'forecast': {'title': 'Прогноз спроса', 'args': ['mode'], 'help': 'refresh — пересчитать прогноз'},
+    'rebuild_ratings': {'title': 'Пересчет рейтингов', 'args': [], 'help': 'Сводка оценок блюд по отзывам'},
+    'rate_limits': {'title': 'Ограничения запросов', 'args': [], 'help': 'Счетчики по политикам'},
+    'hashing_stats': {'title': 'Хеширование паролей', 'args': [], 'help': 'Очередь и время хеширования'},
+    'image_jobs': {'title': 'Обработка изображений', 'args': [], 'help': 'Очередь фоновой обработки'},
+    'backfill_images': {'title': 'Размеры изображений', 'args': ['limit'], 'help': 'Сколько изображений поставить в очередь'},
+    'export_columnar': {'title': 'Колоночная выгрузка', 'args': ['mode', 'format'],
+                        'help': 'full — все месяцы; формат parquet/arrow'},
     'list_inventory': {'title': 'Склад', 'args': ['limit'], 'help': 'Например: 100'},
     'inventory_stats': {'title': 'Склад статистика', 'args': [], 'help': 'Низкие остатки'},
     'list_incidents': {'title': 'Инциденты', 'args': ['limit'], 'help': 'Например: 80'},
@@ -332,6 +432,9 @@ class Dish(db.Model):
     price = db.Column(db.Integer, nullable=False, default=0)
     dish_group_id = db.Column(db.Integer, db.ForeignKey('DishGroup.id'), index=True)
     image_path = db.Column(db.String(300), default='')
+    image_variants = db.Column(db.JSON)
+    allergen_tags = db.Column(db.String(300))
+    search_text = db.Column(db.Text)
     is_active = db.Column(db.Boolean, nullable=False, default=True)
     created_by = db.Column(db.Integer, db.ForeignKey('Users.id'), nullable=False)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
@@ -352,6 +455,24 @@ class DishReview(db.Model):
     updated_at = db.Column(db.DateTime, default=datetime.utcnow)
 
 
+class DishRatingStat(db.Model):
+    __tablename__ = 'DishRatingStat'
+
+    dish_id = db.Column(db.Integer, db.ForeignKey('Dish.id'), primary_key=True)
+    rating_sum = db.Column(db.Integer, nullable=False, default=0)
+    rating_count = db.Column(db.Integer, nullable=False, default=0)
+    rating_avg = db.Column(db.Float, nullable=False, default=0)
+    rating_1 = db.Column(db.Integer, nullable=False, default=0)
+    rating_2 = db.Column(db.Integer, nullable=False, default=0)
+    rating_3 = db.Column(db.Integer, nullable=False, default=0)
+    rating_4 = db.Column(db.Integer, nullable=False, default=0)
+    rating_5 = db.Column(db.Integer, nullable=False, default=0)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    def histogram(self):
+        return {value: to_int(getattr(self, f'rating_{value}'), 0) for value in range(5, 0, -1)}
+
+
 class WeeklyMenu(db.Model):
     __tablename__ = 'WeeklyMenu'
     __table_args__ = (db.UniqueConstraint('dish_id', 'day_of_week', name='uq_weekly_menu_dish_day'),)
@@ -367,6 +488,9 @@ class WeeklyMenu(db.Model):
 
 class MealOrder(db.Model):
     __tablename__ = 'MealOrder'
+    __table_args__ = (
+        db.Index('ix_meal_order_plan', 'pre_order_date', 'status', 'dish_id'),
+    )
 
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('Users.id'), nullable=False, index=True)
@@ -432,10 +556,21 @@ class InventoryItem(db.Model):
     unit = db.Column(db.String(32), nullable=False, default='кг')
     quantity = db.Column(db.Float, nullable=False, default=0)
     min_quantity = db.Column(db.Float, nullable=False, default=0)
+    grams_per_unit = db.Column(db.Float)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow)
     created_by = db.Column(db.Integer, db.ForeignKey('Users.id'), nullable=False)
 
 
+class DishIngredient(db.Model):
+    __tablename__ = 'DishIngredient'
+    __table_args__ = (UniqueConstraint('dish_id', 'item_id', name='uq_dish_ingredient'),)
+
+    id = db.Column(db.Integer, primary_key=True)
+    dish_id = db.Column(db.Integer, db.ForeignKey('Dish.id'), nullable=False, index=True)
+    item_id = db.Column(db.Integer, db.ForeignKey('InventoryItem.id'), nullable=False, index=True)
+    grams = db.Column(db.Float, nullable=False, default=0)
+
+
 class PurchaseRequest(db.Model):
     __tablename__ = 'PurchaseRequest'
 
@@ -566,6 +701,75 @@ class ParentInvite(db.Model):
     used_by_parent = db.relationship('Users', foreign_keys=[used_by_parent_id])
 
 
+class DailyOrderStat(db.Model):
+    __tablename__ = 'DailyOrderStat'
+    __table_args__ = (UniqueConstraint('day', 'dish_id', 'status', name='uq_daily_order_stat'),)
+
+    id = db.Column(db.Integer, primary_key=True)
+    day = db.Column(db.Date, nullable=False, index=True)
+    dish_id = db.Column(db.Integer, nullable=False, index=True)
+    status = db.Column(db.String(32), nullable=False)
+    orders = db.Column(db.Integer, nullable=False, default=0)
+    revenue = db.Column(db.Integer, nullable=False, default=0)
+
+
+class DailyPaymentStat(db.Model):
+    __tablename__ = 'DailyPaymentStat'
+    __table_args__ = (UniqueConstraint('day', 'kind', name='uq_daily_payment_stat'),)
+
+    id = db.Column(db.Integer, primary_key=True)
+    day = db.Column(db.Date, nullable=False, index=True)
+    kind = db.Column(db.String(64), nullable=False)
+    operations = db.Column(db.Integer, nullable=False, default=0)
+    amount = db.Column(db.Integer, nullable=False, default=0)
+
+
+class DailyFeedbackStat(db.Model):
+    __tablename__ = 'DailyFeedbackStat'
+    __table_args__ = (UniqueConstraint('day', 'role', name='uq_daily_feedback_stat'),)
+
+    id = db.Column(db.Integer, primary_key=True)
+    day = db.Column(db.Date, nullable=False, index=True)
+    role = db.Column(db.String(40), nullable=False)
+    messages = db.Column(db.Integer, nullable=False, default=0)
+
+
+class RollupDirtyDay(db.Model):
+    __tablename__ = 'RollupDirtyDay'
+
+    day = db.Column(db.Date, primary_key=True)
+
+
+class DishForecast(db.Model):
+    __tablename__ = 'DishForecast'
+    __table_args__ = (UniqueConstraint('day', 'dish_id', name='uq_dish_forecast'),)
+
+    id = db.Column(db.Integer, primary_key=True)
+    day = db.Column(db.Date, nullable=False, index=True)
+    dish_id = db.Column(db.Integer, db.ForeignKey('Dish.id'), nullable=False, index=True)
+    portions = db.Column(db.Float, nullable=False, default=0)
+    baseline = db.Column(db.Float, nullable=False, default=0)
+    trend = db.Column(db.Float, nullable=False, default=1)
+    generated_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+
+class ReportSnapshot(db.Model):
+    __tablename__ = 'ReportSnapshot'
+
+    id = db.Column(db.Integer, primary_key=True)
+    scope = db.Column(db.String(40), unique=True, nullable=False, index=True)
+    payload = db.Column(db.Text, nullable=False, default='{}')
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+
+columnar_exporter = ColumnarExporter(
+    db,
+    COLUMNAR_EXPORT_DIR,
+    partitioned_models=[MealOrder, PaymentOperation, DishReview],
+    snapshot_models=[Dish],
+)
+
+
 def to_int(value, default=0):
     try:
         return int(float(str(value).replace(',', '.').strip()))
@@ -599,7 +803,7 @@ def resolve_super_admin_by_password(email, password):
     candidate = Users.query.filter_by(role='super_admin', is_active=True).order_by(Users.id.asc()).first()
     if not candidate:
         return None
-    if not check_password_hash(candidate.psw, password):
+    if not verify_user_password(candidate, password):
         return None
     if normalize_email(candidate.email) != normalized:
         candidate.email = normalized
@@ -650,10 +854,101 @@ def gen_code(length=None):
 
 
 def save_as_avif(img, output_path):
-    img.save(output_path, format='AVIF', quality=80, speed=6, subsampling='4:4:4')
+    img.save(output_path, format='AVIF', **AVIF_SAVE_OPTIONS)
+
+
+def plan_image_variants(image_path, widths):
+    folder, name = image_path.rsplit('/', 1)
+    stem = name.rsplit('.', 1)[0]
+    manifest = {}
+    for fmt in IMAGE_VARIANT_FORMATS:
+        manifest[fmt] = [
+            [width, image_path if fmt == 'avif' and width == widths[-1] else f'{folder}/sizes/{stem}-{width}.{fmt}']
+            for width in widths
+        ]
+    outputs = [(width, STATIC_DIR / path) for rows in manifest.values() for width, path in rows]
+    return outputs, manifest
+
+
+def image_srcset(manifest, fmt):
+    return ', '.join(f"{url_for('static', filename=path)} {width}w" for width, path in (manifest or {}).get(fmt) or [])
+
+
+def remove_image_variants(image_path, manifest):
+    paths = {image_path} | {path for rows in (manifest or {}).values() for _, path in rows}
+    for path in paths:
+        (STATIC_DIR / path).unlink(missing_ok=True)
+
+
+def submit_avatar_image(user, stream):
+    user_id = user.id
+    image_path = f'icons/{user_id}.avif'
+    outputs, manifest = plan_image_variants(image_path, AVATAR_IMAGE_WIDTHS)
+
+    def on_done(_result):
+        with app.app_context():
+            target = db.session.get(Users, user_id)
+            if target:
+                target.icon = True
+                target.dop_data = {**(target.dop_data or {}), 'avatar_variants': manifest}
+                db.session.commit()
+
+    return image_pipeline.submit(stream, outputs, owner_id=user_id, kind='avatar',
+                                 url=f'/static/{image_path}', on_done=on_done)
+
+
+def remove_avatar_image(user):
+    data = dict(user.dop_data or {})
+    remove_image_variants(f'icons/{user.id}.avif', data.pop('avatar_variants', None))
+    user.dop_data = data
+    user.icon = False
+
+
+def submit_dish_image(dish, stream, owner_id):
+    dish_id = dish.id
+    image_path = f'icons/dishes/{dish_id}.avif'
+    outputs, manifest = plan_image_variants(image_path, DISH_IMAGE_WIDTHS)
+
+    def on_done(_result):
+        with app.app_context():
+            target = db.session.get(Dish, dish_id)
+            if target:
+                target.image_path = image_path
+                target.image_variants = manifest
+                target.updated_at = datetime.utcnow()
+                db.session.commit()
+
+    return image_pipeline.submit(stream, outputs, owner_id=owner_id, kind='dish',
+                                 url=f'/static/{image_path}', on_done=on_done)
+
+
+def backfill_image_variants(limit=None):
+    submitted = {'dishes': 0, 'avatars': 0}
+    dishes = Dish.query.filter(Dish.image_path.like('icons/dishes/%.avif')).order_by(Dish.id.asc()).all()
+    for dish in dishes:
+        source = STATIC_DIR / dish.image_path
+        if dish.image_variants or not source.exists():
+            continue
+        if limit and sum(submitted.values()) >= limit:
+            return submitted
+        with source.open('rb') as stream:
+            submit_dish_image(dish, stream, None)
+        submitted['dishes'] += 1
+    for user in Users.query.filter_by(icon=True).order_by(Users.id.asc()).all():
+        source = ICON_DIR / f'{user.id}.avif'
+        if (user.dop_data or {}).get('avatar_variants') or not source.exists():
+            continue
+        if limit and sum(submitted.values()) >= limit:
+            return submitted
+        with source.open('rb') as stream:
+            submit_avatar_image(user, stream)
+        submitted['avatars'] += 1
+    return submitted
 
 
 def format_favicon_image(img, canvas_size=16):
+    from PIL import Image, ImageDraw, ImageEnhance, ImageFilter, ImageOps
+
     icon = img.convert('RGBA')
     if max(icon.size) > 2048:
         ratio = 2048 / max(icon.size)
@@ -712,6 +1007,8 @@ def save_favicon_assets(img, ico_path, avif_path=None, png_path=None):
 
 
 def convert_image_file_to_avif(source_path, target_path):
+    from PIL import Image
+
     try:
         image = Image.open(source_path).convert('RGBA')
         save_as_avif(image, target_path)
@@ -749,6 +1046,16 @@ def enforce_avif_assets():
             set_cfg(key, replacements[current])
 
 
+def favicon_assets_fresh(icon_path, generated_paths):
+    try:
+        if icon_path in generated_paths:
+            return all(path.exists() for path in generated_paths)
+        source_mtime = icon_path.stat().st_mtime
+        return all(path.stat().st_mtime >= source_mtime for path in generated_paths)
+    except OSError:
+        return False
+
+
 def ensure_theme_assets():
     enforce_avif_assets()
     default_ico = DEFAULT_CFG['ico_path']
@@ -762,7 +1069,12 @@ def ensure_theme_assets():
     generated_png_rel = 'ico/site_favicon_16.png'
     final_icon = default_ico
     final_icon_png = generated_png_rel
-    if icon_path.exists():
+    generated_paths = [STATIC_DIR / generated_ico_rel, STATIC_DIR / generated_avif_rel, STATIC_DIR / generated_png_rel]
+    if icon_path.exists() and favicon_assets_fresh(icon_path, generated_paths):
+        final_icon = generated_ico_rel
+    elif icon_path.exists():
+        from PIL import Image
+
         try:
             icon_img = Image.open(icon_path).convert('RGBA')
             save_favicon_assets(
@@ -894,6 +1206,19 @@ def ensure_column(table_name, column_name, column_sql):
             app.logger.error(f'ensure_column error: {str(e)}')
 
 
+def ensure_index(index_name, table_name, columns):
+    identifiers = [index_name, table_name, *columns]
+    if not all(re.match(r'^[a-zA-Z_][a-zA-Z0-9_]*$', value) for value in identifiers):
+        app.logger.error(f'ensure_index: Invalid identifier in {identifiers}')
+        return
+    column_sql = ', '.join(f'"{column}"' for column in columns)
+    try:
+        with db.engine.begin() as conn:
+            conn.execute(text(f'CREATE INDEX IF NOT EXISTS "{index_name}" ON "{table_name}" ({column_sql})'))
+    except Exception as e:
+        app.logger.error(f'ensure_index error: {str(e)}')
+
+
 def setup_database_schema():
     db.create_all()
     ensure_column('Users', 'role', "VARCHAR(32) DEFAULT 'student'")
@@ -910,8 +1235,27 @@ def setup_database_schema():
     ensure_column('Session', 'is_active', 'BOOLEAN DEFAULT 1')
     ensure_column('Session', 'last_seen', 'DATETIME')
     ensure_column('Dish', 'dish_group_id', 'INTEGER')
+    ensure_column('Dish', 'allergen_tags', 'VARCHAR(300)')
+    ensure_column('Dish', 'image_variants', 'JSON')
+    ensure_column('Dish', 'search_text', 'TEXT')
+    ensure_column('InventoryItem', 'grams_per_unit', 'FLOAT')
     ensure_column('MealOrder', 'payer_user_id', 'INTEGER')
     ensure_column('PaymentOperation', 'target_user_id', 'INTEGER')
+    ensure_index('ix_meal_order_plan', 'MealOrder', ['pre_order_date', 'status', 'dish_id'])
+    ensure_index('ix_meal_order_created_at', 'MealOrder', ['created_at'])
+    ensure_index('ix_payment_operation_created_at', 'PaymentOperation', ['created_at'])
+    ensure_index('ix_feedback_message_created_at', 'FeedbackMessage', ['created_at'])
+    ensure_index('ix_dish_menu_category', 'Dish', ['is_active', 'category', 'id'])
+    ensure_index('ix_dish_menu_group', 'Dish', ['is_active', 'dish_group_id', 'id'])
+    ensure_index('ix_dish_menu_price', 'Dish', ['is_active', 'price'])
+    ensure_index('ix_dish_menu_calories', 'Dish', ['is_active', 'calories'])
+    ensure_index('ix_dish_rating_stat_top', 'DishRatingStat', ['rating_avg', 'rating_count'])
+    ensure_index('ix_dish_review_dish_page', 'DishReview', ['dish_id', 'id'])
+    ensure_index('ix_dish_review_dish_user', 'DishReview', ['dish_id', 'user_id'])
+    dish_search.setup()
+    backfill_dish_derived_fields()
+    if not db.session.query(DishRatingStat.dish_id).first() and db.session.query(DishReview.id).first():
+        rebuild_dish_rating_stats()
 
 
 def ask_value(title, default=None, cast=str, validator=None, secret=False):
@@ -1010,6 +1354,8 @@ def normalize_asset_path(value, fallback):
 
 
 def save_project_settings_from_request(form, files):
+    from PIL import Image, ImageFilter
+
     site_name = form.get('site_name', '').strip() or get_cfg('Name', DEFAULT_CFG['Name'])
     school_name = form.get('school_name', '').strip() or get_cfg('Name_sch', DEFAULT_CFG['Name_sch'])
     contacts_raw = form.get('contacts_raw', '').strip()
@@ -1115,7 +1461,19 @@ def refresh_runtime_config():
     app.config['MAIL_USE_TLS'] = cfg_bool('mail_use_tls', True)
     app.config['MAIL_USERNAME'] = get_cfg('mail_username', '')
     app.config['MAIL_PASSWORD'] = get_cfg('mail_password', '')
-    mail.init_app(app)
+    proxy_fix.x_for = proxy_fix.x_proto = max(0, to_int(get_cfg('proxy_hops', 0), 0))
+    if mail is not None:
+        mail.init_app(app)
+    method = str(get_cfg('password_hash_method', 'scrypt') or '').strip()
+    if not is_valid_hash_method(method):
+        app.logger.warning(f'Unknown password hash method {method!r}, using scrypt')
+        method = 'scrypt'
+    password_hasher.configure(
+        method=method,
+        max_workers=max(1, to_int(get_cfg('password_hash_workers', 4), 4)),
+        max_queue=max(0, to_int(get_cfg('password_hash_queue', 32), 32)),
+    )
+    image_pipeline.configure(max(0, to_int(get_cfg('image_workers', 2), 2)))
 
 
 def ensure_super_admin(admin_email, admin_password=None):
@@ -1131,7 +1489,7 @@ def ensure_super_admin(admin_email, admin_password=None):
             admin_password = 'admin12345'
         user = Users(
             email=admin_email,
-            psw=generate_password_hash(admin_password),
+            psw=hash_password(admin_password),
             name='Super',
             surname='Admin',
             otchestvo='',
@@ -1160,7 +1518,7 @@ def ensure_super_admin(admin_email, admin_password=None):
         existing.registrating = True
         changed = True
     if admin_password:
-        existing.psw = generate_password_hash(admin_password)
+        existing.psw = hash_password(admin_password)
         changed = True
     if changed:
         db.session.commit()
@@ -1235,7 +1593,7 @@ def issue_setup_access_code(force=False):
         mode = 'auto'
         code = generate_setup_access_code(12)
 
-    set_cfg('setup_access_code_hash', generate_password_hash(code))
+    set_cfg('setup_access_code_hash', hash_password(code))
     set_cfg('setup_access_mode', mode)
     set_cfg('setup_access_hint', f'{code[:2]}***{code[-2:]}')
     set_cfg('setup_access_issued_at', datetime.utcnow().isoformat())
@@ -1266,17 +1624,27 @@ def run_first_setup(force=False):
     refresh_runtime_config()
 
 
+def get_mail():
+    global mail
+    if mail is None:
+        from flask_mail import Mail
+        mail = Mail(app)
+    return mail
+
+
 def send_email(to_email, subject, template, plain_text=None, **kwargs):
     if not cfg_bool('mail_enabled', False):
         return False
     if not app.config.get('MAIL_SERVER') or not app.config.get('MAIL_USERNAME'):
         return False
+    from flask_mail import Message
+
     try:
         message = Message(subject, sender=f"{get_cfg('Name')} <{get_cfg('mail_username')}>", recipients=[to_email])
         message.html = render_template(template, **kwargs)
         if plain_text is not None:
             message.body = plain_text
-        mail.send(message)
+        get_mail().send(message)
         return True
     except Exception as e:
         app.logger.error(f"Email send failed: {str(e)}")
@@ -1379,9 +1747,7 @@ def apply_pending_password_change(token):
     user.psw = pending.new_password_hash
     user.url_code = gen_code()
     Session.query.filter_by(user_id=user.id, is_active=True).update({'is_active': False})
-    for t, payload in list(session_cache.items()):
-        if payload.get('user_id') == user.id:
-            session_cache.pop(t, None)
+    session_cache.drop_user(user.id)
     pending.is_used = True
     db.session.commit()
     app.logger.info(f'Password changed for user {user.id}')
@@ -1536,12 +1902,48 @@ def check_otp_resend_cooldown(user_id):
     return 0
 
 
-def manage_cache():
-    if len(session_cache) <= MAX_CACHE_SIZE:
-        return
-    sorted_tokens = sorted(session_cache.items(), key=lambda item: item[1].get('last_seen', datetime.utcnow()))
-    for token, _ in sorted_tokens[:MAX_CACHE_SIZE // 2]:
-        session_cache.pop(token, None)
+def send_notification_email(recipient_email, title, body, target_link):
+    from flask_mail import Message
+
+    try:
+        message = Message(
+            f"{get_cfg('Name')}: {title}",
+            sender=f"{get_cfg('Name')} <{get_cfg('mail_username')}>",
+            recipients=[recipient_email],
+        )
+        safe_title = html_module.escape(str(title))
+        safe_body = html_module.escape(str(body))
+        safe_link = html_module.escape(str(target_link))
+        message.html = (
+            f"<h3>{safe_title}</h3>"
+            f"<p>{safe_body}</p>"
+            f"<p><a href='{safe_link}'>Открыть в приложении</a></p>"
+        )
+        get_mail().send(message)
+    except Exception as e:
+        app.logger.error(f'Failed to send email notification to {recipient_email}: {str(e)}')
+
+
+def notification_email_sender():
+    while True:
+        args = notification_email_queue.get()
+        try:
+            with app.app_context():
+                send_notification_email(*args)
+        finally:
+            notification_email_queue.task_done()
+
+
+def queue_notification_email(recipient, title, body, link=''):
+    global notification_email_worker
+    base_url = request.host_url.rstrip('/') if has_request_context() else ''
+    target_link = f"{base_url}{link or '/'}" if base_url else (link or '/')
+    notification_email_queue.put((recipient.email, title, body, target_link))
+    if notification_email_worker is None:
+        with notification_email_worker_lock:
+            if notification_email_worker is None:
+                notification_email_worker = Thread(target=notification_email_sender, daemon=True)
+                notification_email_worker.start()
 
 
 def create_notification(user_id, title, body, link=''):
@@ -1554,25 +1956,36 @@ def create_notification(user_id, title, body, link=''):
         return
     db.session.add(Notification(user_id=user_id, title=title, body=body, link=link or ''))
     if get_email_notifications_enabled(recipient) and cfg_bool('mail_enabled', False):
-        try:
-            base_url = request.host_url.rstrip('/') if has_request_context() else ''
-            target_link = f"{base_url}{link or '/'}" if base_url else (link or '/')
-            message = Message(
-                f"{get_cfg('Name')}: {title}",
-                sender=f"{get_cfg('Name')} <{get_cfg('mail_username')}>",
-                recipients=[recipient.email],
-            )
-            safe_title = html_module.escape(str(title))
-            safe_body = html_module.escape(str(body))
-            safe_link = html_module.escape(str(target_link))
-            message.html = (
-                f"<h3>{safe_title}</h3>"
-                f"<p>{safe_body}</p>"
-                f"<p><a href='{safe_link}'>Открыть в приложении</a></p>"
-            )
-            mail.send(message)
-        except Exception as e:
-            app.logger.error(f'Failed to send email notification to {recipient.email}: {str(e)}')
+        queue_notification_email(recipient, title, body, link)
+
+
+def create_notifications_bulk(entries):
+    entries = [entry for entry in entries if entry and entry[0]]
+    if not entries:
+        return 0
+    recipient_ids = {entry[0] for entry in entries}
+    recipients = {
+        user.id: user for user in Users.query.filter(Users.id.in_(recipient_ids), Users.is_active == True).all()
+    }
+    mail_enabled = cfg_bool('mail_enabled', False)
+    rows = []
+    emails = []
+    for user_id, title, body, link in entries:
+        recipient = recipients.get(user_id)
+        if not recipient:
+            continue
+        category = resolve_notification_category(title, link)
+        if not get_notification_preferences(recipient).get(category, True):
+            continue
+        rows.append({'user_id': user_id, 'title': title, 'body': body, 'link': link or '',
+                     'is_read': False, 'created_at': datetime.utcnow()})
+        if mail_enabled and get_email_notifications_enabled(recipient):
+            emails.append((recipient, title, body, link))
+    if rows:
+        db.session.execute(Notification.__table__.insert(), rows)
+    for recipient, title, body, link in emails:
+        queue_notification_email(recipient, title, body, link)
+    return len(rows)
 
 
 def create_notification_for_roles(min_role_level, title, body, link=''):
@@ -1587,11 +2000,11 @@ def check_session(token):
         return None, 'Необходимо войти в аккаунт.'
     now = datetime.utcnow()
 
-    if token in session_cache:
-        cached = session_cache[token]
+    cached = session_cache.get(token)
+    if cached:
         expires_at = cached.get('expires_at')
         if expires_at and now > expires_at:
-            session_cache.pop(token, None)
+            session_cache.pop(token)
             sess = Session.query.filter_by(token=token, is_active=True).first()
             if sess:
                 sess.is_active = False
@@ -1600,9 +2013,8 @@ def check_session(token):
         cached_user_id = cached.get('user_id')
         user = db.session.get(Users, cached_user_id) if cached_user_id else None
         if user and user.is_active:
-            session_cache[token]['last_seen'] = now
             return user, None
-        session_cache.pop(token, None)
+        session_cache.pop(token)
 
     sess = Session.query.filter_by(token=token, is_active=True).first()
     if not sess:
@@ -1622,8 +2034,7 @@ def check_session(token):
         sess.last_seen = now
         db.session.commit()
 
-    session_cache[token] = {'user_id': user.id, 'last_seen': now, 'expires_at': sess.expires_at}
-    manage_cache()
+    session_cache.put(token, user.id, sess.expires_at)
     return user, None
 
 
@@ -1665,7 +2076,6 @@ def is_valid_csrf_request():
 
 
 def sign_in_user(user):
-    manage_cache()
     token = secrets.token_urlsafe(64)
     session_hours = USER_ROLES.get(user.role, USER_ROLES['student'])['session_hours']
     expires_at = datetime.utcnow() + timedelta(hours=session_hours)
@@ -1681,7 +2091,7 @@ def sign_in_user(user):
     db.session.add(sess)
     db.session.commit()
 
-    session_cache[token] = {'user_id': user.id, 'last_seen': datetime.utcnow(), 'expires_at': expires_at}
+    session_cache.put(token, user.id, expires_at)
     response = make_response(redirect('/'))
     response.set_cookie('session_token', token, httponly=True, secure=False, samesite='Lax', expires=expires_at)
     return response
@@ -1692,7 +2102,7 @@ def logout_user_response():
     if token:
         Session.query.filter_by(token=token, is_active=True).update({'is_active': False})
         db.session.commit()
-        session_cache.pop(token, None)
+        session_cache.pop(token)
     response = make_response(redirect('/'))
     response.set_cookie('session_token', '', expires=0)
     return response
@@ -1733,7 +2143,6 @@ def build_base_context(user=None, **kwargs):
         'bg_light': bg_light,
         'bg_dark': bg_dark,
         'assets_rev': assets_rev,
-        'runtime_assets_rev': int(time.time()),
         'csrf_token': get_csrf_token(),
         'User': user,
         'user_id': str(user.id) if user else '',
@@ -1755,6 +2164,8 @@ def message_page(text, user=None, redirect_to='', status='info'):
 
 
 def resolve_favicon_file():
+    from PIL import Image
+
     default_icon_abs = STATIC_DIR / DEFAULT_CFG['ico_path']
     if not default_icon_abs.exists():
         default_icon_abs.parent.mkdir(parents=True, exist_ok=True)
@@ -1788,7 +2199,6 @@ def resolve_favicon_file():
     return default_icon_abs
 
 
-@app.route('/favicon.ico')
 def favicon():
     icon_abs = resolve_favicon_file()
     response = send_file(icon_abs, mimetype='image/x-icon', max_age=0)
@@ -1797,7 +2207,6 @@ def favicon():
     return response
 
 
-@app.route('/favicon.png')
 def favicon_png():
     png_rel = normalize_asset_path(
         get_cfg('ico_png_path', DEFAULT_CFG.get('ico_png_path', 'ico/site_favicon_16.png')),
@@ -1831,36 +2240,311 @@ def require_roles(roles):
     return user, None
 
 
-def dish_image_path(dish):
-    return dish.image_path if dish.image_path else 'icons/no_photo.svg'
+def dish_image_path(dish, width=None):
+    if not dish.image_path:
+        return 'icons/no_photo.svg'
+    if width:
+        for variant_width, path in (dish.image_variants or {}).get('avif') or []:
+            if variant_width >= width:
+                return path
+    return dish.image_path
 
 
-def build_menu_groups(dishes):
-    groups = {}
-    for dish in dishes:
-        group_obj = getattr(dish, 'dish_group', None)
-        if group_obj and group_obj.is_active:
-            key = f'group_{group_obj.id}'
-            sort_key = (0, to_int(group_obj.sort_order, 100), str(group_obj.title or '').lower())
-            title = str(group_obj.title or '').strip() or 'Группа меню'
-            description = str(group_obj.description or '').strip()
-            kind = 'custom'
+def search_dishes(query, limit=10, active_only=True):
+    dish_ids = dish_search.search_ids(query, limit=limit, active_only=active_only)
+    if not dish_ids:
+        return []
+    found = {dish.id: dish for dish in Dish.query.filter(Dish.id.in_(dish_ids)).all()}
+    return [found[dish_id] for dish_id in dish_ids if dish_id in found]
+
+
+ALLERGEN_KEYWORDS = {
+    'глютен': ['глютен', 'пшениц', 'мук', 'хлеб', 'макарон', 'крупа', 'манн', 'ячмен', 'рожь', 'овёс', 'овес'],
+    'лактоза': ['лактоз', 'молок', 'сливк', 'масл', 'сыр', 'творог', 'кефир', 'йогурт', 'сметан', 'молочн'],
+    'орехи': ['орех', 'миндал', 'фундук', 'кешью', 'грецк', 'арахис', 'фисташ'],
+    'яйца': ['яйц', 'яйко', 'омлет', 'желток', 'белок яйц'],
+    'рыба': ['рыб', 'лосос', 'треск', 'сельд', 'тунец', 'скумбри', 'минтай', 'судак', 'карп'],
+    'соя': ['соя', 'сои', 'соев'],
+    'кунжут': ['кунжут', 'тахин', 'сезам'],
+}
+DISH_CATEGORY_LABELS = {'breakfast': 'Завтрак', 'lunch': 'Обед'}
+MENU_PAGE_SIZE = 24
+MENU_PAGE_SIZE_MAX = 96
+MENU_GROUP_PREVIEW_SIZE = 3
+
+
+def detect_dish_allergens(dish):
+    explicit = [a.strip().lower() for a in (dish.allergens or '').split(',') if a.strip()]
+    if explicit:
+        return explicit
+    search_text = ' '.join([dish.title or '', dish.composition or '', dish.description or '']).lower()
+    return [key for key, words in ALLERGEN_KEYWORDS.items() if any(w in search_text for w in words)]
+
+
+def dish_allergen_list(dish):
+    if dish.allergen_tags is None:
+        return detect_dish_allergens(dish)
+    return [tag for tag in dish.allergen_tags.split(',') if tag]
+
+
+@event.listens_for(Dish, 'before_insert')
+@event.listens_for(Dish, 'before_update')
+def sync_dish_derived_fields(mapper, connection, target):
+    tags = detect_dish_allergens(target)
+    target.allergen_tags = f",{','.join(tags)}," if tags else ''
+    target.search_text = build_search_text(target.title, target.composition, target.description, target.allergens)
+
+
+def backfill_dish_derived_fields(batch_size=500):
+    updated = 0
+    while True:
+        dishes = Dish.query.filter(or_(Dish.allergen_tags.is_(None), Dish.search_text.is_(None))).limit(
+            batch_size).all()
+        if not dishes:
+            break
+        for dish in dishes:
+            dish.allergen_tags = ''
+            dish.search_text = ''
+        db.session.commit()
+        updated += len(dishes)
+    return updated
+
+
+def parse_menu_filters(args, default_exclude=()):
+    def number(name, upper=None):
+        value = to_float(args.get(name), None) if str(args.get(name) or '').strip() else None
+        if value is None or value < 0:
+            return None
+        return min(value, upper) if upper is not None else value
+
+    exclude = args.getlist('exclude') if args.get('f') else list(default_exclude or [])
+    category = str(args.get('category') or '').strip()
+    return {
+        'category': category if category in DISH_CATEGORY_LABELS else '',
+        'exclude': [key for key in dict.fromkeys(str(v).strip().lower() for v in exclude) if key in ALLERGEN_KEYWORDS],
+        'price_min': number('price_min'),
+        'price_max': number('price_max'),
+        'calories_min': number('calories_min'),
+        'calories_max': number('calories_max'),
+        'min_rating': number('min_rating', 5),
+    }
+
+
+def menu_filter_args(filters):
+    args = [('f', '1')]
+    for key, value in filters.items():
+        if key == 'exclude':
+            args.extend(('exclude', item) for item in value)
+        elif value not in (None, ''):
+            args.append((key, int(value) if isinstance(value, float) and value.is_integer() else value))
+    return args
+
+
+def menu_group_key_expr():
+    return case(
+        (DishGroup.is_active.is_(True), literal('group_') + cast(Dish.dish_group_id, db.String)),
+        else_=literal('category_') + func.coalesce(Dish.category, 'lunch'),
+    )
+
+
+def build_menu_query(filters=None, group_key=None, day_of_week=None):
+    filters = filters or {}
+    query = Dish.query.outerjoin(DishGroup, DishGroup.id == Dish.dish_group_id).filter(Dish.is_active.is_(True))
+    if group_key:
+        kind, _, value = str(group_key).partition('_')
+        if kind == 'group' and value.isdigit():
+            query = query.filter(Dish.dish_group_id == int(value), DishGroup.is_active.is_(True))
+        elif kind == 'category' and value:
+            query = query.filter(Dish.category == value, or_(DishGroup.id.is_(None), DishGroup.is_active.is_(False)))
         else:
-            title = 'Завтраки' if dish.category == 'breakfast' else 'Обеды'
-            rank = 0 if dish.category == 'breakfast' else 1
-            key = f'category_{dish.category or "lunch"}'
-            sort_key = (1, rank, title.lower())
-            description = 'Блюда основной категории меню'
-            kind = 'category'
-        entry = groups.get(key)
-        if not entry:
-            entry = {'key': key, 'title': title, 'description': description, 'kind': kind, 'sort_key': sort_key,
-                     'dishes': []}
-            groups[key] = entry
-        entry['dishes'].append(dish)
+            query = query.filter(false())
+    if day_of_week is not None:
+        query = query.filter(Dish.id.in_(select(WeeklyMenu.dish_id).where(WeeklyMenu.day_of_week == day_of_week)))
+    if filters.get('category'):
+        query = query.filter(Dish.category == filters['category'])
+    for key in filters.get('exclude') or []:
+        query = query.filter(~func.coalesce(Dish.allergen_tags, '').contains(f',{key},', autoescape=True))
+    if filters.get('price_min') is not None:
+        query = query.filter(Dish.price >= filters['price_min'])
+    if filters.get('price_max') is not None:
+        query = query.filter(Dish.price <= filters['price_max'])
+    if filters.get('calories_min') is not None:
+        query = query.filter(Dish.calories >= filters['calories_min'])
+    if filters.get('calories_max') is not None:
+        query = query.filter(Dish.calories <= filters['calories_max'])
+    if filters.get('min_rating'):
+        query = query.filter(Dish.id.in_(
+            select(DishRatingStat.dish_id).where(DishRatingStat.rating_avg >= filters['min_rating'])
+        ))
+    return query
+
+
+def paginate_menu_query(query, cursor=None, page_size=MENU_PAGE_SIZE):
+    page_size = max(1, min(to_int(page_size, MENU_PAGE_SIZE), MENU_PAGE_SIZE_MAX))
+    cursor = to_int(cursor, 0)
+    if cursor > 0:
+        query = query.filter(Dish.id < cursor)
+    dishes = query.order_by(Dish.id.desc()).limit(page_size + 1).all()
+    next_cursor = dishes[page_size - 1].id if len(dishes) > page_size else None
+    return dishes[:page_size], next_cursor
+
+
+def menu_group_meta(group_key, group_obj=None):
+    kind, _, value = str(group_key).partition('_')
+    if kind == 'group' and group_obj is not None:
+        return {
+            'key': group_key,
+            'title': str(group_obj.title or '').strip() or 'Группа меню',
+            'description': str(group_obj.description or '').strip(),
+            'kind': 'custom',
+            'group_id': group_obj.id,
+            'sort_key': (0, to_int(group_obj.sort_order, 100), str(group_obj.title or '').lower()),
+        }
+    if kind == 'category' and value:
+        title = 'Завтраки' if value == 'breakfast' else 'Обеды'
+        return {
+            'key': group_key,
+            'title': title,
+            'description': 'Блюда основной категории меню',
+            'kind': 'category',
+            'group_id': None,
+            'sort_key': (1, 0 if value == 'breakfast' else 1, title.lower()),
+        }
+    return None
+
+
+def resolve_menu_group(group_key):
+    kind, _, value = str(group_key).partition('_')
+    if kind == 'group':
+        group_obj = db.session.get(DishGroup, int(value)) if value.isdigit() else None
+        return menu_group_meta(group_key, group_obj) if group_obj and group_obj.is_active else None
+    return menu_group_meta(group_key)
+
+
+def build_menu_groups(filters=None, day_of_week=None, preview_size=MENU_GROUP_PREVIEW_SIZE):
+    base = build_menu_query(filters, day_of_week=day_of_week)
+    key_expr = menu_group_key_expr().label('group_key')
+    counts = dict(base.with_entities(key_expr, func.count(Dish.id)).group_by(key_expr).all())
+    if not counts:
+        return []
+
+    group_ids = [int(key[6:]) for key in counts if key.startswith('group_') and key[6:].isdigit()]
+    group_objs = {item.id: item for item in DishGroup.query.filter(DishGroup.id.in_(group_ids)).all()} if group_ids else {}
+    groups = {}
+    for key, count in counts.items():
+        group_obj = group_objs.get(int(key[6:])) if key.startswith('group_') and key[6:].isdigit() else None
+        entry = menu_group_meta(key, group_obj)
+        if entry:
+            preview = build_menu_query(filters, group_key=key, day_of_week=day_of_week)
+            groups[key] = dict(entry, count=count, dishes=preview.order_by(Dish.id.desc()).limit(preview_size).all())
     return sorted(groups.values(), key=lambda item: item['sort_key'])
 
 
+def apply_dish_rating_change(dish_id, old_rating=None, new_rating=None):
+    old_rating = max(1, min(5, to_int(old_rating, 0))) if old_rating is not None else None
+    new_rating = max(1, min(5, to_int(new_rating, 0))) if new_rating is not None else None
+    if old_rating == new_rating:
+        return
+    db.session.execute(sqlite_insert(DishRatingStat).values(dish_id=dish_id).on_conflict_do_nothing(
+        index_elements=[DishRatingStat.dish_id]))
+    count_delta = (new_rating is not None) - (old_rating is not None)
+    sum_delta = (new_rating or 0) - (old_rating or 0)
+    values = {
+        'rating_sum': DishRatingStat.rating_sum + sum_delta,
+        'rating_count': DishRatingStat.rating_count + count_delta,
+        'rating_avg': case(
+            (DishRatingStat.rating_count + count_delta > 0,
+             cast(DishRatingStat.rating_sum + sum_delta, db.Float) / (DishRatingStat.rating_count + count_delta)),
+            else_=0.0,
+        ),
+        'updated_at': datetime.utcnow(),
+    }
+    if old_rating is not None:
+        values[f'rating_{old_rating}'] = getattr(DishRatingStat, f'rating_{old_rating}') - 1
+    if new_rating is not None:
+        values[f'rating_{new_rating}'] = getattr(DishRatingStat, f'rating_{new_rating}') + 1
+    DishRatingStat.query.filter(DishRatingStat.dish_id == dish_id).update(values, synchronize_session=False)
+
+
+def rebuild_dish_rating_stats():
+    rows = (
+        db.session.query(
+            DishReview.dish_id,
+            func.sum(DishReview.rating),
+            func.count(DishReview.id),
+            *[func.sum(case((DishReview.rating == value, 1), else_=0)) for value in range(1, 6)],
+        )
+        .group_by(DishReview.dish_id)
+        .all()
+    )
+    DishRatingStat.query.delete(synchronize_session=False)
+    now = datetime.utcnow()
+    db.session.bulk_insert_mappings(DishRatingStat, [{
+        'dish_id': row[0],
+        'rating_sum': to_int(row[1], 0),
+        'rating_count': to_int(row[2], 0),
+        'rating_avg': (to_int(row[1], 0) / row[2]) if row[2] else 0.0,
+        **{f'rating_{value}': to_int(row[2 + value], 0) for value in range(1, 6)},
+        'updated_at': now,
+    } for row in rows])
+    db.session.commit()
+    return len(rows)
+
+
+def load_dish_rating_stats(dish_ids):
+    dish_ids = list(dish_ids)
+    if not dish_ids:
+        return {}
+    rows = DishRatingStat.query.filter(DishRatingStat.dish_id.in_(dish_ids), DishRatingStat.rating_count > 0).all()
+    return {row.dish_id: {'avg': round(row.rating_avg or 0, 1), 'count': row.rating_count} for row in rows}
+
+
+REVIEWS_PAGE_SIZE = 20
+
+
+def serialize_dish_review(review, author):
+    return {
+        'id': review.id,
+        'author': f'{author.surname} {author.name}'.strip(),
+        'rating': review.rating,
+        'text': review.review_text,
+        'date': review.created_at.strftime('%d.%m.%Y %H:%M') if review.created_at else '',
+    }
+
+
+def load_dish_reviews(dish_id, before=None, limit=REVIEWS_PAGE_SIZE):
+    limit = max(1, min(to_int(limit, REVIEWS_PAGE_SIZE), 100))
+    query = (
+        db.session.query(DishReview, Users)
+        .join(Users, Users.id == DishReview.user_id)
+        .filter(DishReview.dish_id == dish_id)
+    )
+    before = to_int(before, 0)
+    if before > 0:
+        query = query.filter(DishReview.id < before)
+    rows = query.order_by(DishReview.id.desc()).limit(limit + 1).all()
+    next_cursor = rows[limit - 1][0].id if len(rows) > limit else None
+    return [serialize_dish_review(review, author) for review, author in rows[:limit]], next_cursor
+
+
+def load_user_dish_review(dish_id, user):
+    if not user:
+        return None
+    review = DishReview.query.filter_by(dish_id=dish_id, user_id=user.id).first()
+    return serialize_dish_review(review, user) if review else None
+
+
+def top_rated_dishes(limit=5):
+    return (
+        db.session.query(Dish, DishRatingStat)
+        .join(DishRatingStat, DishRatingStat.dish_id == Dish.id)
+        .filter(Dish.is_active.is_(True), DishRatingStat.rating_count > 0)
+        .order_by(DishRatingStat.rating_avg.desc(), DishRatingStat.rating_count.desc())
+        .limit(limit)
+        .all()
+    )
+
+
 def parse_meal_date(raw):
     if not raw:
         return date.today()
@@ -1879,6 +2563,112 @@ def parse_order_status_label(status):
     }.get(status, status)
 
 
+def resolve_public_base_url():
+    configured = str(get_cfg('public_url', '') or '').strip().rstrip('/')
+    if configured:
+        return configured
+    if has_request_context():
+        return request.host_url.rstrip('/')
+    return ''
+
+
+def build_order_scan_url(order_id, base_url=None):
+    return f'{base_url or resolve_public_base_url()}/order/{order_id}/scan/'
+
+
+def pregenerate_preorder_qr_codes(target_date=None):
+    target_date = target_date or (date.today() + timedelta(days=1))
+    base_url = resolve_public_base_url()
+    if not base_url:
+        return 0
+    order_ids = [
+        row[0] for row in db.session.query(MealOrder.id)
+        .filter(MealOrder.pre_order_date == target_date, MealOrder.status == 'ordered')
+        .all()
+    ]
+    return qr_cache.pregenerate(build_order_scan_url(order_id, base_url) for order_id in order_ids)
+
+
+ORDER_SCAN_CODE_RE = re.compile(r'/order/(\d+)/scan/?')
+BULK_ISSUE_MAX_ORDERS = 500
+
+
+def parse_order_codes(values):
+    order_ids = []
+    invalid = []
+    seen = set()
+    for raw in values or []:
+        value = str(raw or '').strip()
+        if not value:
+            continue
+        match = ORDER_SCAN_CODE_RE.search(value)
+        order_id = int(match.group(1)) if match else (int(value) if value.isdigit() else 0)
+        if order_id <= 0:
+            invalid.append(value[:200])
+            continue
+        if order_id not in seen:
+            seen.add(order_id)
+            order_ids.append(order_id)
+    return order_ids, invalid
+
+
+def issue_orders_bulk(order_ids, notice=None):
+    order_ids = list(dict.fromkeys(int(x) for x in order_ids))[:BULK_ISSUE_MAX_ORDERS]
+    result = {'issued': [], 'skipped': [], 'not_found': []}
+    if not order_ids:
+        return result
+    eligible = (MealOrder.id.in_(order_ids), MealOrder.status == 'ordered')
+    issue = (
+        update(MealOrder).where(*eligible).values(status='issued', issued_at=datetime.utcnow())
+        .execution_options(synchronize_session=False)
+    )
+    if db.engine.dialect.update_returning:
+        issued_ids = set(db.session.execute(issue.returning(MealOrder.id)).scalars())
+    else:
+        issued_ids = set(db.session.execute(select(MealOrder.id).where(*eligible).with_for_update()).scalars())
+        if issued_ids:
+            db.session.execute(issue.where(MealOrder.id.in_(issued_ids)))
+    if issued_ids:
+        note_report_tables_touched(db.session, MealOrder.__tablename__)
+    rows = (
+        db.session.query(MealOrder.id, MealOrder.user_id, MealOrder.dish_id, MealOrder.status, MealOrder.created_at,
+                         Dish.title, Users.surname, Users.name)
+        .join(Dish, Dish.id == MealOrder.dish_id)
+        .join(Users, Users.id == MealOrder.user_id)
+        .filter(MealOrder.id.in_(order_ids))
+        .all()
+    )
+    found = {row.id: row for row in rows}
+    notifications = []
+    issued_portions = {}
+    for order_id in order_ids:
+        row = found.get(order_id)
+        if not row:
+            result['not_found'].append(order_id)
+            continue
+        student = f'{row.surname} {row.name}'.strip()
+        if order_id in issued_ids:
+            result['issued'].append({'id': order_id, 'dish': row.title, 'student': student})
+            issued_portions[row.dish_id] = issued_portions.get(row.dish_id, 0) + 1
+            if notice:
+                notifications.append((row.user_id, *notice))
+            else:
+                notifications.append((
+                    row.user_id,
+                    'Заказ выдан',
+                    f'Ваш заказ «{row.title}» выдан. Заберите у стойки.',
+                    f'/order/{order_id}/qr/',
+                ))
+        else:
+            result['skipped'].append({'id': order_id, 'dish': row.title, 'student': student, 'status': row.status})
+    consume_inventory(issued_portions)
+    mark_rollup_days_dirty(db.session, [rollup_day(found[order_id].created_at) for order_id in issued_ids
+                                        if order_id in found and found[order_id].created_at])
+    create_notifications_bulk(notifications)
+    db.session.commit()
+    return result
+
+
 def build_orders_view(user, limit=80, status_filter='all', period_filter='all'):
     status_filter = str(status_filter or 'all').strip().lower()
     period_filter = str(period_filter or 'all').strip().lower()
@@ -2250,238 +3040,704 @@ def can_change_user_role(manager, target, new_role):
     return True
 
 
-def make_dataset(label, values, color):
-    return {
-        'label': label,
-        'data': values,
-        'backgroundColor': color,
-        'borderColor': color,
-        'tension': 0.35,
-        'fill': False,
-    }
+DAY_SHORT_NAMES_RU = ['Пн', 'Вт', 'Ср', 'Чт', 'Пт', 'Сб', 'Вс']
 
 
-def build_report_payload(user):
-    if user.role in {'student', 'parent'}:
-        since = datetime.utcnow() - timedelta(days=30)
-        is_parent_view = user.role == 'parent'
-        linked_children = get_parent_children_rows(user.id, active_only=True) if is_parent_view else []
-        target_user_ids = [child.id for _, child in linked_children] if is_parent_view else [user.id]
-        query_ids = target_user_ids if target_user_ids else [-1]
+INVENTORY_GRAMS_PER_UNIT = {'г': 1.0, 'гр': 1.0, 'g': 1.0, 'мл': 1.0, 'ml': 1.0,
+                            'кг': 1000.0, 'kg': 1000.0, 'л': 1000.0, 'l': 1000.0}
+INVENTORY_PROJECTION_DAYS = 7
 
-        rows = (
-            db.session.query(MealOrder, Dish)
-            .join(Dish, Dish.id == MealOrder.dish_id)
-            .filter(MealOrder.user_id.in_(query_ids), MealOrder.created_at >= since)
-            .order_by(MealOrder.created_at.asc())
-            .all()
-        )
-        labels = []
-        spending = []
-        calories = []
-        day_index = {}
-        for step in range(30):
-            day = (date.today() - timedelta(days=29 - step)).strftime('%d.%m')
-            labels.append(day)
-            spending.append(0)
-            calories.append(0)
-            day_index[day] = step
-        for order, dish in rows:
-            key = order.created_at.strftime('%d.%m')
-            if key in day_index:
-                idx = day_index[key]
-                spending[idx] += max(order.price, 0)
-                calories[idx] += max(dish.calories, 0)
 
-        recent_orders = (
-            db.session.query(MealOrder, Dish, Users)
-            .join(Dish, Dish.id == MealOrder.dish_id)
-            .join(Users, Users.id == MealOrder.user_id)
-            .filter(MealOrder.user_id.in_(query_ids))
-            .order_by(MealOrder.created_at.desc())
-            .limit(25)
-            .all()
-        )
+def inventory_grams_per_unit(unit, grams_per_unit=None):
+    if grams_per_unit and grams_per_unit > 0:
+        return grams_per_unit
+    return INVENTORY_GRAMS_PER_UNIT.get(str(unit or '').strip().lower().rstrip('.'))
 
-        table_columns = ['Дата', 'Блюдо', 'Статус', 'Цена', 'Ккал']
-        table_keys = ['date', 'dish', 'status', 'price', 'kcal']
-        if is_parent_view:
-            table_columns.insert(1, 'Ребенок')
-            table_keys.insert(1, 'student')
 
-        table_rows = []
-        for order, dish, student_user in recent_orders:
-            row = {
-                'date': order.created_at.strftime('%d.%m.%Y %H:%M'),
-                'dish': dish.title,
-                'status': parse_order_status_label(order.status),
-                'price': f'{order.price} ₽',
-                'kcal': f'{int(dish.calories)} ккал',
-            }
-            if is_parent_view:
-                row['student'] = build_child_display_name(student_user)
-            table_rows.append(row)
-
-        tables = [{
-            'title': 'История заказов',
-            'columns': table_columns,
-            'keys': table_keys,
-            'rows': table_rows,
-        }]
-
-        recent_spent = sum(max(order.price, 0) for order, _, _ in recent_orders)
-        received_count = sum(1 for order, _, _ in recent_orders if order.status == 'received')
-        if is_parent_view:
-            all_time_spent = (
-                                 db.session.query(func.coalesce(func.sum(MealOrder.price), 0))
-                                 .filter(MealOrder.user_id.in_(query_ids))
-                                 .scalar()
-                             ) or 0
-            cards = [
-                {'title': 'Привязанных детей', 'value': len(target_user_ids)},
-                {'title': 'Заказы за 30 дней', 'value': len(recent_orders)},
-                {'title': 'Расходы за 30 дней', 'value': f'{recent_spent} ₽'},
-                {'title': 'Общие расходы', 'value': f'{to_int(all_time_spent, 0)} ₽'},
-            ]
-        else:
-            cards = [
-                {'title': 'Заказы за 30 дней', 'value': len(recent_orders)},
-                {'title': 'Расходы за 30 дней', 'value': f'{recent_spent} ₽'},
-                {'title': 'Получено блюд', 'value': received_count},
-            ]
-
-        charts = [
-            {
-                'title': 'Расходы по дням',
-                'type': 'bar',
-                'labels': labels,
-                'datasets': [make_dataset('Расходы, ₽', spending, 'rgba(140, 140, 140, 0.5)')],
-            },
-            {
-                'title': 'Калорийность по дням',
-                'type': 'line',
-                'labels': labels,
-                'datasets': [make_dataset('Ккал', calories, 'rgba(92, 92, 92, 0.5)')],
-            },
-        ]
-        title = 'Отчетность школьника'
-        subtitle = 'Аналитика заказов и расходов за последние 30 дней.'
-        if is_parent_view:
-            title = 'Семейная отчетность'
-            subtitle = 'Агрегированные расходы и заказы по всем привязанным детям.'
-        return {'title': title, 'subtitle': subtitle, 'charts': charts, 'tables': tables, 'cards': cards}
-
-    if user.role == 'chef':
-        popular_rows = (
-            db.session.query(Dish.title, func.count(MealOrder.id))
-            .join(MealOrder, MealOrder.dish_id == Dish.id)
-            .group_by(Dish.id)
-            .order_by(func.count(MealOrder.id).desc())
-            .limit(12)
-            .all()
-        )
-        status_rows = db.session.query(MealOrder.status, func.count(MealOrder.id)).group_by(MealOrder.status).all()
-        low_rows = InventoryItem.query.filter(InventoryItem.quantity <= InventoryItem.min_quantity).all()
-        pending_rows = PurchaseRequest.query.filter_by(status='pending').order_by(
-            PurchaseRequest.created_at.desc()).limit(20).all()
-
-        charts = [
-            {'title': 'Популярность блюд', 'type': 'bar',
-             'labels': [row[0] for row in popular_rows],
-             'datasets': [make_dataset('Заказы', [row[1] for row in popular_rows], 'rgba(118, 118, 118, 0.5)')]},
-            {'title': 'Статусы заказов', 'type': 'doughnut',
-             'labels': [parse_order_status_label(row[0]) for row in status_rows],
-             'datasets': [make_dataset('Количество', [row[1] for row in status_rows], [
-                 'rgba(72, 72, 72, 0.5)', 'rgba(102, 102, 102, 0.5)', 'rgba(132, 132, 132, 0.5)',
-                 'rgba(162, 162, 162, 0.5)'
-             ])]},
-        ]
-        tables = [{
-            'title': 'Критические остатки и заявки',
-            'columns': ['Позиция', 'Факт', 'Мин', 'Статус'],
-            'keys': ['name', 'fact', 'min', 'status'],
-            'rows': (
-                    [{'name': row.name, 'fact': f'{row.quantity:.2f} {row.unit}',
-                      'min': f'{row.min_quantity:.2f} {row.unit}', 'status': 'Остаток'} for row in low_rows] +
-                    [{'name': row.item_name, 'fact': f'{row.quantity:.2f} {row.unit}', 'min': f'{row.expected_cost} ₽',
-                      'status': 'Заявка pending'} for row in pending_rows]
+def compute_ingredient_consumption(dish_portions):
+    dish_portions = {dish_id: count for dish_id, count in dish_portions.items() if count}
+    if not dish_portions:
+        return {}
+    rows = (
+        db.session.query(DishIngredient.dish_id, DishIngredient.item_id, DishIngredient.grams, InventoryItem.unit,
+                         InventoryItem.grams_per_unit)
+        .join(InventoryItem, InventoryItem.id == DishIngredient.item_id)
+        .filter(DishIngredient.dish_id.in_(list(dish_portions)))
+        .all()
+    )
+    consumption = {}
+    for dish_id, item_id, grams, unit, grams_per_unit in rows:
+        factor = inventory_grams_per_unit(unit, grams_per_unit)
+        if not factor:
+            app.logger.warning(f'Inventory item {item_id} has no grams per {unit!r}, skipped in consumption')
+            continue
+        consumption[item_id] = consumption.get(item_id, 0) + grams * dish_portions[dish_id] / factor
+    return consumption
+
+
+def consume_inventory(dish_portions):
+    consumption = compute_ingredient_consumption(dish_portions)
+    if not consumption:
+        return consumption
+    db.session.query(InventoryItem).filter(InventoryItem.id.in_(list(consumption))).update({
+        'quantity': InventoryItem.quantity - case(consumption, value=InventoryItem.id, else_=0),
+        'updated_at': datetime.utcnow(),
+    }, synchronize_session=False)
+    return consumption
+
+
+def project_inventory(start=None, days=INVENTORY_PROJECTION_DAYS):
+    start = start or date.today()
+    end = start + timedelta(days=days - 1)
+    service_day = func.coalesce(MealOrder.pre_order_date, start)
+    demand_rows = (
+        db.session.query(service_day, MealOrder.dish_id, func.count(MealOrder.id))
+        .filter(
+            MealOrder.status == 'ordered',
+            or_(
+                MealOrder.pre_order_date.is_(None) & (MealOrder.meal_date == start),
+                (MealOrder.pre_order_date >= start) & (MealOrder.pre_order_date <= end),
             ),
-        }]
-        cards = [
-            {'title': 'Блюд в меню', 'value': Dish.query.filter_by(is_active=True).count()},
-            {'title': 'Критических остатков', 'value': len(low_rows)},
-            {'title': 'Заявок pending', 'value': len(pending_rows)},
-        ]
-        return {'title': 'Отчётность кухни', 'subtitle': 'Контроль выдачи, популярности блюд и складских позиций.',
-                'charts': charts, 'tables': tables, 'cards': cards}
-
-    if user.role == 'moder':
-        status_rows = db.session.query(FeedbackThread.status, func.count(FeedbackThread.id)).group_by(
-            FeedbackThread.status).all()
-        msg_rows = (
-            db.session.query(func.strftime('%Y-%m-%d', FeedbackMessage.created_at), func.count(FeedbackMessage.id))
-            .filter(FeedbackMessage.role.in_(['moder', 'admin', 'super_admin']))
-            .group_by(func.strftime('%Y-%m-%d', FeedbackMessage.created_at))
-            .order_by(func.strftime('%Y-%m-%d', FeedbackMessage.created_at).desc())
-            .limit(14)
-            .all()
         )
-        msg_rows = list(reversed(msg_rows))
-        open_threads = FeedbackThread.query.filter_by(status='open').order_by(FeedbackThread.updated_at.desc()).limit(
-            25).all()
-
-        charts = [
-            {'title': 'Статус обращений', 'type': 'pie',
-             'labels': ['Открыто' if row[0] == 'open' else 'Закрыто' for row in status_rows],
-             'datasets': [make_dataset('Обращения', [row[1] for row in status_rows],
-                                       ['rgba(86, 86, 86, 0.5)', 'rgba(148, 148, 148, 0.5)'])]},
-            {'title': 'Ответы модерации по дням', 'type': 'line',
-             'labels': [datetime.strptime(row[0], '%Y-%m-%d').strftime('%d.%m') for row in msg_rows],
-             'datasets': [make_dataset('Сообщения', [row[1] for row in msg_rows], 'rgba(108, 108, 108, 0.5)')]},
-        ]
-        tables = [{
-            'title': 'Открытые обращения',
-            'columns': ['ID', 'Тема', 'Обновлено'],
-            'keys': ['id', 'subject', 'updated'],
-            'rows': [{'id': row.id, 'subject': row.subject, 'updated': row.updated_at.strftime('%d.%m.%Y %H:%M')} for
-                     row in open_threads],
-        }]
-        cards = [
-            {'title': 'Открыто', 'value': sum(row[1] for row in status_rows if row[0] == 'open')},
-            {'title': 'Закрыто', 'value': sum(row[1] for row in status_rows if row[0] == 'closed')},
-            {'title': 'Всего тредов', 'value': FeedbackThread.query.count()},
-        ]
-        return {'title': 'Отчётность модерации', 'subtitle': 'Контроль очереди обратной связи и скорости ответов.',
-                'charts': charts, 'tables': tables, 'cards': cards}
-
-    role_rows = db.session.query(Users.role, func.count(Users.id)).filter(Users.is_active == True).group_by(
-        Users.role).all()
-    attendance_rows = db.session.query(MealOrder.status, func.count(MealOrder.id)).group_by(MealOrder.status).all()
-    purchase_rows = db.session.query(PurchaseRequest.status, func.count(PurchaseRequest.id)).group_by(
-        PurchaseRequest.status).all()
-    top_dishes = (
-        db.session.query(Dish.title, func.count(MealOrder.id), func.sum(MealOrder.price))
-        .join(MealOrder, MealOrder.dish_id == Dish.id)
-        .group_by(Dish.id)
-        .order_by(func.count(MealOrder.id).desc())
-        .limit(15)
+        .group_by(service_day, MealOrder.dish_id)
         .all()
     )
-    payment_rows = (
-        db.session.query(func.strftime('%Y-%m-%d', PaymentOperation.created_at), func.sum(PaymentOperation.amount))
-        .group_by(func.strftime('%Y-%m-%d', PaymentOperation.created_at))
-        .order_by(func.strftime('%Y-%m-%d', PaymentOperation.created_at).desc())
-        .limit(14)
+    demand_by_day = {}
+    for day, dish_id, count in demand_rows:
+        day = start if day is None else rollup_day(day)
+        demand_by_day.setdefault(max(day, start), {})[dish_id] = count
+
+    usage_by_day = {day: compute_ingredient_consumption(portions) for day, portions in demand_by_day.items()}
+    projections = []
+    for item in InventoryItem.query.order_by(InventoryItem.name.asc()).all():
+        remaining = item.quantity
+        required = 0
+        below_min_on = start if remaining <= item.min_quantity else None
+        runs_out_on = None
+        for day in sorted(usage_by_day):
+            amount = usage_by_day[day].get(item.id, 0)
+            if not amount:
+                continue
+            required += amount
+            remaining -= amount
+            if below_min_on is None and remaining <= item.min_quantity:
+                below_min_on = day
+            if runs_out_on is None and remaining < 0:
+                runs_out_on = day
+        if not required and item.quantity > item.min_quantity:
+            continue
+        projections.append({
+            'item_id': item.id,
+            'name': item.name,
+            'unit': item.unit,
+            'quantity': item.quantity,
+            'min_quantity': item.min_quantity,
+            'required': round(required, 3),
+            'remaining': round(remaining, 3),
+            'below_min_on': below_min_on,
+            'runs_out_on': runs_out_on,
+            'to_buy': round(max(0.0, required + item.min_quantity - item.quantity), 3),
+        })
+    projections.sort(key=lambda row: (row['runs_out_on'] is None, row['below_min_on'] is None, -row['to_buy'],
+                                      row['name'].lower()))
+    return projections
+
+
+def build_production_plan(date_from=None, days=7):
+    date_from = date_from or date.today()
+    days = max(1, min(31, to_int(days, 7)))
+    date_to = date_from + timedelta(days=days - 1)
+    portions = func.count(MealOrder.id)
+    rows = (
+        db.session.query(
+            MealOrder.pre_order_date,
+            MealOrder.dish_id,
+            portions.label('portions'),
+            func.coalesce(func.sum(MealOrder.price), 0).label('revenue'),
+        )
+        .filter(
+            MealOrder.pre_order_date >= date_from,
+            MealOrder.pre_order_date <= date_to,
+            MealOrder.status == 'ordered',
+        )
+        .group_by(MealOrder.pre_order_date, MealOrder.dish_id)
+        .order_by(MealOrder.pre_order_date.asc(), portions.desc())
         .all()
     )
-    payment_rows = list(reversed(payment_rows))
+    dish_ids = {row.dish_id for row in rows}
+    dishes = {dish.id: dish for dish in Dish.query.filter(Dish.id.in_(dish_ids)).all()} if dish_ids else {}
+
+    plan_days = {}
+    dish_totals = {}
+    for row in rows:
+        dish = dishes.get(row.dish_id)
+        day = plan_days.setdefault(row.pre_order_date, {
+            'date': row.pre_order_date,
+            'label': f"{row.pre_order_date.strftime('%d.%m.%Y')} ({DAY_SHORT_NAMES_RU[row.pre_order_date.weekday()]})",
+            'portions': 0,
+            'revenue': 0,
+            'dishes': [],
+        })
+        mass_kg = round((dish.mass_grams if dish else 0) * row.portions / 1000, 2)
+        day['dishes'].append({
+            'dish_id': row.dish_id,
+            'title': dish.title if dish else f'ID {row.dish_id}',
+            'category': dish.category if dish else '',
+            'portions': row.portions,
+            'revenue': to_int(row.revenue, 0),
+            'mass_kg': mass_kg,
+        })
+        day['portions'] += row.portions
+        day['revenue'] += to_int(row.revenue, 0)
+        dish_totals[row.dish_id] = dish_totals.get(row.dish_id, 0) + row.portions
+
+    ingredients = {}
+    consumption = compute_ingredient_consumption(dish_totals)
+    if consumption:
+        recipe_dishes = {}
+        for dish_id, item_id in db.session.query(DishIngredient.dish_id, DishIngredient.item_id).filter(
+                DishIngredient.dish_id.in_(list(dish_totals))).all():
+            if dish_id in dishes:
+                recipe_dishes.setdefault(item_id, []).append(dishes[dish_id].title)
+        for item in InventoryItem.query.filter(InventoryItem.id.in_(list(consumption))).all():
+            required = consumption[item.id]
+            ingredients[item.id] = {
+                'item_id': item.id,
+                'name': item.name,
+                'unit': item.unit,
+                'quantity': item.quantity,
+                'min_quantity': item.min_quantity,
+                'required': round(required, 3),
+                'remaining': round(item.quantity - required, 3),
+                'dishes': sorted(recipe_dishes.get(item.id, [])),
+            }
+
+    return {
+        'date_from': date_from,
+        'date_to': date_to,
+        'days_count': days,
+        'days': [plan_days[key] for key in sorted(plan_days)],
+        'total_portions': sum(dish_totals.values()),
+        'ingredients': sorted(ingredients.values(), key=lambda item: (item['remaining'] - item['min_quantity'],
+                                                                      item['name'].lower())),
+    }
+
+
+ROLLUP_REFRESH_DAYS = 14
+ROLLUP_COMPACT_INTERVAL_SECONDS = 3600
+ROLLUP_ORDER_COLUMNS = ('status', 'price', 'dish_id')
+FEEDBACK_REPLY_ROLES = ('moder', 'admin', 'super_admin')
+PAID_ORDER_STATUSES = ('ordered', 'issued', 'received')
+
+
+def rollup_day(value):
+    if isinstance(value, datetime):
+        return value.date()
+    if isinstance(value, date):
+        return value
+    return datetime.strptime(str(value)[:10], '%Y-%m-%d').date()
+
+
+def rollup_today():
+    # Rollup days come from func.date(created_at) over utcnow() timestamps, so "today" is the UTC date.
+    return datetime.utcnow().date()
+
+
+def get_rollup_compacted_until():
+    value = get_cfg('rollup_compacted_until', '')
+    try:
+        return rollup_day(value) if value else None
+    except Exception:
+        return None
+
+
+def aggregate_daily(rollup_key, rollup_values, rollup_day_column, base_key, base_values, base_created_column,
+                    start=None, end=None, rollup_filters=(), base_filters=(), key_is_day=False):
+    compacted = get_rollup_compacted_until()
+    totals = {}
+
+    def merge(rows):
+        for row in rows:
+            key = rollup_day(row[0]) if key_is_day else row[0]
+            values = [to_int(value, 0) for value in row[1:]]
+            current = totals.get(key)
+            totals[key] = [a + b for a, b in zip(current, values)] if current else values
+
+    if compacted and (start is None or start <= compacted):
+        rollup_end = min(end, compacted) if end else compacted
+        query = db.session.query(rollup_key, *[func.sum(column) for column in rollup_values]).filter(
+            rollup_day_column <= rollup_end, *rollup_filters)
+        if start:
+            query = query.filter(rollup_day_column >= start)
+        merge(query.group_by(rollup_key).all())
+
+    live_start = compacted + timedelta(days=1) if compacted else None
+    if start and (live_start is None or start > live_start):
+        live_start = start
+    if end is None or live_start is None or live_start <= end:
+        query = db.session.query(base_key, *base_values).filter(*base_filters)
+        if live_start:
+            query = query.filter(base_created_column >= datetime.combine(live_start, datetime.min.time()))
+        if end:
+            query = query.filter(base_created_column < datetime.combine(end + timedelta(days=1), datetime.min.time()))
+        merge(query.group_by(base_key).all())
+    return totals
+
+
+def aggregate_order_rollup(group_by, start=None, end=None, statuses=None):
+    rollup_keys = {'day': DailyOrderStat.day, 'dish': DailyOrderStat.dish_id, 'status': DailyOrderStat.status}
+    base_keys = {
+        'day': func.date(MealOrder.created_at),
+        'dish': MealOrder.dish_id,
+        'status': MealOrder.status,
+    }
+    return aggregate_daily(
+        rollup_keys[group_by], [DailyOrderStat.orders, DailyOrderStat.revenue], DailyOrderStat.day,
+        base_keys[group_by], [func.count(MealOrder.id), func.coalesce(func.sum(MealOrder.price), 0)],
+        MealOrder.created_at, start=start, end=end,
+        rollup_filters=[DailyOrderStat.status.in_(statuses)] if statuses else [],
+        base_filters=[MealOrder.status.in_(statuses)] if statuses else [],
+        key_is_day=group_by == 'day',
+    )
+
+
+def aggregate_payment_rollup(group_by, start=None, end=None):
+    rollup_keys = {'day': DailyPaymentStat.day, 'kind': DailyPaymentStat.kind}
+    base_keys = {'day': func.date(PaymentOperation.created_at), 'kind': PaymentOperation.kind}
+    return aggregate_daily(
+        rollup_keys[group_by], [DailyPaymentStat.operations, DailyPaymentStat.amount], DailyPaymentStat.day,
+        base_keys[group_by], [func.count(PaymentOperation.id), func.coalesce(func.sum(PaymentOperation.amount), 0)],
+        PaymentOperation.created_at, start=start, end=end, key_is_day=group_by == 'day',
+    )
+
+
+def aggregate_feedback_rollup(start=None, end=None, roles=FEEDBACK_REPLY_ROLES):
+    return aggregate_daily(
+        DailyFeedbackStat.day, [DailyFeedbackStat.messages], DailyFeedbackStat.day,
+        func.date(FeedbackMessage.created_at), [func.count(FeedbackMessage.id)],
+        FeedbackMessage.created_at, start=start, end=end,
+        rollup_filters=[DailyFeedbackStat.role.in_(roles)], base_filters=[FeedbackMessage.role.in_(roles)],
+        key_is_day=True,
+    )
+
+
+def top_dish_rollup_rows(limit, statuses=None):
+    totals = aggregate_order_rollup('dish', statuses=statuses)
+    top_ids = sorted(totals, key=lambda dish_id: (-totals[dish_id][0], dish_id))[:limit]
+    titles = dict(db.session.query(Dish.id, Dish.title).filter(Dish.id.in_(top_ids)).all()) if top_ids else {}
+    return [(titles[dish_id], totals[dish_id][0], totals[dish_id][1]) for dish_id in top_ids if dish_id in titles]
+
+
+FORECAST_HISTORY_DAYS = 84
+FORECAST_HORIZON_DAYS = 7
+FORECAST_RUN_HOUR = 3
+
+
+def compute_demand_forecast(start=None, horizon=FORECAST_HORIZON_DAYS):
+    import analytics
+    import forecast
+
+    start = start or date.today()
+    history_start = start - timedelta(days=FORECAST_HISTORY_DAYS)
+    dish_ids = [row[0] for row in db.session.query(Dish.id).filter(Dish.is_active == True).order_by(Dish.id).all()]
+    service_day = func.coalesce(MealOrder.pre_order_date, MealOrder.meal_date)
+    history_rows = (
+        db.session.query(MealOrder.dish_id, service_day, func.count(MealOrder.id))
+        .filter(
+            MealOrder.created_at >= datetime.combine(history_start - timedelta(days=31), datetime.min.time()),
+            service_day >= history_start,
+            service_day < start,
+            MealOrder.status != 'cancelled',
+        )
+        .group_by(MealOrder.dish_id, service_day)
+        .all()
+    )
+    schedule_rows = db.session.query(WeeklyMenu.dish_id, WeeklyMenu.day_of_week).all()
+    results = forecast.forecast_dish_demand(
+        dish_ids, history_rows, schedule_rows, analytics.day_number(history_start), FORECAST_HISTORY_DAYS,
+        analytics.day_number(start), horizon,
+    )
+
+    generated_at = datetime.utcnow()
+    forecast_rows = [
+        {
+            'day': start + timedelta(days=offset),
+            'dish_id': dish_id,
+            'portions': round(portions, 2),
+            'baseline': round(baseline, 2),
+            'trend': round(trend, 3),
+            'generated_at': generated_at,
+        }
+        for dish_id, offset, portions, baseline, trend in results
+    ]
+    try:
+        DishForecast.query.filter(or_(
+            (DishForecast.day >= start) & (DishForecast.day < start + timedelta(days=horizon)),
+            DishForecast.day < start - timedelta(days=horizon),
+        )).delete(synchronize_session=False)
+        if forecast_rows:
+            db.session.execute(DishForecast.__table__.insert(), forecast_rows)
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+    return len(forecast_rows)
+
+
+def load_demand_forecast(start=None, days=FORECAST_HORIZON_DAYS, refresh=False):
+    start = start or date.today()
+    if refresh:
+        compute_demand_forecast(start, days)
+    end = start + timedelta(days=days - 1)
+    preorders = {
+        (row[0], row[1]): row[2]
+        for row in db.session.query(MealOrder.pre_order_date, MealOrder.dish_id, func.count(MealOrder.id))
+        .filter(MealOrder.pre_order_date >= start, MealOrder.pre_order_date <= end, MealOrder.status == 'ordered')
+        .group_by(MealOrder.pre_order_date, MealOrder.dish_id)
+        .all()
+    }
+    rows = (
+        db.session.query(DishForecast, Dish.title)
+        .join(Dish, Dish.id == DishForecast.dish_id)
+        .filter(DishForecast.day >= start, DishForecast.day <= end)
+        .order_by(DishForecast.day.asc(), DishForecast.portions.desc())
+        .all()
+    )
+    result = {}
+    for item, title in rows:
+        day = result.setdefault(item.day, {
+            'date': item.day,
+            'label': f"{item.day.strftime('%d.%m.%Y')} ({DAY_SHORT_NAMES_RU[item.day.weekday()]})",
+            'dishes': [],
+        })
+        ordered = preorders.get((item.day, item.dish_id), 0)
+        day['dishes'].append({
+            'dish_id': item.dish_id,
+            'title': title,
+            'forecast': int(round(item.portions)),
+            'preorders': ordered,
+            'prepare': max(int(round(item.portions)), ordered),
+            'trend': item.trend,
+        })
+    return [result[key] for key in sorted(result)]
+
+
+def build_dashboard_charts(today=None, n_days=30, window=7, top_limit=10):
+    import analytics
+
+    today = today or rollup_today()
+    start = today - timedelta(days=n_days - 1)
+    daily = aggregate_order_rollup('day', start=start, statuses=PAID_ORDER_STATUSES)
+    days = analytics.to_day_numbers(daily.keys())
+    revenue_series = analytics.daily_series(days, [values[1] for values in daily.values()], today, n_days, window)
+
+    per_dish = aggregate_order_rollup('dish', start=start, statuses=PAID_ORDER_STATUSES)
+    dish_categories = dict(
+        db.session.query(Dish.id, Dish.category).filter(Dish.id.in_(list(per_dish))).all()) if per_dish else {}
+    category_labels, category_values = analytics.category_totals_from_pairs(
+        [dish_categories.get(dish_id, '') for dish_id in per_dish], [values[1] for values in per_dish.values()])
+
+    dish_totals = aggregate_order_rollup('dish', statuses=PAID_ORDER_STATUSES)
+    top_ids, top_counts, _ = analytics.rank_totals(
+        list(dish_totals), [values[0] for values in dish_totals.values()],
+        [values[1] for values in dish_totals.values()], top_limit)
+    titles = dict(db.session.query(Dish.id, Dish.title).filter(Dish.id.in_(top_ids)).all()) if top_ids else {}
+    top_dishes = [(titles[dish_id], count) for dish_id, count in zip(top_ids, top_counts) if dish_id in titles]
+    return {
+        'revenue_daily': revenue_series,
+        'category_spending': {
+            'labels': [DISH_CATEGORY_LABELS.get(label, label or 'Без категории') for label in category_labels],
+            'data': category_values,
+        },
+        'top_dishes': {
+            'labels': [row[0] for row in top_dishes],
+            'data': [row[1] for row in top_dishes],
+        },
+    }
+
+
+def compact_rollup_range(start, until):
+    range_start = datetime.combine(start, datetime.min.time())
+    range_end = datetime.combine(until + timedelta(days=1), datetime.min.time())
+    order_day = func.date(MealOrder.created_at)
+    payment_day = func.date(PaymentOperation.created_at)
+    feedback_day = func.date(FeedbackMessage.created_at)
+
+    order_rows = [
+        {'day': rollup_day(row[0]), 'dish_id': row[1], 'status': row[2], 'orders': row[3], 'revenue': to_int(row[4], 0)}
+        for row in db.session.query(order_day, MealOrder.dish_id, MealOrder.status, func.count(MealOrder.id),
+                                    func.coalesce(func.sum(MealOrder.price), 0))
+        .filter(MealOrder.created_at >= range_start, MealOrder.created_at < range_end)
+        .group_by(order_day, MealOrder.dish_id, MealOrder.status)
+        .all()
+    ]
+    payment_rows = [
+        {'day': rollup_day(row[0]), 'kind': row[1], 'operations': row[2], 'amount': to_int(row[3], 0)}
+        for row in db.session.query(payment_day, PaymentOperation.kind, func.count(PaymentOperation.id),
+                                    func.coalesce(func.sum(PaymentOperation.amount), 0))
+        .filter(PaymentOperation.created_at >= range_start, PaymentOperation.created_at < range_end)
+        .group_by(payment_day, PaymentOperation.kind)
+        .all()
+    ]
+    feedback_rows = [
+        {'day': rollup_day(row[0]), 'role': row[1], 'messages': row[2]}
+        for row in db.session.query(feedback_day, FeedbackMessage.role, func.count(FeedbackMessage.id))
+        .filter(FeedbackMessage.created_at >= range_start, FeedbackMessage.created_at < range_end)
+        .group_by(feedback_day, FeedbackMessage.role)
+        .all()
+    ]
+
+    for model, rows in ((DailyOrderStat, order_rows), (DailyPaymentStat, payment_rows),
+                        (DailyFeedbackStat, feedback_rows)):
+        model.query.filter(model.day >= start, model.day <= until).delete(synchronize_session=False)
+        if rows:
+            db.session.execute(model.__table__.insert(), rows)
+
+
+def compact_daily_rollups(until=None, days=ROLLUP_REFRESH_DAYS, full=False):
+    until = until or rollup_today() - timedelta(days=1)
+    compacted = get_rollup_compacted_until()
+    if full or not compacted:
+        first_values = [
+            db.session.query(func.min(MealOrder.created_at)).scalar(),
+            db.session.query(func.min(PaymentOperation.created_at)).scalar(),
+            db.session.query(func.min(FeedbackMessage.created_at)).scalar(),
+        ]
+        first_values = [rollup_day(value) for value in first_values if value]
+        start = min(first_values) if first_values else until
+    else:
+        start = min(compacted + timedelta(days=1), until - timedelta(days=days - 1))
+
+    try:
+        dirty_days = [row[0] for row in db.session.query(RollupDirtyDay.day).filter(RollupDirtyDay.day <= until)]
+        if dirty_days:
+            RollupDirtyDay.query.filter(RollupDirtyDay.day.in_(dirty_days)).delete(synchronize_session=False)
+        stale_days = sorted(day for day in dirty_days if day < start)
+        for day in stale_days:
+            compact_rollup_range(day, day)
+        if start <= until:
+            compact_rollup_range(start, until)
+            row = CFG.query.filter_by(cfg='rollup_compacted_until').first()
+            if row:
+                row.value = until.isoformat()
+            else:
+                db.session.add(CFG(cfg='rollup_compacted_until', value=until.isoformat()))
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+    return max(0, (until - start).days + 1) + len(stale_days)
+
+
+def make_dataset(label, values, color):
+    return {
+        'label': label,
+        'data': values,
+        'backgroundColor': color,
+        'borderColor': color,
+        'tension': 0.35,
+        'fill': False,
+    }
+
+
+def load_order_frame(since, user_ids=None, statuses=None):
+    import analytics
+
+    query = (
+        db.session.query(MealOrder.created_at, MealOrder.user_id, MealOrder.dish_id, MealOrder.price, Dish.calories,
+                         Dish.category)
+        .join(Dish, Dish.id == MealOrder.dish_id)
+        .filter(MealOrder.created_at >= since)
+    )
+    if user_ids is not None:
+        query = query.filter(MealOrder.user_id.in_(user_ids))
+    if statuses:
+        query = query.filter(MealOrder.status.in_(statuses))
+    return analytics.OrderFrame.from_rows(query.all())
+
+
+def compute_personal_report_payload(user):
+    import analytics
+
+    since = datetime.utcnow() - timedelta(days=30)
+    is_parent_view = user.role == 'parent'
+    linked_children = get_parent_children_rows(user.id, active_only=True) if is_parent_view else []
+    target_user_ids = [child.id for _, child in linked_children] if is_parent_view else [user.id]
+    query_ids = target_user_ids if target_user_ids else [-1]
+
+    frame = load_order_frame(since, user_ids=query_ids)
+    spending_series = analytics.daily_series(frame.days, frame.prices, date.today(), 30)
+    calories_series = analytics.daily_series(frame.days, frame.calories, date.today(), 30)
+    labels = spending_series['labels']
+    spending = spending_series['values']
+    calories = calories_series['values']
+
+    recent_orders = (
+        db.session.query(MealOrder, Dish, Users)
+        .join(Dish, Dish.id == MealOrder.dish_id)
+        .join(Users, Users.id == MealOrder.user_id)
+        .filter(MealOrder.user_id.in_(query_ids))
+        .order_by(MealOrder.created_at.desc())
+        .limit(25)
+        .all()
+    )
+
+    table_columns = ['Дата', 'Блюдо', 'Статус', 'Цена', 'Ккал']
+    table_keys = ['date', 'dish', 'status', 'price', 'kcal']
+    if is_parent_view:
+        table_columns.insert(1, 'Ребенок')
+        table_keys.insert(1, 'student')
+
+    table_rows = []
+    for order, dish, student_user in recent_orders:
+        row = {
+            'date': order.created_at.strftime('%d.%m.%Y %H:%M'),
+            'dish': dish.title,
+            'status': parse_order_status_label(order.status),
+            'price': f'{order.price} ₽',
+            'kcal': f'{int(dish.calories)} ккал',
+        }
+        if is_parent_view:
+            row['student'] = build_child_display_name(student_user)
+        table_rows.append(row)
+
+    tables = [{
+        'title': 'История заказов',
+        'columns': table_columns,
+        'keys': table_keys,
+        'rows': table_rows,
+    }]
+
+    recent_spent = sum(max(order.price, 0) for order, _, _ in recent_orders)
+    received_count = sum(1 for order, _, _ in recent_orders if order.status == 'received')
+    if is_parent_view:
+        all_time_spent = (
+                             db.session.query(func.coalesce(func.sum(MealOrder.price), 0))
+                             .filter(MealOrder.user_id.in_(query_ids))
+                             .scalar()
+                         ) or 0
+        cards = [
+            {'title': 'Привязанных детей', 'value': len(target_user_ids)},
+            {'title': 'Заказы за 30 дней', 'value': len(recent_orders)},
+            {'title': 'Расходы за 30 дней', 'value': f'{recent_spent} ₽'},
+            {'title': 'Общие расходы', 'value': f'{to_int(all_time_spent, 0)} ₽'},
+        ]
+    else:
+        cards = [
+            {'title': 'Заказы за 30 дней', 'value': len(recent_orders)},
+            {'title': 'Расходы за 30 дней', 'value': f'{recent_spent} ₽'},
+            {'title': 'Получено блюд', 'value': received_count},
+        ]
+
+    charts = [
+        {
+            'title': 'Расходы по дням',
+            'type': 'bar',
+            'labels': labels,
+            'datasets': [make_dataset('Расходы, ₽', spending, 'rgba(140, 140, 140, 0.5)')],
+        },
+        {
+            'title': 'Калорийность по дням',
+            'type': 'line',
+            'labels': labels,
+            'datasets': [make_dataset('Ккал', calories, 'rgba(92, 92, 92, 0.5)')],
+        },
+    ]
+    title = 'Отчетность школьника'
+    subtitle = 'Аналитика заказов и расходов за последние 30 дней.'
+    if is_parent_view:
+        title = 'Семейная отчетность'
+        subtitle = 'Агрегированные расходы и заказы по всем привязанным детям.'
+    return {'title': title, 'subtitle': subtitle, 'charts': charts, 'tables': tables, 'cards': cards}
+
+
+def compute_chef_report_payload():
+    popular_rows = top_dish_rollup_rows(12)
+    status_rows = [(status, values[0]) for status, values in aggregate_order_rollup('status').items()]
+    low_rows = InventoryItem.query.filter(InventoryItem.quantity <= InventoryItem.min_quantity).all()
+    pending_rows = PurchaseRequest.query.filter_by(status='pending').order_by(
+        PurchaseRequest.created_at.desc()).limit(20).all()
+
+    charts = [
+        {'title': 'Популярность блюд', 'type': 'bar',
+         'labels': [row[0] for row in popular_rows],
+         'datasets': [make_dataset('Заказы', [row[1] for row in popular_rows], 'rgba(118, 118, 118, 0.5)')]},
+        {'title': 'Статусы заказов', 'type': 'doughnut',
+         'labels': [parse_order_status_label(row[0]) for row in status_rows],
+         'datasets': [make_dataset('Количество', [row[1] for row in status_rows], [
+             'rgba(72, 72, 72, 0.5)', 'rgba(102, 102, 102, 0.5)', 'rgba(132, 132, 132, 0.5)',
+             'rgba(162, 162, 162, 0.5)'
+         ])]},
+    ]
+    tables = [{
+        'title': 'Критические остатки и заявки',
+        'columns': ['Позиция', 'Факт', 'Мин', 'Статус'],
+        'keys': ['name', 'fact', 'min', 'status'],
+        'rows': (
+                [{'name': row.name, 'fact': f'{row.quantity:.2f} {row.unit}',
+                  'min': f'{row.min_quantity:.2f} {row.unit}', 'status': 'Остаток'} for row in low_rows] +
+                [{'name': row.item_name, 'fact': f'{row.quantity:.2f} {row.unit}', 'min': f'{row.expected_cost} ₽',
+                  'status': 'Заявка pending'} for row in pending_rows]
+        ),
+    }]
+    cards = [
+        {'title': 'Блюд в меню', 'value': Dish.query.filter_by(is_active=True).count()},
+        {'title': 'Критических остатков', 'value': len(low_rows)},
+        {'title': 'Заявок pending', 'value': len(pending_rows)},
+    ]
+    return {'title': 'Отчётность кухни', 'subtitle': 'Контроль выдачи, популярности блюд и складских позиций.',
+            'charts': charts, 'tables': tables, 'cards': cards}
+
+
+def compute_moder_report_payload():
+    status_rows = db.session.query(FeedbackThread.status, func.count(FeedbackThread.id)).group_by(
+        FeedbackThread.status).all()
+    msg_totals = aggregate_feedback_rollup(start=rollup_today() - timedelta(days=13))
+    msg_rows = [(day, msg_totals[day][0]) for day in sorted(msg_totals)]
+    open_threads = FeedbackThread.query.filter_by(status='open').order_by(FeedbackThread.updated_at.desc()).limit(
+        25).all()
+
+    charts = [
+        {'title': 'Статус обращений', 'type': 'pie',
+         'labels': ['Открыто' if row[0] == 'open' else 'Закрыто' for row in status_rows],
+         'datasets': [make_dataset('Обращения', [row[1] for row in status_rows],
+                                   ['rgba(86, 86, 86, 0.5)', 'rgba(148, 148, 148, 0.5)'])]},
+        {'title': 'Ответы модерации по дням', 'type': 'line',
+         'labels': [row[0].strftime('%d.%m') for row in msg_rows],
+         'datasets': [make_dataset('Сообщения', [row[1] for row in msg_rows], 'rgba(108, 108, 108, 0.5)')]},
+    ]
+    tables = [{
+        'title': 'Открытые обращения',
+        'columns': ['ID', 'Тема', 'Обновлено'],
+        'keys': ['id', 'subject', 'updated'],
+        'rows': [{'id': row.id, 'subject': row.subject, 'updated': row.updated_at.strftime('%d.%m.%Y %H:%M')} for
+                 row in open_threads],
+    }]
+    cards = [
+        {'title': 'Открыто', 'value': sum(row[1] for row in status_rows if row[0] == 'open')},
+        {'title': 'Закрыто', 'value': sum(row[1] for row in status_rows if row[0] == 'closed')},
+        {'title': 'Всего тредов', 'value': FeedbackThread.query.count()},
+    ]
+    return {'title': 'Отчётность модерации', 'subtitle': 'Контроль очереди обратной связи и скорости ответов.',
+            'charts': charts, 'tables': tables, 'cards': cards}
+
+
+def compute_admin_report_payload():
+    role_rows = db.session.query(Users.role, func.count(Users.id)).filter(Users.is_active == True).group_by(
+        Users.role).all()
+    attendance_rows = [(status, values[0]) for status, values in aggregate_order_rollup('status').items()]
+    purchase_rows = db.session.query(PurchaseRequest.status, func.count(PurchaseRequest.id)).group_by(
+        PurchaseRequest.status).all()
+    top_dishes = top_dish_rollup_rows(15)
+    payment_totals = aggregate_payment_rollup('day', start=rollup_today() - timedelta(days=13))
+    payment_rows = [(day, payment_totals[day][1]) for day in sorted(payment_totals)]
 
     charts = [
         {'title': 'Пользователи по ролям', 'type': 'bar',
          'labels': [role_label(row[0]) for row in role_rows],
          'datasets': [make_dataset('Количество', [row[1] for row in role_rows], 'rgba(92, 92, 92, 0.5)')]},
         {'title': 'Финансовый поток за 14 дней', 'type': 'line',
-         'labels': [datetime.strptime(row[0], '%Y-%m-%d').strftime('%d.%m') for row in payment_rows],
+         'labels': [row[0].strftime('%d.%m') for row in payment_rows],
          'datasets': [make_dataset('Сумма, ₽', [row[1] for row in payment_rows], 'rgba(138, 138, 138, 0.5)')]},
         {'title': 'Посещаемость и выдача', 'type': 'doughnut',
          'labels': [parse_order_status_label(row[0]) for row in attendance_rows],
@@ -2515,17 +3771,401 @@ def build_report_payload(user):
             'charts': charts, 'tables': tables, 'cards': cards}
 
 
-@app.context_processor
+REPORT_SCOPE_DEPENDENCIES = {
+    'student': {'MealOrder', 'Dish'},
+    'parent': {'MealOrder', 'Dish', 'Users', 'ParentStudentLink'},
+    'chef': {'MealOrder', 'Dish', 'InventoryItem', 'PurchaseRequest'},
+    'moder': {'FeedbackThread', 'FeedbackMessage'},
+    'admin': {'Users', 'MealOrder', 'Dish', 'PurchaseRequest', 'PaymentOperation', 'FeedbackThread'},
+}
+REPORT_WATCHED_COLUMNS = {
+    'Users': {'role', 'is_active', 'name', 'surname'},
+}
+REPORT_SNAPSHOT_BUILDERS = {
+    'chef': compute_chef_report_payload,
+    'moder': compute_moder_report_payload,
+    'admin': compute_admin_report_payload,
+}
+
+
+def resolve_report_scope(user):
+    if user.role in {'student', 'parent'}:
+        return user.role, (user.role, user.id)
+    if user.role in {'chef', 'moder'}:
+        return user.role, (user.role,)
+    return 'admin', ('admin',)
+
+
+def report_table_touched_at(table_name):
+    touched = shared_state.get(f'report:touched:{table_name}')
+    return datetime.fromisoformat(touched) if touched else None
+
+
+def report_scope_changed_since(scope, moment):
+    for table_name in REPORT_SCOPE_DEPENDENCIES.get(scope, ()):
+        touched = report_table_touched_at(table_name)
+        if touched and touched >= moment:
+            return True
+    return False
+
+
+def mark_report_tables_touched(table_names):
+    now = datetime.utcnow().isoformat()
+    for table_name in table_names:
+        if table_name:
+            shared_state.set(f'report:touched:{table_name}', now)
+
+
+def collect_report_tables(session):
+    touched = session.info.setdefault('report_touched_tables', set())
+    for obj in list(session.new) + list(session.deleted):
+        touched.add(getattr(obj, '__tablename__', ''))
+    for obj in session.dirty:
+        table_name = getattr(obj, '__tablename__', '')
+        watched = REPORT_WATCHED_COLUMNS.get(table_name)
+        if watched is None:
+            if session.is_modified(obj):
+                touched.add(table_name)
+            continue
+        state = inspect(obj)
+        if any(state.attrs[name].history.has_changes() for name in watched if name in state.attrs):
+            touched.add(table_name)
+
+
+def mark_rollup_days_dirty(session, days):
+    today = rollup_today()
+    with session.no_autoflush:
+        for day in set(days):
+            if day < today and session.get(RollupDirtyDay, day) is None:
+                session.add(RollupDirtyDay(day=day))
+
+
+def collect_rollup_dirty_days(session):
+    days = []
+    for obj in session.dirty:
+        if isinstance(obj, MealOrder) and obj.created_at:
+            state = inspect(obj)
+            if any(state.attrs[name].history.has_changes() for name in ROLLUP_ORDER_COLUMNS):
+                days.append(rollup_day(obj.created_at))
+    for obj in session.deleted:
+        if isinstance(obj, MealOrder) and obj.created_at:
+            days.append(rollup_day(obj.created_at))
+    if days:
+        mark_rollup_days_dirty(session, days)
+
+
+@event.listens_for(db.session, 'before_flush')
+def track_report_flush(session, flush_context, instances):
+    collect_report_tables(session)
+    collect_rollup_dirty_days(session)
+
+
+def note_report_tables_touched(session, *table_names):
+    session.info.setdefault('report_touched_tables', set()).update(table_names)
+
+
+@event.listens_for(db.session, 'after_bulk_update')
+def track_report_bulk_update(update_context):
+    note_report_tables_touched(update_context.session, getattr(update_context.mapper.class_, '__tablename__', ''))
+
+
+@event.listens_for(db.session, 'after_bulk_delete')
+def track_report_bulk_delete(delete_context):
+    note_report_tables_touched(delete_context.session, getattr(delete_context.mapper.class_, '__tablename__', ''))
+
+
+@event.listens_for(db.session, 'after_commit')
+def apply_report_invalidation(session):
+    touched = session.info.pop('report_touched_tables', set())
+    mark_report_tables_touched(touched)
+    if touched & MENU_CACHE_TABLES:
+        bump_menu_cache_version()
+    if 'CFG' in touched:
+        shared_state.incr('menu:cfg_version')
+
+
+def menu_cache_version():
+    return shared_state.get('menu:version', 0)
+
+
+def bump_menu_cache_version():
+    shared_state.incr('menu:version')
+    with menu_fragment_cache_lock:
+        menu_fragment_cache.clear()
+
+
+def cached_menu_fragment(key_parts, builder, enabled=True):
+    if not enabled:
+        return Markup(builder())
+    now = datetime.utcnow()
+    key = (menu_cache_version(), date.today().isoformat(), *key_parts)
+    with menu_fragment_cache_lock:
+        entry = menu_fragment_cache.get(key)
+    if entry and (now - entry['created_at']).total_seconds() <= MENU_FRAGMENT_CACHE_TTL_SECONDS:
+        return entry['html']
+
+    html = Markup(builder())
+    if key[0] != menu_cache_version():
+        return html
+    with menu_fragment_cache_lock:
+        if len(menu_fragment_cache) >= MENU_FRAGMENT_CACHE_MAX_ITEMS:
+            oldest = min(menu_fragment_cache, key=lambda item: menu_fragment_cache[item]['created_at'])
+            menu_fragment_cache.pop(oldest, None)
+        menu_fragment_cache[key] = {'html': html, 'created_at': now}
+    return html
+
+
+def page_user_stamp(user):
+    if not user:
+        return 'anonymous'
+    unread = Notification.query.filter_by(user_id=user.id, is_read=False).count()
+    dop_data = json.dumps(user.dop_data or {}, sort_keys=True, ensure_ascii=False)
+    return f'{user.id}:{user.role}:{user.balance}:{user.name}:{user.surname}:{user.icon}:{unread}:{dop_data}'
+
+
+def build_data_etag(*parts):
+    versions = (menu_cache_version(), shared_state.get('menu:cfg_version', 0))
+    payload = '|'.join(str(part) for part in (
+        *parts,
+        *versions,
+        date.today().isoformat(),
+        int(time.time() // MENU_FRAGMENT_CACHE_TTL_SECONDS),
+    ))
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()[:32]
+
+
+def build_page_etag(user, *parts):
+    return build_data_etag(*parts, get_csrf_token(), page_user_stamp(user))
+
+
+def conditional_response(etag, render):
+    if session.get('_flashes'):
+        return render()
+    if request.if_none_match.contains_weak(etag):
+        response = make_response('', 304)
+    else:
+        response = make_response(render())
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'private, no-cache'
+    return response
+
+
+@event.listens_for(db.session, 'after_rollback')
+def discard_report_invalidation(session):
+    session.info.pop('report_touched_tables', None)
+
+
+def report_snapshot_stale(scope, snapshot, margin=0):
+    if not snapshot or not snapshot.created_at:
+        return True
+    now = datetime.utcnow()
+    if (now - snapshot.created_at).total_seconds() + margin > REPORT_SNAPSHOT_MAX_AGE_SECONDS:
+        return True
+    if snapshot.created_at.date() != now.date():
+        return True
+    return report_scope_changed_since(scope, snapshot.created_at)
+
+
+def load_report_snapshot(scope):
+    snapshot = ReportSnapshot.query.filter_by(scope=scope).first()
+    if report_snapshot_stale(scope, snapshot):
+        return None
+    try:
+        payload = json.loads(snapshot.payload or '{}')
+    except Exception:
+        return None
+    return payload, snapshot.created_at
+
+
+def store_report_snapshot(scope, payload, created_at):
+    snapshot = ReportSnapshot.query.filter_by(scope=scope).first()
+    if not snapshot:
+        snapshot = ReportSnapshot(scope=scope)
+        db.session.add(snapshot)
+    snapshot.payload = json.dumps(payload, ensure_ascii=False)
+    snapshot.created_at = created_at
+    db.session.commit()
+
+
+def refresh_report_snapshots():
+    refreshed = 0
+    for scope, builder in REPORT_SNAPSHOT_BUILDERS.items():
+        snapshot = ReportSnapshot.query.filter_by(scope=scope).first()
+        if not report_snapshot_stale(scope, snapshot, margin=REPORT_SNAPSHOT_INTERVAL_SECONDS):
+            continue
+        created_at = datetime.utcnow()
+        payload = builder()
+        payload['generated_at'] = created_at.strftime('%d.%m.%Y %H:%M')
+        store_report_snapshot(scope, payload, created_at)
+        with report_cache_lock:
+            report_cache[(scope,)] = {'payload': payload, 'created_at': created_at}
+        refreshed += 1
+    return refreshed
+
+
+def build_report_payload(user):
+    scope, key = resolve_report_scope(user)
+    now = datetime.utcnow()
+    with report_cache_lock:
+        entry = report_cache.get(key)
+    if entry and (now - entry['created_at']).total_seconds() <= REPORT_CACHE_TTL_SECONDS \
+            and not report_scope_changed_since(scope, entry['created_at']):
+        return entry['payload']
+
+    created_at = now
+    snapshot = load_report_snapshot(scope) if scope in REPORT_SNAPSHOT_BUILDERS else None
+    if snapshot:
+        payload, created_at = snapshot
+    else:
+        if scope in REPORT_SNAPSHOT_BUILDERS:
+            payload = REPORT_SNAPSHOT_BUILDERS[scope]()
+        else:
+            payload = compute_personal_report_payload(user)
+        payload['generated_at'] = created_at.strftime('%d.%m.%Y %H:%M')
+        if scope in REPORT_SNAPSHOT_BUILDERS:
+            store_report_snapshot(scope, payload, created_at)
+
+    with report_cache_lock:
+        if len(report_cache) >= REPORT_CACHE_MAX_ITEMS:
+            oldest = min(report_cache, key=lambda item: report_cache[item]['created_at'])
+            report_cache.pop(oldest, None)
+        report_cache[key] = {'payload': payload, 'created_at': created_at}
+    return payload
+
+
+REPORT_EXPORT_BATCH_SIZE = 1000
+
+
+def format_export_value(value):
+    if value is None:
+        return ''
+    if isinstance(value, datetime):
+        return value.strftime('%Y-%m-%d %H:%M:%S')
+    if isinstance(value, date):
+        return value.isoformat()
+    return value
+
+
+def iter_export_rows(statement):
+    result = db.session.execute(
+        statement.execution_options(stream_results=True, yield_per=REPORT_EXPORT_BATCH_SIZE))
+    try:
+        for row in result:
+            yield [format_export_value(value) for value in row]
+    finally:
+        result.close()
+
+
+def build_report_export_datasets(user, date_from, date_to):
+    range_start = datetime.combine(date_from, datetime.min.time())
+    range_end = datetime.combine(date_to + timedelta(days=1), datetime.min.time())
+    datasets = []
+
+    if user.role in {'student', 'parent', 'chef', 'admin', 'super_admin'}:
+        orders = (
+            select(MealOrder.id, MealOrder.created_at, MealOrder.meal_date, MealOrder.pre_order_date,
+                   MealOrder.user_id, Users.surname, Users.name, Dish.title, MealOrder.status, MealOrder.price,
+                   MealOrder.issued_at)
+            .join(Users, Users.id == MealOrder.user_id)
+            .join(Dish, Dish.id == MealOrder.dish_id)
+            .where(MealOrder.created_at >= range_start, MealOrder.created_at < range_end)
+            .order_by(MealOrder.created_at.asc(), MealOrder.id.asc())
+        )
+        if user.role == 'student':
+            orders = orders.where(MealOrder.user_id == user.id)
+        elif user.role == 'parent':
+            child_ids = [child.id for _, child in get_parent_children_rows(user.id, active_only=True)] or [-1]
+            orders = orders.where(MealOrder.user_id.in_(child_ids))
+        datasets.append((
+            'orders.csv',
+            ['ID', 'Создан', 'Дата питания', 'Дата предзаказа', 'ID ученика', 'Фамилия', 'Имя', 'Блюдо', 'Статус',
+             'Цена', 'Выдан'],
+            orders,
+        ))
+
+    if user.role in {'student', 'parent', 'admin', 'super_admin'}:
+        payments = (
+            select(PaymentOperation.id, PaymentOperation.created_at, PaymentOperation.user_id,
+                   PaymentOperation.target_user_id, PaymentOperation.kind, PaymentOperation.amount,
+                   PaymentOperation.description)
+            .where(PaymentOperation.created_at >= range_start, PaymentOperation.created_at < range_end)
+            .order_by(PaymentOperation.created_at.asc(), PaymentOperation.id.asc())
+        )
+        if user.role == 'student':
+            payments = payments.where(or_(PaymentOperation.user_id == user.id,
+                                          PaymentOperation.target_user_id == user.id))
+        elif user.role == 'parent':
+            child_ids = [child.id for _, child in get_parent_children_rows(user.id, active_only=True)] or [-1]
+            payments = payments.where(or_(PaymentOperation.user_id == user.id,
+                                          PaymentOperation.target_user_id.in_(child_ids)))
+        datasets.append((
+            'payments.csv',
+            ['ID', 'Создан', 'ID пользователя', 'ID получателя', 'Тип', 'Сумма', 'Описание'],
+            payments,
+        ))
+
+    if user.role in {'moder', 'admin', 'super_admin'}:
+        feedback = (
+            select(FeedbackMessage.id, FeedbackMessage.created_at, FeedbackMessage.thread_id, FeedbackThread.subject,
+                   FeedbackThread.status, FeedbackMessage.user_id, FeedbackMessage.role, FeedbackMessage.body)
+            .join(FeedbackThread, FeedbackThread.id == FeedbackMessage.thread_id)
+            .where(FeedbackMessage.created_at >= range_start, FeedbackMessage.created_at < range_end)
+            .order_by(FeedbackMessage.created_at.asc(), FeedbackMessage.id.asc())
+        )
+        datasets.append((
+            'feedback.csv',
+            ['ID', 'Создано', 'ID обращения', 'Тема', 'Статус', 'ID автора', 'Роль', 'Текст'],
+            feedback,
+        ))
+    return datasets
+
+
 def inject_helpers():
-    return {'parse_order_status_label': parse_order_status_label}
+    return {'parse_order_status_label': parse_order_status_label, 'asset_urls': asset_pipeline.urls,
+            'image_srcset': image_srcset}
+
+
+def build_static_assets():
+    try:
+        manifest = asset_pipeline.build()
+        precompressed = asset_pipeline.precompress_static()
+        app.logger.info(f'Static assets built: {len(manifest)} bundles, {precompressed} precompressed files')
+    except Exception as e:
+        app.logger.error(f'build_static_assets error: {str(e)}')
+        asset_pipeline.load()
+
+
+def accepted_encodings():
+    return [encoding for encoding in ('br', 'gzip') if request.accept_encodings[encoding]]
+
+
+def serve_static_file(filename):
+    path, encoding = asset_pipeline.resolve_static(filename, accepted_encodings())
+    if path is None:
+        return app.send_static_file(filename)
+    response = send_file(path, mimetype=mimetypes.guess_type(filename)[0],
+                         max_age=app.get_send_file_max_age(filename), conditional=True)
+    response.headers['Content-Encoding'] = encoding
+    response.headers['Vary'] = 'Accept-Encoding'
+    return response
+
+
+def static_asset(filename):
+    path, encoding = asset_pipeline.resolve(filename, accepted_encodings())
+    if path is None:
+        return '', 404
+    response = send_file(path, mimetype=mimetypes.guess_type(filename)[0], max_age=ASSET_MAX_AGE, conditional=True)
+    if encoding:
+        response.headers['Content-Encoding'] = encoding
+    response.headers['Vary'] = 'Accept-Encoding'
+    response.headers['Cache-Control'] = f'public, max-age={ASSET_MAX_AGE}, immutable'
+    return response
 
 
-@app.before_request
 def run_periodic_cleanup():
     cleanup_expired_unverified_users()
 
 
-@app.before_request
 def attach_user_to_request():
     token = request.cookies.get('session_token')
     user, error = check_session(token)
@@ -2533,7 +4173,6 @@ def attach_user_to_request():
     g.session_error = error
 
 
-@app.before_request
 def enforce_setup_gate():
     endpoint = request.endpoint or ''
     if endpoint in {'static', 'favicon', 'favicon_png', 'auth.setup'}:
@@ -2545,7 +4184,6 @@ def enforce_setup_gate():
     return redirect('/setup/')
 
 
-@app.before_request
 def enforce_csrf_protection():
     if request.method not in {'POST', 'PUT', 'PATCH', 'DELETE'}:
         return None
@@ -2554,7 +4192,7 @@ def enforce_csrf_protection():
     if is_valid_csrf_request():
         return None
     user = g.get('current_user')
-    if request.path.startswith('/upload_avatar/'):
+    if request.path.startswith('/upload_avatar/') or request.path.startswith('/kitchen/issue/'):
         return jsonify({'status': 'error', 'message': 'CSRF token missing or invalid'}), 400
     if request.path.startswith('/setup/'):
         return message_page('Сессия устарела. Обновите страницу и повторите действие.', user=user, status='error')
@@ -2562,6 +4200,16 @@ def enforce_csrf_protection():
     return redirect('/login/new/')
 
 
+def handle_password_hashing_busy(_error):
+    db.session.rollback()
+    app.logger.warning(f'Password hashing queue is full, rejected {request.method} {request.path}')
+    text = 'Сервер перегружен. Повторите попытку через несколько секунд.'
+    response = make_response(message_page(text, user=g.get('current_user'), status='error'))
+    response.status_code = 503
+    response.headers['Retry-After'] = '5'
+    return response
+
+
 def build_console(mode=False, log_file='console.txt'):
     log_target = str((BASE_DIR / str(log_file)).resolve()) if not Path(str(log_file)).is_absolute() else str(log_file)
     return CustomConsole(
@@ -2584,7 +4232,18 @@ def build_console(mode=False, log_file='console.txt'):
             'PaymentOperation': PaymentOperation,
             'DishReview': DishReview,
         },
-        hooks={'setup_wizard': lambda: run_first_setup(force=True)},
+        hooks={
+            'setup_wizard': lambda: run_first_setup(force=True),
+            'compact_rollups': lambda full: compact_daily_rollups(full=full),
+            'export_columnar': lambda full, fmt: run_columnar_export(full=full, fmt=fmt),
+            'forecast': lambda refresh: load_demand_forecast(refresh=refresh),
+            'rebuild_ratings': rebuild_dish_rating_stats,
+            'rate_limits': lambda: {'backend': shared_state.stats(), 'policies': RATE_LIMIT_POLICIES,
+                                    'counters': rate_limiter.stats()},
+            'hashing_stats': password_hasher.stats,
+            'image_jobs': image_pipeline.stats,
+            'backfill_images': backfill_image_variants,
+        },
         mode=mode,
         log_file=log_target,
     )
@@ -2602,50 +4261,224 @@ def cleanup_expired_sessions():
                     (PasswordReset.expires_at < now - timedelta(days=1)) | (PasswordReset.is_used == True)
                 ).delete()
                 db.session.commit()
-                for token, payload in list(session_cache.items()):
-                    expires = payload.get('expires_at')
-                    if expires and expires < now:
-                        session_cache.pop(token, None)
+                shared_state.purge_expired()
         except Exception:
             pass
         time.sleep(900)
 
 
-def initialize_application():
-    with app.app_context():
-        run_first_setup(force=False)
-        refresh_runtime_config()
+def pregenerate_qr_codes_job():
+    while True:
+        try:
+            with app.app_context():
+                created = pregenerate_preorder_qr_codes()
+                removed = qr_cache.prune(max_age_days=14)
+                if created or removed:
+                    app.logger.info(f'QR cache: {created} pregenerated, {removed} pruned')
+        except Exception as e:
+            app.logger.error(f'pregenerate_qr_codes_job failed: {str(e)}')
+        time.sleep(3600)
+
+
+def run_columnar_export(full=False, fmt=None):
+    fmt = fmt or str(get_cfg('columnar_export_format', DEFAULT_CFG['columnar_export_format']))
+    summary = columnar_exporter.export(fmt=fmt, full=full)
+    app.logger.info(f"Columnar export ({summary['format']}): {len(summary['written'])} partitions, "
+                    f"{summary['rows']} rows, {summary['skipped']} skipped")
+    return summary
 
 
-sys.modules.setdefault('main', sys.modules['__main__'])
+def columnar_export_job():
+    while True:
+        try:
+            with app.app_context():
+                if cfg_bool('columnar_export_enabled', DEFAULT_CFG['columnar_export_enabled']):
+                    run_columnar_export()
+        except ImportError:
+            app.logger.error('columnar_export_job: pyarrow is not installed')
+            return
+        except Exception as e:
+            app.logger.error(f'columnar_export_job failed: {str(e)}')
+        time.sleep(86400)
 
-from routes.auth import auth as auth_bp
-from routes.menu import menu as menu_bp
-from routes.orders import orders as orders_bp
-from routes.profile import profile as profile_bp
-from routes.admin import admin as admin_bp
-from routes.kitchen import kitchen as kitchen_bp
-from routes.misc import misc as misc_bp
 
-app.register_blueprint(auth_bp)
-app.register_blueprint(menu_bp)
-app.register_blueprint(orders_bp)
-app.register_blueprint(profile_bp)
-app.register_blueprint(admin_bp)
-app.register_blueprint(kitchen_bp)
-app.register_blueprint(misc_bp)
+def seconds_until_hour(hour, now=None):
+    now = now or datetime.now()
+    target = now.replace(hour=hour, minute=0, second=0, microsecond=0)
+    if target <= now:
+        target += timedelta(days=1)
+    return (target - now).total_seconds()
 
 
-if __name__ == '__main__':
-    initialize_application()
+def forecast_demand_job():
+    startup = True
+    while True:
+        try:
+            with app.app_context():
+                if not startup or not DishForecast.query.filter(DishForecast.day == date.today()).first():
+                    created = compute_demand_forecast()
+                    app.logger.info(f'Demand forecast: {created} dish-days')
+        except Exception as e:
+            app.logger.error(f'forecast_demand_job failed: {str(e)}')
+        startup = False
+        time.sleep(seconds_until_hour(FORECAST_RUN_HOUR))
+
+
+def compact_daily_rollups_job():
+    while True:
+        try:
+            with app.app_context():
+                days = compact_daily_rollups()
+                app.logger.info(f'Daily rollups compacted: {days} days')
+        except Exception as e:
+            app.logger.error(f'compact_daily_rollups_job failed: {str(e)}')
+        time.sleep(ROLLUP_COMPACT_INTERVAL_SECONDS)
+
+
+def refresh_report_snapshots_job():
+    while True:
+        try:
+            with app.app_context():
+                refresh_report_snapshots()
+        except Exception as e:
+            app.logger.error(f'refresh_report_snapshots_job failed: {str(e)}')
+        time.sleep(REPORT_SNAPSHOT_INTERVAL_SECONDS)
+
+
+BACKGROUND_JOBS = (
+    cleanup_expired_sessions,
+    pregenerate_qr_codes_job,
+    refresh_report_snapshots_job,
+    compact_daily_rollups_job,
+    columnar_export_job,
+    forecast_demand_job,
+)
+BACKGROUND_JOBS_LOCK_PATH = DATA_DIR / 'jobs.lock'
+BACKGROUND_JOBS_RETRY_SECONDS = 60
+background_jobs_lock = None
+
+
+def acquire_background_jobs_lock():
+    handle = open(BACKGROUND_JOBS_LOCK_PATH, 'a+')
+    try:
+        if os.name == 'nt':
+            import msvcrt
+            handle.seek(0)
+            msvcrt.locking(handle.fileno(), msvcrt.LK_NBLCK, 1)
+        else:
+            import fcntl
+            fcntl.flock(handle.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        handle.close()
+        return None
+    return handle
+
+
+def start_background_jobs():
+    global background_jobs_lock
+    if background_jobs_lock is not None:
+        return True
+    handle = acquire_background_jobs_lock()
+    if handle is None:
+        return False
+    background_jobs_lock = handle
+    for job in BACKGROUND_JOBS:
+        Thread(target=job, daemon=True).start()
+    app.logger.info(f'Background jobs started in process {os.getpid()}')
+    return True
+
+
+def background_jobs_leader():
+    while not start_background_jobs():
+        time.sleep(BACKGROUND_JOBS_RETRY_SECONDS)
+
+
+def prepare_console_runners():
+    global admin_console_runner, admin_console_runner_admin
     admin_console_runner = build_console(mode=True, log_file='console.txt')
     admin_console_runner.start_console()
+    admin_console_runner_admin = build_console(mode=True, log_file='console_admin.txt')
+    admin_console_runner_admin.start_console()
+
 
+def start_interactive_console():
     if sys.stdin and sys.stdin.isatty():
         console = build_console(mode=False, log_file='console.txt')
         Thread(target=console.start, daemon=True).start()
 
-    Thread(target=cleanup_expired_sessions, daemon=True).start()
+
+def initialize_application():
+    build_static_assets()
+    with app.app_context():
+        run_first_setup(force=False)
+        refresh_runtime_config()
+
+
+def register_core_handlers(flask_app):
+    flask_app.view_functions['static'] = serve_static_file
+    flask_app.add_url_rule('/favicon.ico', 'favicon', favicon)
+    flask_app.add_url_rule('/favicon.png', 'favicon_png', favicon_png)
+    flask_app.add_url_rule('/assets/<path:filename>', 'static_asset', static_asset)
+    flask_app.context_processor(inject_helpers)
+    flask_app.before_request(run_periodic_cleanup)
+    flask_app.before_request(attach_user_to_request)
+    flask_app.before_request(enforce_setup_gate)
+    flask_app.before_request(enforce_csrf_protection)
+    flask_app.register_error_handler(PasswordHashingBusy, handle_password_hashing_busy)
+
+
+def register_blueprints(flask_app):
+    from routes.auth import auth as auth_bp
+    from routes.menu import menu as menu_bp
+    from routes.orders import orders as orders_bp
+    from routes.profile import profile as profile_bp
+    from routes.admin import admin as admin_bp
+    from routes.kitchen import kitchen as kitchen_bp
+    from routes.misc import misc as misc_bp
+
+    flask_app.register_blueprint(auth_bp)
+    flask_app.register_blueprint(menu_bp)
+    flask_app.register_blueprint(orders_bp)
+    flask_app.register_blueprint(profile_bp)
+    flask_app.register_blueprint(admin_bp)
+    flask_app.register_blueprint(kitchen_bp)
+    flask_app.register_blueprint(misc_bp)
+
+
+def create_app():
+    global app, proxy_fix, compression_middleware
+    if app is not None:
+        return app
+    for folder in [DATA_DIR, STATIC_DIR, ICON_DIR, DISH_ICON_DIR, BG_DIR, STATIC_DIR / 'ico']:
+        folder.mkdir(parents=True, exist_ok=True)
+    flask_app = Flask(__name__, static_folder=str(STATIC_DIR), template_folder=str(TEMPLATES_DIR))
+    flask_app.config['SQLALCHEMY_DATABASE_URI'] = f"sqlite:///{(DATA_DIR / 'DB.db').as_posix()}"
+    flask_app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    flask_app.config['UPLOAD_FOLDER'] = str(ICON_DIR)
+    flask_app.config['MAX_CONTENT_LENGTH'] = 8 * 1024 * 1024
+    bootstrap_secret_key, _ = resolve_secret_key()
+    flask_app.config['SECRET_KEY'] = bootstrap_secret_key
+    flask_app.secret_key = bootstrap_secret_key
+    db.init_app(flask_app)
+
+    proxy_fix = ProxyFix(flask_app.wsgi_app, x_for=0, x_proto=0)
+    compression_middleware = CompressionMiddleware(proxy_fix, min_size=COMPRESSION_MIN_SIZE)
+    flask_app.wsgi_app = compression_middleware
+    register_core_handlers(flask_app)
+    register_blueprints(flask_app)
+
+    app = flask_app
+    configure_shared_state()
+    asset_pipeline.load()
+    initialize_application()
+    prepare_console_runners()
+    return app
+
+
+def run_development_server():
+    create_app()
+    start_interactive_console()
+    Thread(target=background_jobs_leader, daemon=True).start()
 
     with app.app_context():
         host = str(get_cfg('adress', DEFAULT_CFG['adress']))
@@ -2654,3 +4487,10 @@ if __name__ == '__main__':
 
     logging.getLogger('werkzeug').setLevel(logging.INFO if debug_enabled else logging.ERROR)
     app.run(debug=False, host=host, port=port, use_reloader=False, threaded=True)
+
+
+if __name__ == '__main__':
+    # Blueprints import from ``main``; run the importable module rather than this ``__main__`` copy.
+    import main
+
+    main.run_development_server()
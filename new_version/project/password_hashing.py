@@ -0,0 +1,133 @@
+import os
+import re
+import time
+import weakref
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from threading import Lock
+
+from werkzeug.security import check_password_hash, generate_password_hash
+
+HASH_METHOD_RE = re.compile(r'^(?:scrypt(?::(\d+):(\d+):(\d+))?|pbkdf2:(?:sha256|sha512)(?::(\d+))?)$')
+SCRYPT_MIN_N = 1 << 14
+PBKDF2_MIN_ITERATIONS = 100000
+
+
+class PasswordHashingBusy(Exception):
+    pass
+
+
+def is_valid_hash_method(method):
+    match = HASH_METHOD_RE.match(str(method or ''))
+    if not match:
+        return False
+    n, r, p, iterations = match.groups()
+    if n is not None:
+        n = int(n)
+        return n >= SCRYPT_MIN_N and n & (n - 1) == 0 and int(r) > 0 and int(p) > 0
+    if iterations is not None:
+        return int(iterations) >= PBKDF2_MIN_ITERATIONS
+    return True
+
+
+class PasswordHasher:
+    def __init__(self, method='scrypt', max_workers=4, max_queue=32, timeout=15.0):
+        self.method = method
+        self.max_workers = max(1, int(max_workers))
+        self.max_queue = max(0, int(max_queue))
+        self.timeout = timeout
+        self._method_prefix = None
+        self._reset_state()
+        if hasattr(os, 'register_at_fork'):
+            ref = weakref.ref(self)
+            os.register_at_fork(after_in_child=lambda: ref() and ref()._reset_state())
+
+    def _reset_state(self):
+        # Pool threads do not survive fork (gunicorn preload), so a child starts with a fresh pool.
+        self._executor = None
+        self._lock = Lock()
+        self._in_flight = 0
+        self._stats = {'completed': 0, 'shed': 0, 'timed_out': 0, 'peak_in_flight': 0, 'total_ms': 0.0,
+                       'rehashed': 0}
+
+    def configure(self, method=None, max_workers=None, max_queue=None):
+        with self._lock:
+            if method and method != self.method:
+                self.method = method
+                self._method_prefix = None
+            if max_workers and int(max_workers) != self.max_workers:
+                self.max_workers = max(1, int(max_workers))
+                if self._executor is not None:
+                    self._executor.shutdown(wait=False)
+                    self._executor = None
+            if max_queue is not None:
+                self.max_queue = max(0, int(max_queue))
+
+    def _submit(self, fn, *args):
+        with self._lock:
+            if self._in_flight >= self.max_workers + self.max_queue:
+                self._stats['shed'] += 1
+                raise PasswordHashingBusy()
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='pwhash')
+            self._in_flight += 1
+            self._stats['peak_in_flight'] = max(self._stats['peak_in_flight'], self._in_flight)
+            executor = self._executor
+        started = time.perf_counter()
+        try:
+            future = executor.submit(fn, *args)
+        except RuntimeError:
+            with self._lock:
+                self._in_flight -= 1
+            raise PasswordHashingBusy() from None
+        future.add_done_callback(lambda _future: self._finished(started))
+        try:
+            return future.result(timeout=self.timeout)
+        except FutureTimeoutError:
+            with self._lock:
+                self._stats['timed_out'] += 1
+            raise PasswordHashingBusy() from None
+
+    def _finished(self, started):
+        with self._lock:
+            self._in_flight -= 1
+            self._stats['completed'] += 1
+            self._stats['total_ms'] += (time.perf_counter() - started) * 1000
+
+    def hash(self, password):
+        return self._submit(generate_password_hash, password, self.method)
+
+    def verify(self, pwhash, password):
+        if not pwhash:
+            return False
+        return self._submit(check_password_hash, pwhash, password)
+
+    def current_prefix(self):
+        if self._method_prefix is None:
+            self._method_prefix = generate_password_hash('', self.method).split('$', 1)[0]
+        return self._method_prefix
+
+    def needs_rehash(self, pwhash):
+        return bool(pwhash) and pwhash.split('$', 1)[0] != self.current_prefix()
+
+    def mark_rehashed(self):
+        with self._lock:
+            self._stats['rehashed'] += 1
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            in_flight = self._in_flight
+        completed = stats['completed']
+        return {
+            'method': self.method,
+            'workers': self.max_workers,
+            'max_queue': self.max_queue,
+            'in_flight': in_flight,
+            'queued': max(0, in_flight - self.max_workers),
+            'peak_in_flight': stats['peak_in_flight'],
+            'completed': completed,
+            'shed': stats['shed'],
+            'timed_out': stats['timed_out'],
+            'rehashed': stats['rehashed'],
+            'avg_ms': round(stats['total_ms'] / completed, 1) if completed else 0.0,
+        }
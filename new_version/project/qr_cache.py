@@ -0,0 +1,102 @@
+import hashlib
+import io
+import os
+import time
+from collections import OrderedDict
+from pathlib import Path
+from threading import Lock
+
+
+class QRCodeCache:
+    def __init__(self, cache_dir, max_items=512):
+        self.cache_dir = Path(cache_dir)
+        self.max_items = max(1, int(max_items))
+        self._items = OrderedDict()
+        self._lock = Lock()
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def make_etag(payload):
+        return hashlib.sha256(str(payload).encode('utf-8')).hexdigest()[:32]
+
+    def _disk_path(self, etag):
+        return self.cache_dir / f'{etag}.png'
+
+    def _remember(self, etag, png):
+        with self._lock:
+            self._items[etag] = png
+            self._items.move_to_end(etag)
+            while len(self._items) > self.max_items:
+                self._items.popitem(last=False)
+
+    @staticmethod
+    def render_png(payload):
+        import qrcode
+
+        img = qrcode.make(payload)
+        buf = io.BytesIO()
+        img.save(buf, format='PNG')
+        return buf.getvalue()
+
+    def get_png(self, payload):
+        etag = self.make_etag(payload)
+        with self._lock:
+            png = self._items.get(etag)
+            if png is not None:
+                self._items.move_to_end(etag)
+                self.hits += 1
+                return png, etag
+
+        path = self._disk_path(etag)
+        try:
+            png = path.read_bytes()
+            self.disk_hits += 1
+        except OSError:
+            png = None
+        if png is None:
+            png = self.render_png(payload)
+            self.misses += 1
+            self._write_disk(path, png)
+        self._remember(etag, png)
+        return png, etag
+
+    def _write_disk(self, path, png):
+        try:
+            self.cache_dir.mkdir(parents=True, exist_ok=True)
+            tmp_path = path.with_suffix(f'.{os.getpid()}.tmp')
+            tmp_path.write_bytes(png)
+            os.replace(tmp_path, path)
+        except OSError:
+            pass
+
+    def pregenerate(self, payloads):
+        created = 0
+        for payload in payloads:
+            etag = self.make_etag(payload)
+            path = self._disk_path(etag)
+            if path.exists():
+                continue
+            self._write_disk(path, self.render_png(payload))
+            created += 1
+        return created
+
+    def prune(self, max_age_days=14):
+        if not self.cache_dir.exists():
+            return 0
+        border = time.time() - max_age_days * 86400
+        removed = 0
+        for path in self.cache_dir.glob('*.png'):
+            try:
+                if path.stat().st_mtime < border:
+                    path.unlink()
+                    removed += 1
+            except OSError:
+                continue
+        return removed
+
+    def stats(self):
+        with self._lock:
+            size = len(self._items)
+        return {'memory_items': size, 'hits': self.hits, 'disk_hits': self.disk_hits, 'misses': self.misses}
@@ -0,0 +1,81 @@
+import time
+
+
+class SlidingWindowLimiter:
+    def __init__(self, state, policies, prefix='rl:'):
+        self.state = state
+        self.policies = dict(policies)
+        self.prefix = prefix
+
+    def _policy(self, name):
+        policy = self.policies.get(name)
+        if policy is None:
+            raise KeyError(f'Unknown rate limit policy: {name}')
+        return policy
+
+    def _window(self, name, ident, now):
+        window = self._policy(name)['window']
+        index = int(now // window)
+        elapsed = now - index * window
+        base = f'{self.prefix}{name}:{ident}:'
+        return f'{base}{index}', f'{base}{index - 1}', 1.0 - elapsed / window, window - elapsed
+
+    def _block_key(self, name, ident):
+        return f'{self.prefix}{name}:{ident}:block'
+
+    def _estimate(self, current_key, previous_key, weight):
+        return self.state.get(previous_key, 0) * weight + self.state.get(current_key, 0)
+
+    def count(self, name, outcome):
+        self.state.incr(f'{self.prefix}stats:{name}:{outcome}')
+
+    def blocked_for(self, name, ident):
+        remaining = (self.state.get(self._block_key(name, ident)) or 0) - time.time()
+        return int(remaining) + 1 if remaining > 0 else 0
+
+    def peek(self, name, ident):
+        policy = self._policy(name)
+        blocked = self.blocked_for(name, ident)
+        if blocked:
+            return blocked
+        current_key, previous_key, weight, left = self._window(name, ident, time.time())
+        if self._estimate(current_key, previous_key, weight) >= policy['limit']:
+            return int(left) + 1
+        return 0
+
+    def hit(self, name, ident):
+        retry_after = self.peek(name, ident)
+        if retry_after:
+            self.count(name, 'limited')
+            return retry_after
+        self.record(name, ident)
+        self.count(name, 'allowed')
+        return 0
+
+    def record(self, name, ident):
+        policy = self._policy(name)
+        now = time.time()
+        current_key, previous_key, weight, _ = self._window(name, ident, now)
+        self.state.incr(current_key, ttl=policy['window'] * 2)
+        estimate = self._estimate(current_key, previous_key, weight)
+        block = policy.get('block', 0)
+        if block and estimate >= policy['limit']:
+            self.state.set(self._block_key(name, ident), now + block, ttl=block)
+            self.state.delete(current_key)
+            self.state.delete(previous_key)
+            self.count(name, 'blocked')
+        return estimate
+
+    def reset(self, name, ident):
+        current_key, previous_key, _, _ = self._window(name, ident, time.time())
+        for key in (current_key, previous_key, self._block_key(name, ident)):
+            self.state.delete(key)
+
+    def stats(self):
+        rows = {}
+        for name in self.policies:
+            rows[name] = {
+                outcome: self.state.get(f'{self.prefix}stats:{name}:{outcome}', 0)
+                for outcome in ('allowed', 'limited', 'blocked')
+            }
+        return rows
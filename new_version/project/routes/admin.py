@@ -4,16 +4,17 @@ import json as _json
 import re
 from datetime import timedelta
 
-from flask import Blueprint, redirect, render_template, request, flash, make_response
+from flask import Blueprint, current_app, redirect, render_template, request, flash, make_response
 from main import (
-    app, db, build_base_context, require_user, require_roles, message_page,
-    Users, Dish, DishGroup, DishReview, MealOrder, Session, WeeklyMenu,
+    db, build_base_context, require_user, require_roles, message_page,
+    Users, Dish, DishGroup, DishReview, Session, WeeklyMenu,
     can_change_user_role, allowed_roles_to_assign, create_notification,
     get_cfg, cfg_bool, set_cfg, DEFAULT_CFG, contact_data_to_raw,
     save_project_settings_from_request, refresh_runtime_config,
     role_label, USER_ROLES,
+    aggregate_order_rollup, top_dish_rollup_rows, build_dashboard_charts, PAID_ORDER_STATUSES,
     to_int, to_float, func, datetime,
-    DISH_ICON_DIR, save_as_avif, Image,
+    submit_dish_image,
     get_console_allowed_commands, get_console_command_specs,
     is_role, build_console, role_level, get_csrf_token, is_valid_csrf_request,
 )
@@ -93,6 +94,8 @@ def create_menu_group():
 
 @admin_bp.route('/create_dish/', methods=['GET', 'POST'])
 def create_dish():
+    from PIL import Image
+
     user, failure = require_roles({'admin', 'super_admin'})
     if failure:
         return failure
@@ -231,20 +234,15 @@ def create_dish():
                 image = request.files.get('dish_image')
                 if image and image.filename:
                     try:
-                        img = Image.open(image).convert('RGBA')
-                        w, h = img.size
-                        side = min(w, h)
-                        img = img.crop(((w - side) / 2, (h - side) / 2, (w + side) / 2, (h + side) / 2))
-                        img = img.resize((900, 900), Image.LANCZOS)
-                        output_name = f'{dish.id}.avif'
-                        save_as_avif(img, DISH_ICON_DIR / output_name)
-                        dish.image_path = f'icons/dishes/{output_name}'
-                        db.session.commit()
+                        Image.open(image)
+                        image.seek(0)
+                        submit_dish_image(dish, image.stream, user.id)
+                        flash('Фото блюда обрабатывается и появится через несколько секунд.', 'success')
                     except IOError as e:
-                        app.logger.warning(f'Invalid image file for dish {dish.id}: {str(e)}')
+                        current_app.logger.warning(f'Invalid image file for dish {dish.id}: {str(e)}')
                         flash('Блюдо добавлено, но изображение не загружено (неверный формат).', 'warning')
                     except Exception as e:
-                        app.logger.error(f'Failed to process dish image for dish {dish.id}: {str(e)}')
+                        current_app.logger.error(f'Failed to process dish image for dish {dish.id}: {str(e)}')
                         flash('Блюдо добавлено, но ошибка при обработке изображения. Попробуйте позже.', 'warning')
 
                 flash('Блюдо успешно добавлено в меню.', 'success')
@@ -408,32 +406,19 @@ def admin_dashboard():
         return failure
 
     now = datetime.utcnow()
-    today_start = now.replace(hour=0, minute=0, second=0, microsecond=0)
-    week_start = today_start - timedelta(days=today_start.weekday())
-    month_start = today_start.replace(day=1)
-    paid_statuses = ('ordered', 'issued', 'received')
-
-    def revenue_since(dt):
-        val = db.session.query(func.sum(MealOrder.price)).filter(
-            MealOrder.status.in_(paid_statuses),
-            MealOrder.created_at >= dt
-        ).scalar()
-        return val or 0
-
-    revenue_today = revenue_since(today_start)
+    today = now.date()
+    week_start = today - timedelta(days=today.weekday())
+    month_start = today.replace(day=1)
+
+    revenue_by_day = aggregate_order_rollup('day', start=min(week_start, month_start), statuses=PAID_ORDER_STATUSES)
+
+    def revenue_since(day):
+        return sum(values[1] for row_day, values in revenue_by_day.items() if row_day >= day)
+
+    revenue_today = revenue_since(today)
     revenue_week = revenue_since(week_start)
     revenue_month = revenue_since(month_start)
 
-    top_dishes_rows = (
-        db.session.query(Dish.title, func.count(MealOrder.id).label('cnt'))
-        .join(MealOrder, MealOrder.dish_id == Dish.id)
-        .filter(MealOrder.status.in_(paid_statuses))
-        .group_by(Dish.id, Dish.title)
-        .order_by(func.count(MealOrder.id).desc())
-        .limit(10)
-        .all()
-    )
-
     thirty_days_ago = now - timedelta(days=30)
     active_users_count = (
         db.session.query(Session.user_id)
@@ -442,12 +427,8 @@ def admin_dashboard():
         .count()
     )
 
-    charts_json = _json.dumps({
-        'top_dishes': {
-            'labels': [r.title for r in top_dishes_rows],
-            'data': [r.cnt for r in top_dishes_rows],
-        }
-    })
+    charts = build_dashboard_charts(today)
+    charts_json = _json.dumps(charts)
 
     return render_template('dashboard.html', **build_base_context(
         user,
@@ -465,26 +446,13 @@ def admin_dashboard_export_csv():
     if failure:
         return failure
 
-    paid_statuses = ('ordered', 'issued', 'received')
-    rows = (
-        db.session.query(
-            Dish.title.label('dish_name'),
-            func.count(MealOrder.id).label('order_count'),
-            func.sum(MealOrder.price).label('revenue'),
-            func.avg(MealOrder.price).label('avg_price'),
-        )
-        .join(MealOrder, MealOrder.dish_id == Dish.id)
-        .filter(MealOrder.status.in_(paid_statuses))
-        .group_by(Dish.id, Dish.title)
-        .order_by(func.count(MealOrder.id).desc())
-        .all()
-    )
+    rows = top_dish_rollup_rows(None, statuses=PAID_ORDER_STATUSES)
 
     buf = io.StringIO()
     writer = csv.writer(buf)
     writer.writerow(['dish_name', 'order_count', 'revenue', 'avg_price'])
-    for r in rows:
-        writer.writerow([r.dish_name, r.order_count, r.revenue or 0, round(r.avg_price or 0, 2)])
+    for dish_name, order_count, revenue in rows:
+        writer.writerow([dish_name, order_count, revenue, round(revenue / order_count, 2) if order_count else 0])
 
     response = make_response(buf.getvalue())
     response.headers['Content-Type'] = 'text/csv; charset=utf-8'
@@ -1,16 +1,16 @@
-from flask import Blueprint, g, redirect, render_template, request, session, flash
+from flask import Blueprint, current_app, g, redirect, render_template, request, session, flash
 from main import (
-    db, app, get_csrf_token, is_valid_csrf_request, check_session,
+    db, get_csrf_token, is_valid_csrf_request, check_session,
     build_base_context, require_user, require_roles, message_page,
     Users, Session, EmailVerification, PasswordReset, LoginOTP,
     normalize_email, is_valid_email, find_user_by_email, resolve_super_admin_by_password,
     gen_code, sign_in_user, logout_user_response, create_email_verification, verify_email_token,
     create_password_reset, get_active_password_reset, send_email, get_cfg,
-    REGISTRATION_ROLES, session_cache, generate_password_hash, check_password_hash,
+    REGISTRATION_ROLES, session_cache, hash_password, verify_password, verify_user_password,
     generate_setup_access_code, cfg_bool, DEFAULT_CFG, save_project_settings_from_request,
     ensure_super_admin, set_cfg, refresh_runtime_config, contact_data_to_raw,
     to_int, datetime,
-    check_rate_limit, record_failed_attempt, clear_rate_limit,
+    check_rate_limit, record_failed_attempt, clear_rate_limit, client_ip, rate_limit_hit, rate_limit_message,
     create_login_otp, verify_login_otp, check_otp_resend_cooldown, mask_email
 )
 auth = Blueprint('auth', __name__)
@@ -43,7 +43,7 @@ def setup():
         code_hash = str(get_cfg('setup_access_code_hash', '') or '')
         if not code_hash:
             fallback_code = generate_setup_access_code(12)
-            set_cfg('setup_access_code_hash', generate_password_hash(fallback_code))
+            set_cfg('setup_access_code_hash', hash_password(fallback_code))
             set_cfg('setup_access_mode', 'auto')
             set_cfg('setup_access_hint', f'{fallback_code[:2]}***{fallback_code[-2:]}')
             set_cfg('setup_access_issued_at', datetime.utcnow().isoformat())
@@ -55,15 +55,15 @@ def setup():
             setup_code = request.form.get('setup_code', '').strip()
             if not setup_code:
                 mes = 'Введите код доступа к мастеру.'
-            elif code_hash and check_password_hash(code_hash, setup_code):
+            elif code_hash and verify_password(code_hash, setup_code):
                 session['setup_unlocked'] = True
                 session.permanent = False
                 session.modified = True
-                app.logger.info(f'Setup unlocked from IP {request.remote_addr}')
+                current_app.logger.info(f'Setup unlocked from IP {request.remote_addr}')
                 flash('Код доступа подтвержден.', 'success')
                 return redirect('/setup/')
             else:
-                app.logger.warning(f'Failed setup code attempt from IP {request.remote_addr}')
+                current_app.logger.warning(f'Failed setup code attempt from IP {request.remote_addr}')
                 mes = 'Неверный код доступа.'
         else:
             admin_email = normalize_email(request.form.get('admin_email', ''))
@@ -82,7 +82,7 @@ def setup():
                 field_errors['admin_password_confirm'] = True
             else:
                 errors = save_project_settings_from_request(request.form, {})
-                set_cfg('super_admin_password_hash', generate_password_hash(admin_password))
+                set_cfg('super_admin_password_hash', hash_password(admin_password))
                 set_cfg('gen_admin', admin_email)
                 set_cfg('setup_done', True)
                 ensure_super_admin(admin_email, admin_password)
@@ -190,7 +190,7 @@ def reg(cod):
             else:
                 user = Users(
                     email=email,
-                    psw=generate_password_hash(password),
+                    psw=hash_password(password),
                     name=name,
                     surname=surname,
                     otchestvo=otchestvo,
@@ -227,9 +227,7 @@ def reg_cancel(cod):
         return message_page('Ссылка отмены недействительна.')
     EmailVerification.query.filter_by(user_id=user.id).delete()
     Session.query.filter_by(user_id=user.id).delete()
-    for token, payload in list(session_cache.items()):
-        if payload.get('user_id') == user.id:
-            session_cache.pop(token, None)
+    session_cache.drop_user(user.id)
     db.session.delete(user)
     db.session.commit()
     return render_template('reg_cancelled.html', **build_base_context(None))
@@ -255,7 +253,7 @@ def login(cod):
     form_data = {'email': ''}
     field_errors = {}
     if request.method == 'POST':
-        ip = request.headers.get('X-Forwarded-For', request.remote_addr or '0.0.0.0').split(',')[0].strip()
+        ip = client_ip()
         blocked_until, remaining = check_rate_limit(ip)
         if blocked_until:
             mes = f'Слишком много попыток. Повторите через {remaining} мин.'
@@ -264,9 +262,12 @@ def login(cod):
         email = normalize_email(form_data['email'])
         password = request.form.get('password', '')
         user = find_user_by_email(email)
-        if not user:
+        if user:
+            password_ok = verify_user_password(user, password)
+        else:
             user = resolve_super_admin_by_password(email, password)
-        if not user or not check_password_hash(user.psw, password):
+            password_ok = user is not None
+        if not user or not password_ok:
             mes = 'Неверный email или пароль.'
             field_errors['email'] = True
             record_failed_attempt(ip)
@@ -314,7 +315,10 @@ def password_restore():
         form_data['email'] = request.form.get('email', '')
         email = normalize_email(form_data['email'])
         generic_mes = 'Если аккаунт найден, инструкция по восстановлению отправлена на email.'
-        if not is_valid_email(email):
+        retry_after = rate_limit_hit('password_restore')
+        if retry_after:
+            mes = rate_limit_message(retry_after)
+        elif not is_valid_email(email):
             mes = 'Введите корректный email.'
             field_errors['email'] = True
         else:
@@ -371,13 +375,11 @@ def password_reset(code):
         elif len(password) < 6:
             mes = 'Пароль должен быть не короче 6 символов.'
         else:
-            user.psw = generate_password_hash(password)
+            user.psw = hash_password(password)
             user.url_code = gen_code()
             reset.is_used = True
             Session.query.filter_by(user_id=user.id, is_active=True).update({'is_active': False})
-            for token, payload in list(session_cache.items()):
-                if payload.get('user_id') == user.id:
-                    session_cache.pop(token, None)
+            session_cache.drop_user(user.id)
             db.session.commit()
             send_email(
                 user.email,
@@ -435,7 +437,7 @@ def resend_verification():
                     mes = 'Письмо с ссылкой активации отправлено на ваш email. Если письмо не приходит, проверьте папку спама.'
                     return render_template('message.html', **build_base_context(None, message=mes, title="Письмо отправлено"))
                 except Exception as e:
-                    app.logger.error(f"Resend verification failed: {str(e)}")
+                    current_app.logger.error(f"Resend verification failed: {str(e)}")
                     mes = 'Ошибка при отправке письма. Попробуйте позже.'
 
     return render_template('resend_verification.html', **build_base_context(None, mes=mes, form_data=form_data, field_errors=field_errors))
@@ -461,21 +463,24 @@ def login_verify_otp():
             if cooldown > 0:
                 mes = f'Повторная отправка доступна через {cooldown} сек.'
             else:
-                ip = request.headers.get('X-Forwarded-For', request.remote_addr or '0.0.0.0').split(',')[0].strip()
+                ip = client_ip()
                 create_login_otp(user, ip)
                 mes = 'Новый код отправлен на вашу почту.'
                 resend_cooldown = 60
         else:
             entered_code = request.form.get('otp_code', '').strip()
+            retry_after = rate_limit_hit('otp_verify', f'user:{otp_user_id}') if entered_code else 0
             if not entered_code:
                 mes = 'Введите код подтверждения.'
+            elif retry_after:
+                mes = rate_limit_message(retry_after)
             else:
                 verified_user, error = verify_login_otp(otp_user_id, entered_code)
                 if error:
                     mes = error
                 else:
                     session.pop('otp_user_id', None)
-                    ip = request.headers.get('X-Forwarded-For', request.remote_addr or '0.0.0.0').split(',')[0].strip()
+                    ip = client_ip()
                     clear_rate_limit(ip)
                     return sign_in_user(verified_user)
     return render_template('login_verify_otp.html',
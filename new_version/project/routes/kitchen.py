@@ -2,21 +2,26 @@ import csv
 import io
 import json
 import re
-import zipfile
 
-from flask import Blueprint, redirect, render_template, request, flash, send_file
+from flask import Blueprint, current_app, Response, jsonify, make_response, redirect, render_template, request, flash, \
+    stream_with_context
 from main import (
-    app, db, build_base_context, require_roles, require_user, message_page,
+    db, build_base_context, require_roles, require_user, message_page,
     is_valid_csrf_request,
-    Users, Dish, MealOrder, InventoryItem, PurchaseRequest, Incident,
-    build_report_payload, parse_order_status_label, create_notification, create_notification_for_roles,
+    Users, Dish, DishIngredient, MealOrder, InventoryItem, PurchaseRequest, Incident,
+    build_report_payload, build_report_export_datasets, iter_export_rows, build_production_plan,
+    load_demand_forecast, project_inventory, parse_order_status_label, create_notification, create_notification_for_roles,
+    issue_orders_bulk, parse_order_codes, inventory_grams_per_unit, BULK_ISSUE_MAX_ORDERS,
     INCIDENT_KIND_LABELS, INCIDENT_SEVERITY_LABELS,
     is_role, is_any_role, role_level,
-    to_int, to_float, to_date, datetime
+    to_int, to_float, to_date, date, datetime, func
 )
+from zip_stream import iter_csv, stream_zip
 
 kitchen = Blueprint('kitchen', __name__)
 
+ISSUE_ORDER_NOTICE = ('Блюдо выдано', 'Можно отметить получение в профиле.', '/profile/')
+
 
 @kitchen.route('/kitchen/', methods=['GET', 'POST'])
 def kitchen_page():
@@ -36,6 +41,8 @@ def kitchen_page():
             unit = request.form.get('unit', 'кг').strip() or 'кг'
             quantity = to_float(request.form.get('quantity', '0'), -1)
             min_quantity = to_float(request.form.get('min_quantity', '0'), -1)
+            grams_per_unit = to_float(request.form.get('grams_per_unit', '0'), 0)
+            grams_per_unit = grams_per_unit if grams_per_unit > 0 else None
             if name and quantity >= 0 and min_quantity >= 0:
                 if item_id > 0:
                     item = db.session.get(InventoryItem, item_id)
@@ -44,10 +51,12 @@ def kitchen_page():
                         item.unit = unit
                         item.quantity = quantity
                         item.min_quantity = min_quantity
+                        item.grams_per_unit = grams_per_unit
                         item.updated_at = datetime.utcnow()
                 else:
                     db.session.add(InventoryItem(name=name, unit=unit, quantity=quantity, min_quantity=min_quantity,
-                                                 created_by=user.id, updated_at=datetime.utcnow()))
+                                                 grams_per_unit=grams_per_unit, created_by=user.id,
+                                                 updated_at=datetime.utcnow()))
                 db.session.commit()
                 flash('Остаток сохранен.', 'success')
             else:
@@ -130,13 +139,7 @@ def kitchen_page():
 
         elif action == 'issue_order' and is_role(user, 'chef'):
             order_id = to_int(request.form.get('order_id', '0'), 0)
-            order = db.session.get(MealOrder, order_id)
-            if order and order.status == 'ordered':
-                order.status = 'issued'
-                order.issued_at = datetime.utcnow()
-                db.session.commit()
-                create_notification(order.user_id, 'Блюдо выдано', 'Можно отметить получение в профиле.', '/profile/')
-                db.session.commit()
+            if order_id > 0 and issue_orders_bulk([order_id], notice=ISSUE_ORDER_NOTICE)['issued']:
                 flash('Выдача отмечена.', 'success')
 
         return redirect('/kitchen/')
@@ -167,6 +170,15 @@ def kitchen_page():
         .limit(200)
         .all()
     )
+    preorder_totals = {
+        row_date.strftime('%d.%m.%Y') + f" ({_days_ru.get(row_date.strftime('%A'), '')})": count
+        for row_date, count in (
+            db.session.query(MealOrder.pre_order_date, func.count(MealOrder.id))
+            .filter(MealOrder.pre_order_date.isnot(None), MealOrder.status == 'ordered')
+            .group_by(MealOrder.pre_order_date)
+            .all()
+        )
+    }
     preorders_by_date = {}
     for order, student, dish in preorders_raw:
         day_ru = _days_ru.get(order.pre_order_date.strftime('%A'), '')
@@ -191,18 +203,137 @@ def kitchen_page():
         can_manage_kitchen=is_role(user, 'chef'),
         can_approve=is_any_role(user, {'admin', 'super_admin'}),
         preorders_by_date=preorders_by_date,
+        preorder_totals=preorder_totals,
+        demand_forecast=load_demand_forecast(days=3),
+        inventory_projection=project_inventory(),
     ))
 
 
+@kitchen.route('/kitchen/recipes/', methods=['GET', 'POST'])
+def kitchen_recipes():
+    user, failure = require_roles({'chef', 'admin', 'super_admin'})
+    if failure:
+        return failure
+
+    if request.method == 'POST':
+        if not is_valid_csrf_request():
+            return message_page('Недействительный CSRF-токен.', user=user)
+        action = request.form.get('action', '')
+        if action == 'save_ingredient':
+            dish = db.session.get(Dish, to_int(request.form.get('dish_id', '0'), 0))
+            item = db.session.get(InventoryItem, to_int(request.form.get('item_id', '0'), 0))
+            grams = to_float(request.form.get('grams', '0'), -1)
+            grams_per_unit = to_float(request.form.get('grams_per_unit', '0'), 0)
+            if item and grams_per_unit > 0:
+                item.grams_per_unit = grams_per_unit
+            if item and not inventory_grams_per_unit(item.unit, item.grams_per_unit):
+                flash(f'Для «{item.name}» укажите, сколько граммов в 1 {item.unit}.', 'error')
+            elif dish and item and grams > 0:
+                ingredient = DishIngredient.query.filter_by(dish_id=dish.id, item_id=item.id).first()
+                if ingredient:
+                    ingredient.grams = grams
+                else:
+                    db.session.add(DishIngredient(dish_id=dish.id, item_id=item.id, grams=grams))
+                db.session.commit()
+                flash('Техкарта обновлена.', 'success')
+            else:
+                flash('Выберите блюдо, продукт и укажите граммовку.', 'error')
+        elif action == 'remove_ingredient':
+            ingredient = db.session.get(DishIngredient, to_int(request.form.get('ingredient_id', '0'), 0))
+            if ingredient:
+                db.session.delete(ingredient)
+                db.session.commit()
+                flash('Продукт удален из техкарты.', 'success')
+        return redirect('/kitchen/recipes/')
+
+    dishes = Dish.query.filter_by(is_active=True).order_by(Dish.title.asc()).all()
+    inventory = InventoryItem.query.order_by(InventoryItem.name.asc()).all()
+    unit_grams = {item.id: inventory_grams_per_unit(item.unit, item.grams_per_unit) for item in inventory}
+    recipes = {}
+    for ingredient, item in (
+        db.session.query(DishIngredient, InventoryItem)
+        .join(InventoryItem, InventoryItem.id == DishIngredient.item_id)
+        .order_by(InventoryItem.name.asc())
+        .all()
+    ):
+        recipes.setdefault(ingredient.dish_id, []).append({'ingredient': ingredient, 'item': item})
+    return render_template('kitchen_recipes.html', **build_base_context(
+        user,
+        dishes=dishes,
+        inventory=inventory,
+        unit_grams=unit_grams,
+        recipes=recipes,
+    ))
+
+
+def parse_plan_args():
+    date_from = to_date(request.args.get('from', '')) or date.today()
+    days = max(1, min(31, to_int(request.args.get('days', '7'), 7)))
+    return date_from, days
+
+
+@kitchen.route('/kitchen/plan/')
+def production_plan():
+    user, failure = require_roles({'chef', 'admin', 'super_admin'})
+    if failure:
+        return failure
+    date_from, days = parse_plan_args()
+    plan = build_production_plan(date_from, days)
+    return render_template('production_plan.html', **build_base_context(user, plan=plan))
+
+
+@kitchen.route('/kitchen/plan/export.csv')
+def production_plan_export():
+    user, failure = require_roles({'chef', 'admin', 'super_admin'})
+    if failure:
+        return failure
+    date_from, days = parse_plan_args()
+    plan = build_production_plan(date_from, days)
+    output = io.StringIO()
+    writer = csv.writer(output, delimiter=';')
+    writer.writerow(['Дата', 'Блюдо', 'Категория', 'Порций', 'Масса, кг', 'Сумма'])
+    for day in plan['days']:
+        for item in day['dishes']:
+            writer.writerow([
+                day['date'].strftime('%d.%m.%Y'),
+                item['title'],
+                item['category'],
+                item['portions'],
+                item['mass_kg'],
+                item['revenue'],
+            ])
+    writer.writerow([])
+    writer.writerow(['Продукт', 'Ед.', 'На складе', 'Минимум', 'Потребуется', 'Останется', 'Блюда'])
+    for item in plan['ingredients']:
+        writer.writerow([
+            item['name'],
+            item['unit'],
+            item['quantity'],
+            item['min_quantity'],
+            item['required'],
+            item['remaining'],
+            ', '.join(item['dishes']),
+        ])
+    response = make_response(output.getvalue().encode('utf-8-sig'))
+    response.headers['Content-Type'] = 'text/csv; charset=utf-8'
+    response.headers['Content-Disposition'] = (
+        f"attachment; filename=plan_{plan['date_from'].isoformat()}_{plan['date_to'].isoformat()}.csv"
+    )
+    return response
+
+
 @kitchen.route('/reports/')
 def reports():
     user, failure = require_user(1)
     if failure:
         return failure
     payload = build_report_payload(user)
+    today = date.today()
     return render_template('reports.html', **build_base_context(user, report=payload,
                                                                 charts_json=json.dumps(payload['charts'],
-                                                                                       ensure_ascii=False)))
+                                                                                       ensure_ascii=False),
+                                                                export_from=today.replace(month=1, day=1).isoformat(),
+                                                                export_to=today.isoformat()))
 
 
 @kitchen.route('/reports/export.zip')
@@ -211,33 +342,57 @@ def reports_export():
     if failure:
         return failure
     payload = build_report_payload(user)
-    archive_io = io.BytesIO()
-    with zipfile.ZipFile(archive_io, 'w', compression=zipfile.ZIP_DEFLATED) as zf:
-        meta = {
-            'title': payload.get('title', ''),
-            'subtitle': payload.get('subtitle', ''),
-            'created_at': datetime.utcnow().strftime('%Y-%m-%d %H:%M:%S'),
-            'user_id': user.id,
-            'role': user.role,
-        }
-        zf.writestr('summary.json', json.dumps(meta, ensure_ascii=False, indent=2).encode('utf-8'))
-        for idx, table in enumerate(payload.get('tables', []), start=1):
-            output = io.StringIO()
-            writer = csv.writer(output, delimiter=';')
-            columns = table.get('columns', [])
-            keys = table.get('keys', [])
-            writer.writerow(columns)
-            for row in table.get('rows', []):
-                writer.writerow([str(row.get(key, '')) for key in keys])
-            safe_title = re.sub(r'[^A-Za-z0-9_\\-]+', '_', str(table.get('title', f'table_{idx}'))).strip('_').lower()
-            if not safe_title:
-                safe_title = f'table_{idx}'
-            zf.writestr(f'{idx:02d}_{safe_title}.csv', output.getvalue().encode('utf-8-sig'))
-    archive_io.seek(0)
+    meta = {
+        'title': payload.get('title', ''),
+        'subtitle': payload.get('subtitle', ''),
+        'created_at': datetime.utcnow().strftime('%Y-%m-%d %H:%M:%S'),
+        'user_id': user.id,
+        'role': user.role,
+    }
+    entries = [('summary.json', [json.dumps(meta, ensure_ascii=False, indent=2).encode('utf-8')])]
+    for idx, table in enumerate(payload.get('tables', []), start=1):
+        keys = table.get('keys', [])
+        safe_title = re.sub(r'[^A-Za-z0-9_\\-]+', '_', str(table.get('title', f'table_{idx}'))).strip('_').lower()
+        if not safe_title:
+            safe_title = f'table_{idx}'
+        rows = ([str(row.get(key, '')) for key in keys] for row in table.get('rows', []))
+        entries.append((f'{idx:02d}_{safe_title}.csv', iter_csv(table.get('columns', []), rows)))
     download_name = f"reports_{user.role}_{datetime.utcnow().strftime('%Y%m%d_%H%M%S')}.zip"
-    return send_file(archive_io, mimetype='application/zip', as_attachment=True, download_name=download_name)
+    return zip_response(entries, download_name)
 
 
+@kitchen.route('/reports/export/full.zip')
+def reports_export_full():
+    user, failure = require_user(1)
+    if failure:
+        return failure
+    today = date.today()
+    date_from = to_date(request.args.get('from', '')) or today.replace(month=1, day=1)
+    date_to = to_date(request.args.get('to', '')) or today
+    if date_from > date_to:
+        return message_page('Дата начала периода позже даты окончания.', user=user)
+    datasets = build_report_export_datasets(user, date_from, date_to)
+    meta = {
+        'created_at': datetime.utcnow().strftime('%Y-%m-%d %H:%M:%S'),
+        'user_id': user.id,
+        'role': user.role,
+        'from': date_from.isoformat(),
+        'to': date_to.isoformat(),
+        'files': [name for name, _, _ in datasets],
+    }
+    entries = [('summary.json', [json.dumps(meta, ensure_ascii=False, indent=2).encode('utf-8')])]
+    for name, header, statement in datasets:
+        entries.append((name, iter_csv(header, iter_export_rows(statement))))
+    download_name = f'reports_{user.role}_{date_from.isoformat()}_{date_to.isoformat()}.zip'
+    return zip_response(entries, download_name)
+
+
+def zip_response(entries, download_name):
+    response = Response(stream_with_context(stream_zip(entries)), mimetype='application/zip')
+    response.headers['Content-Disposition'] = f'attachment; filename={download_name}'
+    response.headers['Cache-Control'] = 'no-store'
+    return response
+
 
 @kitchen.route('/order/<int:order_id>/scan/', methods=['GET'])
 def order_scan_get(order_id):
@@ -263,16 +418,8 @@ def order_scan_post(order_id):
         return message_page('Недействительный CSRF-токен.', user=user)
     order = MealOrder.query.get_or_404(order_id)
     if order.status == 'ordered':
-        order.status = 'issued'
-        order.issued_at = datetime.utcnow()
-        db.session.commit()
-        create_notification(
-            order.user_id,
-            'Заказ выдан',
-            f'Ваш заказ «{order.dish.title}» выдан. Заберите у стойки.',
-            f'/order/{order_id}/qr/',
-        )
-        db.session.commit()
+        issue_orders_bulk([order.id])
+        db.session.refresh(order)
     return render_template('scan.html', **build_base_context(
         user,
         order=order,
@@ -282,6 +429,37 @@ def order_scan_post(order_id):
     ))
 
 
+@kitchen.route('/kitchen/issue/batch/', methods=['POST'])
+def issue_orders_batch():
+    user, failure = require_roles({'chef', 'admin', 'super_admin'})
+    if failure:
+        return jsonify({'status': 'error', 'message': 'Недостаточно прав доступа.'}), 403
+    data = request.get_json(silent=True)
+    if data is None:
+        data = {'codes': request.form.getlist('codes') or request.form.getlist('order_id')}
+    values = []
+    for key in ('order_ids', 'codes'):
+        raw = data.get(key) if isinstance(data, dict) else None
+        if isinstance(raw, list):
+            values.extend(raw)
+    order_ids, invalid = parse_order_codes(values)
+    if not order_ids and not invalid:
+        return jsonify({'status': 'error', 'message': 'Не переданы заказы.'}), 400
+    if len(order_ids) > BULK_ISSUE_MAX_ORDERS:
+        return jsonify({'status': 'error', 'message': f'Не более {BULK_ISSUE_MAX_ORDERS} заказов за запрос.'}), 400
+    result = issue_orders_bulk(order_ids)
+    if result['issued']:
+        current_app.logger.info(f'User {user.id} issued {len(result["issued"])} orders in batch')
+    return jsonify({
+        'status': 'ok',
+        'issued': result['issued'],
+        'skipped': result['skipped'],
+        'not_found': result['not_found'],
+        'invalid': invalid,
+        'counts': {key: len(result[key]) for key in ('issued', 'skipped', 'not_found')},
+    })
+
+
 @kitchen.route('/kitchen/scan/')
 def kitchen_scan_page():
     user, failure = require_roles({'chef', 'admin', 'super_admin'})
@@ -1,8 +1,13 @@
-from flask import Blueprint, g, jsonify, redirect, render_template, request, flash
+from urllib.parse import urlencode
+
+from flask import Blueprint, g, jsonify, redirect, render_template, request, flash, url_for
 from main import (
     db, build_base_context, require_user, require_roles, message_page,
-    Users, Dish, DishGroup, DishReview, MealOrder, WeeklyMenu,
-    build_menu_groups, dish_image_path, get_allergen_warnings,
+    Users, Dish, DishGroup, DishReview, DishRatingStat, MealOrder, WeeklyMenu,
+    build_menu_groups, build_menu_query, paginate_menu_query, parse_menu_filters, menu_filter_args,
+    resolve_menu_group, dish_allergen_list, apply_dish_rating_change, load_dish_rating_stats, top_rated_dishes,
+    load_dish_reviews, load_user_dish_review, cached_menu_fragment, get_csrf_token, build_page_etag,
+    build_data_etag, conditional_response, dish_image_path, search_dishes, get_allergen_warnings,
     get_parent_children_rows, build_child_display_name, is_parent_of_student,
     get_student_restrictions, check_dish_against_restrictions, check_dish_against_limits, get_student_daily_spent,
     parse_meal_date, create_notification, PaymentOperation,
@@ -13,24 +18,6 @@ from main import (
 
 menu = Blueprint('menu', __name__)
 
-ALLERGEN_KEYWORDS = {
-    'глютен': ['глютен', 'пшениц', 'мук', 'хлеб', 'макарон', 'крупа', 'манн', 'ячмен', 'рожь', 'овёс', 'овес'],
-    'лактоза': ['лактоз', 'молок', 'сливк', 'масл', 'сыр', 'творог', 'кефир', 'йогурт', 'сметан', 'молочн'],
-    'орехи': ['орех', 'миндал', 'фундук', 'кешью', 'грецк', 'арахис', 'фисташ'],
-    'яйца': ['яйц', 'яйко', 'омлет', 'желток', 'белок яйц'],
-    'рыба': ['рыб', 'лосос', 'треск', 'сельд', 'тунец', 'скумбри', 'минтай', 'судак', 'карп'],
-    'соя': ['соя', 'сои', 'соев'],
-    'кунжут': ['кунжут', 'тахин', 'сезам'],
-}
-
-
-def detect_dish_allergens(dish):
-    explicit = [a.strip().lower() for a in (dish.allergens or '').split(',') if a.strip()]
-    if explicit:
-        return explicit
-    text = ' '.join([dish.title or '', dish.composition or '', dish.description or '']).lower()
-    return [key for key, words in ALLERGEN_KEYWORDS.items() if any(w in text for w in words)]
-
 
 @menu.route('/')
 def index():
@@ -38,15 +25,30 @@ def index():
     today_dow = date.today().weekday()
     DAY_NAMES_RU = ['Понедельник', 'Вторник', 'Среда', 'Четверг', 'Пятница', 'Суббота', 'Воскресенье']
     current_day_name = DAY_NAMES_RU[today_dow]
-    schedule_entries = WeeklyMenu.query.filter_by(day_of_week=today_dow).all()
-    if schedule_entries:
-        scheduled_ids = {entry.dish_id for entry in schedule_entries}
-        dishes = Dish.query.filter(Dish.is_active == True, Dish.id.in_(scheduled_ids)).order_by(Dish.created_at.desc()).all()
-        has_schedule = True
-    else:
-        dishes = Dish.query.filter_by(is_active=True).order_by(Dish.created_at.desc()).all()
-        has_schedule = False
-    menu_groups = build_menu_groups(dishes)
+    saved_allergens = (user.dop_data or {}).get('allergens', []) if user else []
+    filters = parse_menu_filters(request.args, default_exclude=saved_allergens)
+    filter_args = menu_filter_args(filters)
+    can_create_dish = bool(user and has_permission(user, role_level('admin')))
+
+    def render_menu_fragment():
+        has_schedule = db.session.query(WeeklyMenu.id).filter_by(day_of_week=today_dow).first() is not None
+        menu_groups = build_menu_groups(filters, day_of_week=today_dow if has_schedule else None)
+        top_dishes = [{'dish': dish, 'avg_rating': round(stat.rating_avg or 0, 1)} for dish, stat in top_rated_dishes(5)]
+        return render_template(
+            'menu_groups_fragment.html',
+            menu_groups=menu_groups,
+            top_dishes=top_dishes,
+            dish_allergens={dish.id: dish_allergen_list(dish) for group in menu_groups for dish in group['dishes']},
+            filters=filters,
+            filter_query=urlencode(filter_args),
+            can_create_dish=can_create_dish,
+            current_day_name=current_day_name,
+            has_schedule=has_schedule,
+            csrf_token=get_csrf_token() if can_create_dish else '',
+        )
+
+    menu_fragment = cached_menu_fragment(('index', tuple(filter_args)), render_menu_fragment,
+                                         enabled=not can_create_dish)
 
     orders_preview = []
     if user:
@@ -72,69 +74,72 @@ def index():
                 entry['child'] = build_child_display_name(order_user)
             orders_preview.append(entry)
 
-    top_dishes_rows = (
-        db.session.query(Dish, func.avg(DishReview.rating).label('avg_r'), func.count(DishReview.id).label('cnt'))
-        .join(DishReview, DishReview.dish_id == Dish.id)
-        .filter(Dish.is_active == True)
-        .group_by(Dish.id)
-        .having(func.count(DishReview.id) >= 1)
-        .order_by(func.avg(DishReview.rating).desc())
-        .limit(5)
-        .all()
-    )
-    top_dishes = [{'dish': d, 'avg_rating': round(r or 0, 1)} for d, r, _ in top_dishes_rows]
-
-    dish_allergens = {dish.id: detect_dish_allergens(dish) for dish in dishes}
-    saved_allergens = []
-    if user:
-        saved_allergens = (user.dop_data or {}).get('allergens', [])
     return render_template('index.html', **build_base_context(
         user,
-        menu_groups=menu_groups,
+        menu_fragment=menu_fragment,
         orders_preview=orders_preview,
-        top_dishes=top_dishes,
-        dish_allergens=dish_allergens,
-        saved_allergens=saved_allergens,
-        can_create_dish=bool(user and has_permission(user, role_level('admin'))),
+        can_create_dish=can_create_dish,
         can_open_kitchen=bool(user and is_role(user, 'chef')),
         can_open_reports=bool(user),
-        current_day_name=current_day_name,
-        has_schedule=has_schedule,
     ))
 
 
+@menu.route('/menu/search/')
+def menu_search():
+    user = g.current_user
+    query = (request.args.get('q') or '').strip()[:100]
+    limit = max(1, min(to_int(request.args.get('limit'), 8), 20))
+    include_hidden = bool(user and has_permission(user, role_level('admin')) and request.args.get('all') == '1')
+
+    def render_json():
+        dishes = search_dishes(query, limit=limit, active_only=not include_hidden) if len(query) >= 2 else []
+        return jsonify({
+            'status': 'ok',
+            'query': query,
+            'results': [{
+                'id': dish.id,
+                'title': dish.title,
+                'price': dish.price,
+                'category': dish.category,
+                'is_active': bool(dish.is_active),
+                'url': f'/dish/{dish.id}/',
+                'image': url_for('static', filename=dish_image_path(dish, 160)),
+            } for dish in dishes],
+        })
+
+    return conditional_response(build_data_etag('menu_search', query, limit, include_hidden), render_json)
+
+
 @menu.route('/menu/group/<group_key>/')
 def menu_group_page(group_key):
     user = g.current_user
-    dishes = Dish.query.filter_by(is_active=True).order_by(Dish.created_at.desc()).all()
-    menu_groups = build_menu_groups(dishes)
-    group = next((item for item in menu_groups if item['key'] == group_key), None)
+    group = resolve_menu_group(group_key)
     if not group:
         return message_page('Группа меню не найдена.', user=user)
 
-    group_ids = [dish.id for dish in group['dishes']]
-    rate_rows = []
-    if group_ids:
-        rate_rows = (
-            db.session.query(DishReview.dish_id, func.avg(DishReview.rating), func.count(DishReview.id))
-            .filter(DishReview.dish_id.in_(group_ids))
-            .group_by(DishReview.dish_id)
-            .all()
-        )
-    ratings = {row[0]: {'avg': round(row[1] or 0, 1), 'count': row[2]} for row in rate_rows}
+    filters = parse_menu_filters(request.args)
+    query = build_menu_query(filters, group_key=group['key'])
+    dishes, next_cursor = paginate_menu_query(query, request.args.get('after'), request.args.get('limit'))
+    total_count = query.order_by(None).count()
 
-    group_db_id = None
-    if group.get('kind') == 'custom':
-        key_parts = group['key'].split('_', 1)
-        if len(key_parts) == 2 and key_parts[1].isdigit():
-            group_db_id = int(key_parts[1])
+    ratings = load_dish_rating_stats(dish.id for dish in dishes)
+
+    can_create_dish = bool(user and has_permission(user, role_level('admin')))
+    group_db_id = group['group_id']
+    group_active_count = build_menu_query(group_key=group['key']).count() if can_create_dish and group_db_id else 0
+    filter_args = menu_filter_args(filters)
     return render_template('menu_group.html', **build_base_context(
         user,
-        menu_group=group,
+        menu_group=dict(group, dishes=dishes, count=total_count),
         ratings=ratings,
         dish_image_path=dish_image_path,
-        can_create_dish=bool(user and has_permission(user, role_level('admin'))),
+        can_create_dish=can_create_dish,
         group_db_id=group_db_id,
+        group_active_count=group_active_count,
+        filters=filters,
+        is_first_page=not to_int(request.args.get('after'), 0),
+        first_page_url=f"?{urlencode(filter_args)}",
+        next_page_url=f"?{urlencode(filter_args + [('after', next_cursor)])}" if next_cursor else '',
     ))
 
 
@@ -145,26 +150,7 @@ def dish_information(dish_id):
     if not dish.is_active and not (user and has_permission(user, role_level('admin'))):
         return message_page('Блюдо недоступно.', user=user)
 
-    reviews_raw = (
-        db.session.query(DishReview, Users)
-        .join(Users, Users.id == DishReview.user_id)
-        .filter(DishReview.dish_id == dish.id)
-        .order_by(DishReview.created_at.desc())
-        .all()
-    )
-    reviews = []
-    user_review = None
-    for review, author in reviews_raw:
-        item = {
-            'id': review.id,
-            'author': f'{author.surname} {author.name}'.strip(),
-            'rating': review.rating,
-            'text': review.review_text,
-            'date': review.created_at.strftime('%d.%m.%Y %H:%M'),
-        }
-        reviews.append(item)
-        if user and review.user_id == user.id:
-            user_review = item
+    user_review = load_user_dish_review(dish.id, user)
 
     parent_children = []
     if user and user.role == 'parent':
@@ -189,26 +175,60 @@ def dish_information(dish_id):
     elif payer_balance < to_int(dish.price, 0):
         order_low_balance = True
 
-    rate_row = db.session.query(func.avg(DishReview.rating), func.count(DishReview.id)).filter(
-        DishReview.dish_id == dish.id).first()
-    allergen_warnings = get_allergen_warnings(user, dish)
-    return render_template('dish_information.html', **build_base_context(
-        user,
-        dish=dish,
-        reviews=reviews,
-        user_review=user_review,
-        avg_rating=round(rate_row[0] or 0, 1),
-        rate_count=rate_row[1] or 0,
-        can_order=can_order,
-        dish_image=dish_image_path(dish),
-        parent_children=parent_children,
-        order_block_reason=order_block_reason,
-        order_low_balance=order_low_balance,
-        payer_balance=payer_balance,
-        allergen_warnings=allergen_warnings,
-        is_favorite=dish.id in [int(x) for x in ((user.dop_data or {}).get('favorites') or []) if str(x).isdigit()] if user else False,
-        can_edit_dish=bool(user and has_permission(user, role_level('admin'))),
-    ))
+    rating_stat = db.session.get(DishRatingStat, dish.id)
+    etag = build_page_etag(
+        user, 'dish', dish.id, dish.updated_at, dish.is_active, dish.dish_group_id,
+        rating_stat.updated_at if rating_stat else '', user_review, parent_children,
+    )
+
+    def render_reviews_fragment():
+        reviews, reviews_next_cursor = load_dish_reviews(dish.id)
+        return render_template(
+            'dish_reviews_fragment.html',
+            dish=dish,
+            reviews=reviews,
+            reviews_next_cursor=reviews_next_cursor,
+            rating_histogram=rating_stat.histogram() if rating_stat and rating_stat.rating_count else {},
+        )
+
+    def render_page():
+        allergen_warnings = get_allergen_warnings(user, dish)
+        return render_template('dish_information.html', **build_base_context(
+            user,
+            dish=dish,
+            reviews_fragment=cached_menu_fragment(('dish_reviews', dish.id), render_reviews_fragment),
+            user_review=user_review,
+            avg_rating=round(rating_stat.rating_avg or 0, 1) if rating_stat else 0,
+            rate_count=rating_stat.rating_count if rating_stat else 0,
+            can_order=can_order,
+            dish_image=dish_image_path(dish),
+            parent_children=parent_children,
+            order_block_reason=order_block_reason,
+            order_low_balance=order_low_balance,
+            payer_balance=payer_balance,
+            allergen_warnings=allergen_warnings,
+            is_favorite=dish.id in [int(x) for x in ((user.dop_data or {}).get('favorites') or []) if str(x).isdigit()] if user else False,
+            can_edit_dish=bool(user and has_permission(user, role_level('admin'))),
+        ))
+
+    return conditional_response(etag, render_page)
+
+
+@menu.route('/dish/<int:dish_id>/reviews/')
+def dish_reviews_page(dish_id):
+    user = g.current_user
+    dish = Dish.query.get_or_404(dish_id)
+    if not dish.is_active and not (user and has_permission(user, role_level('admin'))):
+        return jsonify({'status': 'error', 'message': 'Блюдо недоступно'}), 404
+    rating_stat = db.session.get(DishRatingStat, dish.id)
+    etag = build_data_etag('dish_reviews', dish.id, rating_stat.updated_at if rating_stat else '',
+                           request.args.get('before'), request.args.get('limit'))
+
+    def render_json():
+        reviews, next_cursor = load_dish_reviews(dish.id, request.args.get('before'), request.args.get('limit'))
+        return jsonify({'status': 'ok', 'reviews': reviews, 'next_cursor': next_cursor})
+
+    return conditional_response(etag, render_json)
 
 
 @menu.route('/dish/<int:dish_id>/favorite/', methods=['POST'])
@@ -244,11 +264,13 @@ def dish_review(dish_id):
 
     existing = DishReview.query.filter_by(dish_id=dish.id, user_id=user.id).first()
     if existing:
+        apply_dish_rating_change(dish.id, existing.rating, rating)
         existing.rating = rating
         existing.review_text = text_body
         existing.updated_at = datetime.utcnow()
     else:
         db.session.add(DishReview(dish_id=dish.id, user_id=user.id, rating=rating, review_text=text_body))
+        apply_dish_rating_change(dish.id, None, rating)
     db.session.commit()
     flash('Отзыв сохранен.', 'success')
     return redirect(f'/dish/{dish.id}/')
@@ -543,19 +565,22 @@ def menu_week():
     user = g.current_user
     DAY_NAMES_RU = ['Понедельник', 'Вторник', 'Среда', 'Четверг', 'Пятница', 'Суббота', 'Воскресенье']
     today_dow = date.today().weekday()
-    all_entries = (
-        WeeklyMenu.query
-        .join(Dish, Dish.id == WeeklyMenu.dish_id)
-        .filter(Dish.is_active == True)
-        .order_by(WeeklyMenu.day_of_week, WeeklyMenu.id)
-        .all()
-    )
-    by_day = {i: [] for i in range(7)}
-    for entry in all_entries:
-        by_day[entry.day_of_week].append(entry)
-    return render_template('menu_week.html', **build_base_context(
-        user,
-        by_day=by_day,
-        day_names=DAY_NAMES_RU,
-        today_dow=today_dow,
+
+    def render_week_fragment():
+        rows = (
+            db.session.query(WeeklyMenu.day_of_week, Dish)
+            .join(Dish, Dish.id == WeeklyMenu.dish_id)
+            .filter(Dish.is_active == True)
+            .order_by(WeeklyMenu.day_of_week, WeeklyMenu.id)
+            .all()
+        )
+        by_day = {i: [] for i in range(7)}
+        for day_of_week, dish in rows:
+            if day_of_week in by_day:
+                by_day[day_of_week].append(dish)
+        return render_template('menu_week_fragment.html', by_day=by_day, day_names=DAY_NAMES_RU, today_dow=today_dow)
+
+    return conditional_response(build_page_etag(user, 'menu_week'), lambda: render_template(
+        'menu_week.html',
+        **build_base_context(user, week_fragment=cached_menu_fragment(('menu_week',), render_week_fragment)),
     ))
@@ -7,7 +7,7 @@ from main import (
     get_parent_children_rows, build_child_display_name,
     enforce_csrf_protection,
     has_permission, role_level, create_notification,
-    to_int, datetime
+    to_int, datetime, rate_limit_hit, rate_limit_message
 )
 
 misc_bp = Blueprint('misc', __name__)
@@ -31,6 +31,10 @@ def feedback():
             flash('Сообщение слишком длинное (максимум 5000 символов).', 'error')
             field_errors['body'] = True
         elif form_data['subject'] and form_data['body']:
+            retry_after = rate_limit_hit('feedback_post', f'user:{user.id}')
+            if retry_after:
+                flash(rate_limit_message(retry_after), 'error')
+                return redirect('/feedback/')
             thread = FeedbackThread(user_id=user.id, subject=form_data['subject'], status='open', updated_at=datetime.utcnow())
             db.session.add(thread)
             db.session.flush()
@@ -70,6 +74,10 @@ def feedback_thread(thread_id):
             flash('Сообщение слишком длинное (максимум 5000 символов).', 'error')
             return redirect(f'/feedback/{thread.id}/')
         if body:
+            retry_after = rate_limit_hit('feedback_post', f'user:{user.id}')
+            if retry_after:
+                flash(rate_limit_message(retry_after), 'error')
+                return redirect(f'/feedback/{thread.id}/')
             db.session.add(FeedbackMessage(thread_id=thread.id, user_id=user.id, role=user.role, body=body))
             thread.updated_at = datetime.utcnow()
             if not is_moder and thread.status == 'closed':
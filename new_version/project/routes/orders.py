@@ -1,9 +1,7 @@
-import base64
 import csv
 import io
 from datetime import date, timedelta
 
-import qrcode
 from flask import Blueprint, jsonify, redirect, render_template, request, flash, make_response
 from main import (
     db, build_base_context, require_user, message_page,
@@ -11,18 +9,13 @@ from main import (
     Users, Dish, MealOrder, PaymentOperation,
     build_orders_view, parse_order_status_label, create_notification,
     is_parent_of_student, build_child_display_name,
+    qr_cache, build_order_scan_url, build_data_etag, conditional_response,
     to_int, get_cfg, datetime
 )
 
 orders_bp = Blueprint('orders', __name__)
 
-
-def generate_qr_b64(url):
-    img = qrcode.make(url)
-    buf = io.BytesIO()
-    img.save(buf, format='PNG')
-    buf.seek(0)
-    return base64.b64encode(buf.read()).decode('ascii')
+QR_MAX_AGE = 7 * 24 * 3600
 
 
 @orders_bp.route('/order/<int:order_id>/qr/')
@@ -33,9 +26,32 @@ def order_qr(order_id):
     order = MealOrder.query.get_or_404(order_id)
     if order.user_id != user.id:
         return message_page('Недостаточно прав.', user=user)
-    url = request.host_url.rstrip('/') + f'/order/{order_id}/scan/'
-    qr_b64 = generate_qr_b64(url)
-    return render_template('qr.html', **build_base_context(user, order=order, dish=order.dish, qr_b64=qr_b64))
+    scan_url = build_order_scan_url(order_id)
+    qr_url = f'/order/{order_id}/qr.png?v={qr_cache.make_etag(scan_url)[:12]}'
+    return render_template('qr.html', **build_base_context(user, order=order, dish=order.dish, qr_url=qr_url))
+
+
+@orders_bp.route('/order/<int:order_id>/qr.png')
+def order_qr_image(order_id):
+    user, failure = require_user(1)
+    if failure:
+        return '', 401
+    owner_id = db.session.query(MealOrder.user_id).filter(MealOrder.id == order_id).scalar()
+    if owner_id is None:
+        return '', 404
+    if owner_id != user.id:
+        return '', 403
+    scan_url = build_order_scan_url(order_id)
+    etag = qr_cache.make_etag(scan_url)
+    if etag in request.if_none_match:
+        response = make_response('', 304)
+    else:
+        png, etag = qr_cache.get_png(scan_url)
+        response = make_response(png)
+        response.headers['Content-Type'] = 'image/png'
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = f'private, max-age={QR_MAX_AGE}'
+    return response
 
 
 @orders_bp.route('/order/<int:order_id>/status.json')
@@ -46,7 +62,8 @@ def order_status_json(order_id):
     order = MealOrder.query.get_or_404(order_id)
     if order.user_id != user.id:
         return jsonify({'error': 'forbidden'}), 403
-    return jsonify({'status': order.status})
+    etag = build_data_etag('order_status', order.id, order.status, order.received_at)
+    return conditional_response(etag, lambda: jsonify({'status': order.status}))
 
 
 @orders_bp.route('/order/<int:order_id>/received/', methods=['POST'])
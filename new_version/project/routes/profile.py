@@ -1,9 +1,9 @@
 import time
 from datetime import date, timedelta
 
-from flask import Blueprint, g, redirect, render_template, request, flash, jsonify, make_response, session
+from flask import Blueprint, current_app, g, redirect, render_template, request, flash, jsonify, make_response, session
 from main import (
-    app, db, build_base_context, require_user, require_roles, message_page,
+    db, build_base_context, require_user, require_roles, message_page,
     Users, Session, Dish, MealOrder, PaymentOperation, ParentInvite,
     get_parent_children_rows, get_student_parent_rows, get_parent_child_link,
     build_child_display_name, ensure_parent_student_link, mark_parent_invite_used,
@@ -12,9 +12,8 @@ from main import (
     parse_order_status_label, get_student_daily_spent, create_notification,
     normalize_rule_tokens, stringify_rule_tokens,
     has_permission, role_level, is_role,
-    to_int, func, datetime, ICON_DIR,
-    save_as_avif, generate_password_hash, check_password_hash, session_cache,
-    Image,
+    to_int, func, datetime,
+    submit_avatar_image, remove_avatar_image, image_pipeline, hash_password, verify_password, session_cache,
     PendingPasswordChange, create_pending_password_change, apply_pending_password_change,
     send_email, get_cfg,
     is_valid_csrf_request,
@@ -141,8 +140,8 @@ def profile():
                 flash('Укажите текущий пароль.', 'error')
                 return redirect('/profile/')
 
-            if not check_password_hash(user.psw, current_password):
-                app.logger.warning(f'Failed password change attempt for user {user.id}')
+            if not verify_password(user.psw, current_password):
+                current_app.logger.warning(f'Failed password change attempt for user {user.id}')
                 flash('Неверный текущий пароль.', 'error')
                 return redirect('/profile/')
 
@@ -158,7 +157,7 @@ def profile():
                 flash('Новый пароль совпадает с текущим.', 'error')
                 return redirect('/profile/')
 
-            new_hash = generate_password_hash(new_password)
+            new_hash = hash_password(new_password)
             create_pending_password_change(user, new_hash)
             flash('Письмо с подтверждением отправлено на вашу почту. Перейдите по ссылке из письма для применения нового пароля.', 'success')
             return redirect('/profile/')
@@ -181,7 +180,7 @@ def profile():
 
             session_obj.is_active = False
             db.session.commit()
-            app.logger.info(f'Session {session_id} closed by user {user.id}')
+            current_app.logger.info(f'Session {session_id} closed by user {user.id}')
             flash('Сессия закрыта.', 'success')
             return redirect('/profile/')
 
@@ -194,7 +193,7 @@ def profile():
                     session_obj.is_active = False
                     closed_count += 1
             db.session.commit()
-            app.logger.info(f'User {user.id} closed {closed_count} sessions')
+            current_app.logger.info(f'User {user.id} closed {closed_count} sessions')
             flash(f'Закрыто {closed_count} сессий.', 'success')
             return redirect('/profile/')
 
@@ -511,6 +510,8 @@ def link_child_by_token(token):
 
 @profile_bp.route('/upload_avatar/', methods=['POST'])
 def upload_avatar():
+    from PIL import Image
+
     user, failure = require_user(1)
     if failure:
         return jsonify({'status': 'error', 'message': 'Требуется авторизация'}), 401
@@ -519,6 +520,13 @@ def upload_avatar():
     if not is_valid_csrf_request():
         return jsonify({'status': 'error', 'message': 'CSRF token invalid'}), 403
 
+    from main import rate_limit_hit, rate_limit_message
+    retry_after = rate_limit_hit('avatar_upload', f'user:{user.id}')
+    if retry_after:
+        response = jsonify({'status': 'error', 'message': rate_limit_message(retry_after)})
+        response.headers['Retry-After'] = str(retry_after)
+        return response, 429
+
     if 'file' not in request.files:
         return jsonify({'status': 'error', 'message': 'Файл не выбран'}), 400
 
@@ -538,7 +546,6 @@ def upload_avatar():
         if image.format and image.format.upper() not in {'JPEG', 'PNG', 'WEBP'}:
             return jsonify({'status': 'error', 'message': 'Неподдерживаемый формат файла. Допускаются JPG, PNG, WEBP'}), 400
 
-        image = image.convert('RGBA')
         width, height = image.size
 
         if width < 100 or height < 100:
@@ -546,26 +553,38 @@ def upload_avatar():
         if width > 10000 or height > 10000:
             return jsonify({'status': 'error', 'message': 'Изображение слишком большое'}), 400
 
-        side = min(width, height)
-        image = image.crop(((width - side) / 2, (height - side) / 2, (width + side) / 2, (height + side) / 2))
-        image = image.resize((512, 512), Image.LANCZOS)
-        old_avatar_path = ICON_DIR / f'{user.id}.avif'
-        if old_avatar_path.exists():
-            old_avatar_path.unlink()
-        save_as_avif(image, ICON_DIR / f'{user.id}.avif')
-        if not user.icon:
-            user.icon = True
-            db.session.commit()
-        return jsonify({'status': 'success'})
+        file.seek(0)
+        job_id = submit_avatar_image(user, file.stream)
+        return jsonify({'status': 'pending', 'job_id': job_id, 'status_url': f'/upload_status/{job_id}/'}), 202
 
     except IOError:
-        app.logger.warning(f'Invalid image file uploaded by user {user.id}')
+        current_app.logger.warning(f'Invalid image file uploaded by user {user.id}')
         return jsonify({'status': 'error', 'message': 'Невалидное изображение'}), 400
     except Exception as exc:
-        app.logger.error(f'upload_avatar error for user {user.id}: {str(exc)}')
+        current_app.logger.error(f'upload_avatar error for user {user.id}: {str(exc)}')
         return jsonify({'status': 'error', 'message': 'Ошибка при обработке изображения'}), 500
 
 
+@profile_bp.route('/upload_status/<job_id>/')
+def upload_status(job_id):
+    user, failure = require_user(1)
+    if failure:
+        return jsonify({'status': 'error', 'message': 'Требуется авторизация'}), 401
+
+    job = image_pipeline.status(job_id)
+    if not job or (job.get('owner_id') != user.id and role_level(user.role) < role_level('admin')):
+        return jsonify({'status': 'error', 'message': 'Задача не найдена'}), 404
+
+    payload = {'status': job['status']}
+    if job['status'] == 'done':
+        payload['url'] = job.get('url', '')
+    elif job['status'] == 'error':
+        payload['message'] = 'Ошибка при обработке изображения'
+    response = jsonify(payload)
+    response.headers['Cache-Control'] = 'no-store'
+    return response
+
+
 @profile_bp.route('/del_ava/', methods=['POST'])
 def del_ava():
     user, failure = require_user(1)
@@ -574,10 +593,7 @@ def del_ava():
     if not is_valid_csrf_request():
         return message_page('Недействительный CSRF-токен.', user=user)
     if user.icon:
-        avatar_path = ICON_DIR / f'{user.id}.avif'
-        if avatar_path.exists():
-            avatar_path.unlink()
-        user.icon = False
+        remove_avatar_image(user)
         db.session.commit()
     return redirect('/profile/')
 
@@ -592,13 +608,9 @@ def del_account():
             return render_template('del_account.html',
                                    **build_base_context(user, mes='Введите DELETE для подтверждения.'))
         Session.query.filter_by(user_id=user.id).update({'is_active': False})
-        for token, payload in list(session_cache.items()):
-            if payload.get('user_id') == user.id:
-                session_cache.pop(token, None)
+        session_cache.drop_user(user.id)
         if user.icon:
-            avatar_path = ICON_DIR / f'{user.id}.avif'
-            if avatar_path.exists():
-                avatar_path.unlink()
+            remove_avatar_image(user)
         user.is_active = False
         user.email = f'deleted_{user.id}_{int(time.time())}@local'
         user.name = 'Удалено'
@@ -0,0 +1,167 @@
+import argparse
+import importlib.util
+import json
+import logging
+import os
+import subprocess
+import sys
+from pathlib import Path
+from threading import Thread
+
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+
+STARTUP_PROBE = '''
+import json, sys, time
+started = time.perf_counter()
+import main
+imported = time.perf_counter()
+main.create_app()
+ready = time.perf_counter()
+try:
+    import resource
+    rss_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+except ImportError:
+    rss_kb = 0
+heavy = [name for name in ('numpy', 'PIL', 'qrcode', 'flask_mail', 'pyarrow') if name in sys.modules]
+print(json.dumps({'import': imported - started, 'ready': ready - started,
+                  'rss_kb': rss_kb, 'heavy': heavy}))
+'''
+
+
+def create_app():
+    import main
+
+    return main.create_app()
+
+
+def run_startup_benchmark(runs=5):
+    project_dir = Path(__file__).resolve().parent
+    samples = []
+    for _ in range(runs):
+        result = subprocess.run([sys.executable, '-c', STARTUP_PROBE], cwd=project_dir,
+                                capture_output=True, text=True, check=True)
+        samples.append(json.loads(result.stdout.strip().splitlines()[-1]))
+    for key in ('import', 'ready'):
+        values = sorted(sample[key] for sample in samples)
+        print(f'{key:<7} median {values[len(values) // 2] * 1000:8.1f} ms  min {values[0] * 1000:8.1f} ms')
+    rss = sorted(sample['rss_kb'] for sample in samples)
+    print(f'rss     median {rss[len(rss) // 2] / 1024:8.1f} MB  max {rss[-1] / 1024:8.1f} MB')
+    print(f"heavy modules after start: {', '.join(samples[-1]['heavy']) or '-'}")
+
+
+def resolve_settings(args):
+    import main
+
+    with main.app.app_context():
+        host = args.host or str(main.get_cfg('adress', main.DEFAULT_CFG['adress']))
+        port = args.port or main.to_int(main.get_cfg('port', main.DEFAULT_CFG['port']), main.DEFAULT_CFG['port'])
+        workers = args.workers if args.workers is not None else main.to_int(
+            main.get_cfg('server_workers', main.DEFAULT_CFG['server_workers']), main.DEFAULT_CFG['server_workers'])
+        threads = args.threads or main.to_int(
+            main.get_cfg('server_threads', main.DEFAULT_CFG['server_threads']), main.DEFAULT_CFG['server_threads'])
+    if workers <= 0:
+        workers = min(8, (os.cpu_count() or 1) * 2 + 1)
+    return host, port, max(1, workers), max(1, threads)
+
+
+def after_worker_fork(server, worker):
+    import main
+
+    with main.app.app_context():
+        main.db.engine.dispose()
+    Thread(target=main.background_jobs_leader, daemon=True).start()
+
+
+def start_launcher_console(server=None):
+    import main
+
+    main.start_interactive_console()
+
+
+def serve_gunicorn(app, host, port, workers, threads, console=False):
+    from gunicorn.app.base import BaseApplication
+
+    class CanteenApplication(BaseApplication):
+        def load_config(self):
+            self.cfg.set('bind', f'{host}:{port}')
+            self.cfg.set('workers', workers)
+            self.cfg.set('threads', threads)
+            self.cfg.set('worker_class', 'gthread')
+            self.cfg.set('preload_app', True)
+            self.cfg.set('timeout', 120)
+            self.cfg.set('graceful_timeout', 30)
+            self.cfg.set('max_requests', 5000)
+            self.cfg.set('max_requests_jitter', 500)
+            self.cfg.set('post_fork', after_worker_fork)
+            if console:
+                self.cfg.set('when_ready', start_launcher_console)
+
+        def load(self):
+            return app
+
+    CanteenApplication().run()
+
+
+def serve_waitress(app, host, port, threads):
+    import main
+    from waitress import serve
+
+    Thread(target=main.background_jobs_leader, daemon=True).start()
+    serve(app, host=host, port=port, threads=threads)
+
+
+def serve_development(app, host, port):
+    import main
+
+    Thread(target=main.background_jobs_leader, daemon=True).start()
+    app.run(debug=False, host=host, port=port, use_reloader=False, threaded=True)
+
+
+def pick_server(requested):
+    if requested != 'auto':
+        return requested
+    if os.name != 'nt' and importlib.util.find_spec('gunicorn'):
+        return 'gunicorn'
+    if importlib.util.find_spec('waitress'):
+        return 'waitress'
+    return 'dev'
+
+
+def main_cli(argv=None):
+    parser = argparse.ArgumentParser(description='Smart Canteen production server')
+    parser.add_argument('--server', choices=['auto', 'gunicorn', 'waitress', 'dev'], default='auto')
+    parser.add_argument('--host')
+    parser.add_argument('--port', type=int)
+    parser.add_argument('--workers', type=int, help='gunicorn worker processes, 0 = by CPU count')
+    parser.add_argument('--threads', type=int, help='threads per worker')
+    parser.add_argument('--console', action='store_true', help='interactive console in the launcher process')
+    parser.add_argument('--startup-benchmark', type=int, metavar='RUNS', help='measure cold start and exit')
+    args = parser.parse_args(argv)
+
+    if args.startup_benchmark:
+        run_startup_benchmark(args.startup_benchmark)
+        return
+
+    app = create_app()
+    host, port, workers, threads = resolve_settings(args)
+    server = pick_server(args.server)
+    if server == 'gunicorn' and workers > 1 and not os.environ.get('CANTEEN_STATE_BACKEND'):
+        import main
+        main.configure_shared_state('sqlite')
+    logging.getLogger('werkzeug').setLevel(logging.ERROR)
+    if args.console and server != 'gunicorn':
+        start_launcher_console()
+
+    app.logger.info(f'Starting {server} server on {host}:{port} (workers={workers}, threads={threads})')
+    if server == 'gunicorn':
+        serve_gunicorn(app, host, port, workers, threads, console=args.console)
+    elif server == 'waitress':
+        serve_waitress(app, host, port, threads)
+    else:
+        app.logger.warning('gunicorn/waitress are not installed, falling back to the development server')
+        serve_development(app, host, port)
+
+
+if __name__ == '__main__':
+    main_cli()
@@ -0,0 +1,252 @@
+import json
+import os
+import sqlite3
+import time
+from collections import OrderedDict
+from datetime import datetime
+from pathlib import Path
+from threading import Lock, local
+
+
+class MemoryBackend:
+    name = 'memory'
+
+    def __init__(self, max_items=10000):
+        self.max_items = max(1, int(max_items))
+        self._items = OrderedDict()
+        self._tags = {}
+        self._lock = Lock()
+
+    def _drop(self, key):
+        entry = self._items.pop(key, None)
+        if entry and entry[2] is not None:
+            keys = self._tags.get(entry[2])
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    self._tags.pop(entry[2], None)
+        return entry
+
+    def _store(self, key, value, ttl, tag):
+        self._drop(key)
+        expires_at = time.time() + ttl if ttl else None
+        self._items[key] = (value, expires_at, tag)
+        if tag is not None:
+            self._tags.setdefault(tag, set()).add(key)
+        while len(self._items) > self.max_items:
+            victim = next((item for item, entry in self._items.items() if entry[1] is not None), None)
+            self._drop(victim if victim is not None else next(iter(self._items)))
+
+    def _live(self, key, now):
+        entry = self._items.get(key)
+        if entry is None:
+            return None
+        if entry[1] is not None and entry[1] <= now:
+            self._drop(key)
+            return None
+        self._items.move_to_end(key)
+        return entry
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._live(key, time.time())
+        return default if entry is None else entry[0]
+
+    def set(self, key, value, ttl=None, tag=None):
+        with self._lock:
+            self._store(key, value, ttl, tag)
+
+    def delete(self, key):
+        with self._lock:
+            self._drop(key)
+
+    def incr(self, key, amount=1, ttl=None):
+        with self._lock:
+            entry = self._live(key, time.time())
+            if entry is None:
+                value = amount
+                self._store(key, value, ttl, None)
+            else:
+                value = int(entry[0]) + amount
+                self._items[key] = (value, entry[1], entry[2])
+        return value
+
+    def delete_tag(self, tag):
+        with self._lock:
+            for key in list(self._tags.get(tag, ())):
+                self._drop(key)
+
+    def clear(self, prefix=''):
+        with self._lock:
+            for key in [key for key in self._items if key.startswith(prefix)]:
+                self._drop(key)
+
+    def purge_expired(self):
+        now = time.time()
+        with self._lock:
+            expired = [key for key, entry in self._items.items() if entry[1] is not None and entry[1] <= now]
+            for key in expired:
+                self._drop(key)
+        return len(expired)
+
+    def stats(self):
+        with self._lock:
+            return {'backend': self.name, 'items': len(self._items), 'max_items': self.max_items}
+
+
+class SQLiteBackend:
+    name = 'sqlite'
+
+    def __init__(self, path, timeout=5.0):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.timeout = timeout
+        self._local = local()
+        conn = self._connect()
+        conn.execute(
+            'CREATE TABLE IF NOT EXISTS shared_state ('
+            'key TEXT PRIMARY KEY, value TEXT NOT NULL, tag TEXT, expires_at REAL)'
+        )
+        conn.execute('CREATE INDEX IF NOT EXISTS ix_shared_state_tag ON shared_state (tag)')
+        conn.execute('CREATE INDEX IF NOT EXISTS ix_shared_state_expires ON shared_state (expires_at)')
+
+    def _connect(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(str(self.path), timeout=self.timeout, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def get(self, key, default=None):
+        row = self._connect().execute(
+            'SELECT value FROM shared_state WHERE key = ? AND (expires_at IS NULL OR expires_at > ?)',
+            (key, time.time()),
+        ).fetchone()
+        return default if row is None else json.loads(row[0])
+
+    def set(self, key, value, ttl=None, tag=None):
+        expires_at = time.time() + ttl if ttl else None
+        self._connect().execute(
+            'INSERT OR REPLACE INTO shared_state (key, value, tag, expires_at) VALUES (?, ?, ?, ?)',
+            (key, json.dumps(value), tag, expires_at),
+        )
+
+    def delete(self, key):
+        self._connect().execute('DELETE FROM shared_state WHERE key = ?', (key,))
+
+    def incr(self, key, amount=1, ttl=None):
+        now = time.time()
+        conn = self._connect()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            row = conn.execute(
+                'SELECT value FROM shared_state WHERE key = ? AND (expires_at IS NULL OR expires_at > ?)',
+                (key, now),
+            ).fetchone()
+            if row is None:
+                value = amount
+                conn.execute(
+                    'INSERT OR REPLACE INTO shared_state (key, value, tag, expires_at) VALUES (?, ?, NULL, ?)',
+                    (key, json.dumps(value), now + ttl if ttl else None),
+                )
+            else:
+                value = int(json.loads(row[0])) + amount
+                conn.execute('UPDATE shared_state SET value = ? WHERE key = ?', (json.dumps(value), key))
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+        return value
+
+    def delete_tag(self, tag):
+        self._connect().execute('DELETE FROM shared_state WHERE tag = ?', (tag,))
+
+    def clear(self, prefix=''):
+        escaped = prefix.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+        self._connect().execute("DELETE FROM shared_state WHERE key LIKE ? ESCAPE '\\'", (escaped + '%',))
+
+    def purge_expired(self):
+        cursor = self._connect().execute(
+            'DELETE FROM shared_state WHERE expires_at IS NOT NULL AND expires_at <= ?', (time.time(),)
+        )
+        return cursor.rowcount
+
+    def stats(self):
+        count = self._connect().execute('SELECT COUNT(*) FROM shared_state').fetchone()[0]
+        return {'backend': self.name, 'items': count, 'path': str(self.path)}
+
+
+BACKENDS = {
+    'memory': MemoryBackend,
+    'sqlite': SQLiteBackend,
+}
+
+
+class SharedState:
+    def __init__(self, backend=None):
+        self.backend = backend or MemoryBackend()
+
+    def configure(self, kind, **options):
+        if kind not in BACKENDS:
+            raise ValueError(f'Unknown shared state backend: {kind}')
+        self.backend = BACKENDS[kind](**options)
+        return self.backend
+
+    def get(self, key, default=None):
+        return self.backend.get(key, default)
+
+    def set(self, key, value, ttl=None, tag=None):
+        self.backend.set(key, value, ttl=ttl, tag=tag)
+
+    def delete(self, key):
+        self.backend.delete(key)
+
+    def incr(self, key, amount=1, ttl=None):
+        return self.backend.incr(key, amount, ttl=ttl)
+
+    def delete_tag(self, tag):
+        self.backend.delete_tag(tag)
+
+    def clear(self, prefix=''):
+        self.backend.clear(prefix)
+
+    def purge_expired(self):
+        return self.backend.purge_expired()
+
+    def stats(self):
+        return self.backend.stats()
+
+
+class SessionCache:
+    def __init__(self, state, prefix='session:'):
+        self.state = state
+        self.prefix = prefix
+
+    def get(self, token):
+        payload = self.state.get(self.prefix + token)
+        if not payload:
+            return None
+        expires_at = payload.get('expires_at')
+        return {
+            'user_id': payload.get('user_id'),
+            'expires_at': datetime.fromisoformat(expires_at) if expires_at else None,
+        }
+
+    def put(self, token, user_id, expires_at):
+        ttl = None
+        if expires_at:
+            ttl = max(1.0, (expires_at - datetime.utcnow()).total_seconds())
+        payload = {'user_id': user_id, 'expires_at': expires_at.isoformat() if expires_at else None}
+        self.state.set(self.prefix + token, payload, ttl=ttl, tag=f'{self.prefix}user:{user_id}')
+
+    def pop(self, token):
+        self.state.delete(self.prefix + token)
+
+    def drop_user(self, user_id):
+        self.state.delete_tag(f'{self.prefix}user:{user_id}')
+
+    def clear(self):
+        self.state.clear(self.prefix)
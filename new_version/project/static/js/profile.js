@@ -3,6 +3,21 @@ document.addEventListener('DOMContentLoaded', () => {
     if (!upload) return;
     const csrfToken = document.querySelector('meta[name="csrf-token"]')?.getAttribute('content') || '';
 
+    const waitForImage = (statusUrl, attempt = 0) => {
+        fetch(statusUrl, { cache: 'no-store' })
+            .then((response) => response.json())
+            .then((data) => {
+                if (data.status === 'done') {
+                    window.location.reload();
+                } else if (data.status === 'pending' && attempt < 60) {
+                    setTimeout(() => waitForImage(statusUrl, attempt + 1), Math.min(500 + attempt * 250, 2000));
+                } else {
+                    alert(data.message || 'Ошибка при обработке изображения');
+                }
+            })
+            .catch(() => alert('Ошибка при обработке изображения'));
+    };
+
     upload.addEventListener('change', () => {
         const file = upload.files && upload.files[0];
         if (!file) return;
@@ -17,8 +32,8 @@ document.addEventListener('DOMContentLoaded', () => {
         })
             .then((response) => response.json())
             .then((data) => {
-                if (data.status === 'success') {
-                    window.location.reload();
+                if (data.status === 'pending') {
+                    waitForImage(data.status_url);
                     return;
                 }
                 alert(data.message || 'Ошибка загрузки');
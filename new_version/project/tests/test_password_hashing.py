@@ -0,0 +1,24 @@
+import os
+
+import pytest
+
+from password_hashing import PasswordHasher
+
+
+@pytest.mark.skipif(not hasattr(os, 'fork'), reason='requires os.fork')
+def test_hasher_works_in_forked_child():
+    hasher = PasswordHasher(method='pbkdf2:sha256:100000', max_workers=1, max_queue=0, timeout=5.0)
+    pwhash = hasher.hash('secret')
+    assert hasher.verify(pwhash, 'secret')
+
+    pid = os.fork()
+    if pid == 0:
+        code = 1
+        try:
+            ok = hasher.verify(pwhash, 'secret') and hasher.verify(hasher.hash('other'), 'other')
+            code = 0 if ok and hasher.stats()['in_flight'] == 0 else 1
+        finally:
+            os._exit(code)
+    _, status = os.waitpid(pid, 0)
+    assert os.waitstatus_to_exitcode(status) == 0
+    assert hasher.stats()['completed'] == 2
@@ -0,0 +1,59 @@
+import csv
+import io
+import zipfile
+
+
+class _ChunkSink:
+    def __init__(self):
+        self.chunks = []
+        self.size = 0
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        self.size += len(data)
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data = b''.join(self.chunks)
+        self.chunks = []
+        self.size = 0
+        return data
+
+
+def stream_zip(entries, chunk_size=64 * 1024):
+    sink = _ChunkSink()
+    with zipfile.ZipFile(sink, 'w', compression=zipfile.ZIP_DEFLATED) as zf:
+        for name, parts in entries:
+            with zf.open(name, 'w', force_zip64=True) as fh:
+                for part in parts:
+                    fh.write(part)
+                    if sink.size >= chunk_size:
+                        yield sink.drain()
+            if sink.size:
+                yield sink.drain()
+    tail = sink.drain()
+    if tail:
+        yield tail
+
+
+def iter_csv(header, rows, delimiter=';', batch_size=500):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, delimiter=delimiter)
+    writer.writerow(header)
+    yield b'\xef\xbb\xbf' + buffer.getvalue().encode('utf-8')
+    buffer.seek(0)
+    buffer.truncate(0)
+    pending = 0
+    for row in rows:
+        writer.writerow(row)
+        pending += 1
+        if pending >= batch_size:
+            yield buffer.getvalue().encode('utf-8')
+            buffer.seek(0)
+            buffer.truncate(0)
+            pending = 0
+    if pending:
+        yield buffer.getvalue().encode('utf-8')